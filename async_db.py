@@ -0,0 +1,233 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import database as db
+from storage_session import current_session
+
+logger = logging.getLogger('async_db')
+
+# One worker per pooled connection: more threads would only queue inside the pool
+DB_EXECUTOR_WORKERS = db.DB_POOL_MAX_SIZE
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
+# A session keeps its pooled connection until it ends. If every connection
+# were held by a session, workers would block waiting for one while those
+# sessions wait for a worker, so one connection is always left for the rest.
+MAX_CONCURRENT_SESSIONS = max(1, DB_EXECUTOR_WORKERS - 1)
+_session_slots = None
+
+# With a single-writer backend, sessions queue here on the loop for their
+# turn to run. Waiting for the write lock inside a pool worker instead would
+# let waiting sessions take every worker from the session holding it.
+_writer = None
+# Session -> task acquiring _writer for it, done once the session holds it
+_writer_turns = {}
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'calls': 0,
+    'errors': 0,
+    'queued': 0,        # Submitted calls waiting for a free worker
+    'running': 0,
+    'max_queued': 0,
+    'total_wait_ms': 0.0,
+    'max_wait_ms': 0.0,
+    'total_run_ms': 0.0,
+    'max_run_ms': 0.0
+}
+# Function name -> {'calls', 'total_ms', 'max_ms'}
+_function_metrics = {}
+
+
+def _record_start(wait_ms):
+    with _metrics_lock:
+        _metrics['queued'] -= 1
+        _metrics['running'] += 1
+        _metrics['total_wait_ms'] += wait_ms
+        _metrics['max_wait_ms'] = max(_metrics['max_wait_ms'], wait_ms)
+
+
+def _record_end(name, run_ms, failed):
+    with _metrics_lock:
+        _metrics['running'] -= 1
+        _metrics['calls'] += 1
+        _metrics['total_run_ms'] += run_ms
+        _metrics['max_run_ms'] = max(_metrics['max_run_ms'], run_ms)
+        if failed:
+            _metrics['errors'] += 1
+        stats = _function_metrics.setdefault(name, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['calls'] += 1
+        stats['total_ms'] += run_ms
+        stats['max_ms'] = max(stats['max_ms'], run_ms)
+
+
+async def _writer_turn(active):
+    global _writer
+    if _writer is None:
+        _writer = asyncio.Lock()
+    turn = _writer_turns.get(active)
+    if turn is None:
+        # One acquisition per session, however many of its calls are gathered
+        turn = _writer_turns[active] = asyncio.ensure_future(_writer.acquire())
+    await asyncio.shield(turn)
+
+
+def _end_writer_turn(active):
+    turn = _writer_turns.pop(active, None)
+    if turn is not None and not turn.cancel():
+        _writer.release()
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking database function on the DB thread pool and await its result.
+
+    The caller's context variables are copied into the worker thread. With a
+    single-writer backend, a call in a session first waits for the session's
+    turn to write.
+    """
+    if db.SINGLE_WRITER:
+        active = current_session.get()
+        if active is not None and not active.closed:
+            await _writer_turn(active)
+
+    context = contextvars.copy_context()
+    submitted = time.perf_counter()
+    with _metrics_lock:
+        _metrics['queued'] += 1
+        _metrics['max_queued'] = max(_metrics['max_queued'], _metrics['queued'])
+
+    def call():
+        started = time.perf_counter()
+        _record_start((started - submitted) * 1000)
+        failed = False
+        try:
+            return context.run(func, *args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _record_end(func.__name__, (time.perf_counter() - started) * 1000, failed)
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+@asynccontextmanager
+async def session():
+    """Share one connection and transaction between every database call in the block.
+
+    Calls made with run() (or the async_db.<name> wrappers) inside the block
+    see the session through the copied context. The transaction is committed
+    when the block ends, or rolled back if it raised or any call failed. Inside
+    an existing session this just joins it.
+    """
+    active = current_session.get()
+    if active is not None and not active.closed:
+        yield active
+        return
+
+    global _session_slots
+    if _session_slots is None:
+        _session_slots = asyncio.Semaphore(MAX_CONCURRENT_SESSIONS)
+
+    async with _session_slots:
+        new_session = db.new_session()
+        token = current_session.set(new_session)
+        try:
+            yield new_session
+        except BaseException:
+            new_session.failed = True
+            raise
+        finally:
+            current_session.reset(token)
+            try:
+                if new_session.conn is not None:
+                    await run(new_session.close)
+                else:
+                    new_session.close()
+            finally:
+                _end_writer_turn(new_session)
+
+
+async def commit():
+    """Commit the current session's work so far and give its connection back to the pool.
+
+    The session carries on and takes a connection again on its next call.
+    Called before waiting on the network, so no pooled connection sits idle in
+    a transaction meanwhile, and nothing is announced before it is committed.
+    """
+    active = current_session.get()
+    if active is not None and not active.closed and active.conn is not None:
+        await run(active.commit)
+        _end_writer_turn(active)
+
+
+async def outside_session(coroutine):
+    """Await coroutine with no database session, for background tasks started inside one.
+
+    A task copies its creator's context, session included, and can still be
+    running after that session has ended. Awaited directly, it runs work
+    that manages its own transactions without touching the caller's session.
+    """
+    token = current_session.set(None)
+    try:
+        return await coroutine
+    finally:
+        current_session.reset(token)
+
+
+def _wrap(func):
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def __getattr__(name):
+    """async_db.<name>(...) is an awaitable version of database.<name>(...)."""
+    func = getattr(db, name, None)
+    if not callable(func) or name.startswith('_'):
+        raise AttributeError(f"module 'async_db' has no attribute '{name}'")
+    wrapper = _wrap(func)
+    globals()[name] = wrapper
+    return wrapper
+
+
+def get_metrics():
+    """Return a snapshot of the pool metrics, with mean wait and run times."""
+    with _metrics_lock:
+        snapshot = dict(_metrics)
+        functions = {name: dict(stats) for name, stats in _function_metrics.items()}
+    started = snapshot['calls'] + snapshot['running']
+    snapshot['mean_wait_ms'] = snapshot['total_wait_ms'] / started if started else 0.0
+    snapshot['mean_run_ms'] = snapshot['total_run_ms'] / snapshot['calls'] if snapshot['calls'] else 0.0
+    snapshot['workers'] = DB_EXECUTOR_WORKERS
+    snapshot['functions'] = functions
+    return snapshot
+
+
+def metrics_report(limit=10):
+    """Return report lines: pool totals, then the slowest functions by total time."""
+    metrics = get_metrics()
+    lines = [
+        f"Workers: {metrics['workers']}, running {metrics['running']}, queued {metrics['queued']} "
+        f"(max {metrics['max_queued']})",
+        f"Calls: {metrics['calls']}, errors {metrics['errors']}",
+        f"Wait: mean {metrics['mean_wait_ms']:.1f} ms, max {metrics['max_wait_ms']:.1f} ms",
+        f"Run: mean {metrics['mean_run_ms']:.1f} ms, max {metrics['max_run_ms']:.1f} ms"
+    ]
+    functions = sorted(metrics['functions'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    for name, stats in functions[:limit]:
+        lines.append(f"{name}: {stats['calls']} calls, mean {stats['total_ms'] / stats['calls']:.1f} ms, "
+                     f"max {stats['max_ms']:.1f} ms")
+    return lines
+
+
+def shutdown():
+    """Wait for running calls to finish and stop the worker threads."""
+    _executor.shutdown(wait=True)
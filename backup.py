@@ -0,0 +1,43 @@
+"""Take, list and restore database backups.
+
+Usage:
+    python backup.py                  take a snapshot now and rotate old ones
+    python backup.py --list           list the snapshots in BACKUP_DIR
+    python backup.py --restore PATH   load a snapshot into an empty database
+"""
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import database as db
+import database_backup
+
+
+def main():
+    args = sys.argv[1:]
+    db.print_db_info()
+
+    if '--list' in args:
+        for backup in database_backup.list_backups():
+            rows = sum(table['rows'] for table in backup['tables'].values())
+            print(f"{backup['path']}  {rows} rows  {backup['bytes'] / 1024 / 1024:.1f} MB  "
+                  f"{backup['duration_seconds']:.1f} s")
+        return 0
+
+    if '--restore' in args:
+        index = args.index('--restore') + 1
+        if index >= len(args):
+            print(__doc__)
+            return 1
+        for table, rows in database_backup.restore_backup(args[index]).items():
+            print(f"  {table}: {rows} rows")
+        return 0
+
+    backup = database_backup.create_backup()
+    print(f"Backup written to {backup['path']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Benchmark bot.py handlers against the in-memory storage backend.
+
+Runs find_matching_donors and handle_donation_acceptance with a fake Telegram
+bot, so the timings are bot, matching and async_db overhead without any
+database or network latency.
+
+Usage: python benchmarks/bench_handlers.py [donor_count] [request_count]
+
+Set BENCH_DATABASE_URL to run the same workload against another backend
+(e.g. sqlite:////tmp/bench.db). DATABASE_URL is ignored so the benchmark
+never writes to a configured production database.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import statistics
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', 'memory://')
+
+import bot
+import async_db as adb
+import database as db
+from bench_matching import make_donors
+from locations import BANGLADESH_DISTRICTS
+from matching import BLOOD_GROUPS
+
+
+class FakeBot:
+    """Accepts every Bot API call the handlers make and counts messages."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(username=f"user{chat_id}", first_name="Bench")
+
+
+class FakeJobQueue:
+    """Drops scheduled escalation waves, so each match sends only its first wave."""
+
+    def run_once(self, callback, when, data=None, name=None):
+        pass
+
+    def get_jobs_by_name(self, name):
+        return []
+
+
+class FakeApplication:
+    """Runs background tasks (the admin summary) like Application, keeping them to await at the end."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def create_task(self, coroutine, update=None):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.append(task)
+        return task
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+def make_context(fake_bot):
+    return SimpleNamespace(bot=fake_bot, job_queue=FakeJobQueue(), application=FakeApplication(), user_data={})
+
+
+def make_callback_update():
+    message = SimpleNamespace(reply_text=_noop)
+    return SimpleNamespace(callback_query=SimpleNamespace(edit_message_text=_noop, message=message))
+
+
+def seed(donor_count, request_count, seed=42):
+    """Store synthetic donors and active requests. Returns (donor ids, request ids)."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    donor_ids = []
+    for row in make_donors(donor_count, seed):
+        donor_ids.append(db.save_donor({
+            'telegram_id': row['telegram_id'],
+            'name': f"Donor {row['id']}",
+            'age': str(rng.randint(18, 60)),
+            'phone': f"017{row['id']:08d}",
+            'district': row['district'],
+            'division': row['division'],
+            'area': 'Bench',
+            'blood_group': row['blood_group'],
+            'gender': rng.choice(['Male', 'Female']),
+            'registration_date': now
+        }))
+        if row['last_donation_at']:
+            db.update_donor(donor_ids[-1], {'last_donation_at': row['last_donation_at']})
+
+    locations = [(division, district) for division, districts in BANGLADESH_DISTRICTS.items()
+                 for district in districts]
+    request_ids = []
+    for number in range(request_count):
+        division, district = rng.choice(locations)
+        request_ids.append(db.save_request({
+            'telegram_id': 900000000 + number,
+            'name': f"Patient {number}",
+            'age': str(rng.randint(1, 90)),
+            'hospital_name': 'Bench Hospital',
+            'hospital_address': 'Bench Road',
+            'area': 'Bench',
+            'division': division,
+            'district': district,
+            'urgency': rng.choice(['Urgent (within 24 hours)', 'Within 3 days', 'Within a week']),
+            'phone': f"018{number:08d}",
+            'blood_group': rng.choice(BLOOD_GROUPS),
+            'request_date': now,
+            'status': 'active'
+        }))
+    return donor_ids, request_ids
+
+
+async def timed(handler, *args):
+    """Run one handler call as its own unit of work, like UnitOfWorkApplication. Returns ms."""
+    started = time.perf_counter()
+    async with adb.session():
+        await handler(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def report(name, timings, elapsed):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name}: {len(timings)} calls, {len(timings) / elapsed:.0f}/s, "
+          f"median {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms, max {timings[-1]:.2f} ms")
+
+
+async def run(donor_count, request_count, concurrency):
+    rng = random.Random(7)
+    if not db.ensure_schema():
+        raise SystemExit("Could not set up the database schema")
+
+    started = time.perf_counter()
+    donor_ids, request_ids = seed(donor_count, request_count)
+    print(f"backend: {db.backend.__name__}")
+    print(f"seed: {donor_count} donors, {request_count} requests in {time.perf_counter() - started:.2f} s")
+
+    fake_bot = FakeBot()
+    context = make_context(fake_bot)
+
+    # The first match builds the donor index; time that separately
+    started = time.perf_counter()
+    bot.matching.get_donor_index()
+    print(f"donor index build: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(handler, *args):
+        async with semaphore:
+            return await timed(handler, *args)
+
+    started = time.perf_counter()
+    timings = await asyncio.gather(*(limited(bot.find_matching_donors, context, str(request_id))
+                                     for request_id in request_ids))
+    report("find_matching_donors", timings, time.perf_counter() - started)
+    print(f"  notifications sent: {fake_bot.sent}")
+
+    pairs = [(str(rng.choice(request_ids)), str(rng.choice(donor_ids))) for _ in range(request_count)]
+    started = time.perf_counter()
+    timings = await asyncio.gather(*(limited(bot.handle_donation_acceptance, make_callback_update(), context,
+                                             request_id, donor_id)
+                                     for request_id, donor_id in pairs))
+    report("handle_donation_acceptance", timings, time.perf_counter() - started)
+    await asyncio.gather(*context.application.tasks)
+
+    print("async_db:")
+    for line in adb.metrics_report(limit=5):
+        print(f"  {line}")
+
+
+def main():
+    donor_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    request_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    concurrency = int(os.getenv('BENCH_CONCURRENCY', '20'))
+
+    # Per-notification INFO logging would dominate the output
+    logging.disable(logging.INFO)
+    asyncio.run(run(donor_count, request_count, concurrency))
+    adb.shutdown()
+
+
+if __name__ == '__main__':
+    main()
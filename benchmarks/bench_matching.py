@@ -0,0 +1,62 @@
+"""Benchmark donor ranking with the columnar donor index.
+
+Usage: python benchmarks/bench_matching.py [donor_count]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from locations import BANGLADESH_DISTRICTS, DIVISION_CODES, DISTRICT_CODES
+from matching import BLOOD_GROUPS, DonorIndex
+
+
+def make_donors(count, seed=42):
+    """Generate synthetic donor rows shaped like get_donor_index_rows()."""
+    rng = random.Random(seed)
+    locations = [(division, district) for division, districts in BANGLADESH_DISTRICTS.items()
+                 for district in districts]
+    now = datetime.now()
+    donors = []
+    for donor_id in range(1, count + 1):
+        division, district = rng.choice(locations)
+        donors.append({
+            'id': donor_id,
+            'telegram_id': 100000000 + donor_id,
+            'blood_group': rng.choice(BLOOD_GROUPS),
+            'division': division.lower(),
+            'district': district.lower(),
+            'division_code': DIVISION_CODES[division],
+            'district_code': DISTRICT_CODES[district],
+            'is_restricted': rng.random() < 0.01,
+            # About a third of donors have donated at some point in the last year
+            'last_donation_at': now - timedelta(days=rng.randint(0, 365)) if rng.random() < 0.33 else None,
+        })
+    return donors
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    donors = make_donors(count)
+
+    started = time.perf_counter()
+    index = DonorIndex(donors)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    timings = []
+    for blood_group in BLOOD_GROUPS:
+        started = time.perf_counter()
+        positions, tiers, distances = index.rank(blood_group, DIVISION_CODES['Dhaka'], DISTRICT_CODES['Gazipur'])
+        timings.append((time.perf_counter() - started) * 1000)
+
+    print(f"donors: {count}")
+    print(f"index build: {build_ms:.1f} ms")
+    print(f"rank (per request): min {min(timings):.2f} ms, max {max(timings):.2f} ms, "
+          f"mean {sum(timings) / len(timings):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
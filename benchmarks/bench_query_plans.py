@@ -0,0 +1,231 @@
+"""Check that the hot request/donation reads are served by indexes at scale.
+
+Seeds a scratch database with many closed requests and declined donations,
+runs the hot storage functions, records the SQL they execute and EXPLAINs
+it. Exits with status 1 if a statement that filters on status scans a
+whole hot table instead of using an index. Unfiltered aggregates (counts,
+the donor rank) are reported but not failed.
+
+Usage: python benchmarks/bench_query_plans.py [request_count]
+
+Runs against a temporary SQLite file unless BENCH_DATABASE_URL points at an
+empty scratch Postgres database. DATABASE_URL is ignored.
+"""
+import os
+import sys
+import re
+import json
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCRATCH_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'bench_query_plans.sqlite3')
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{SCRATCH_SQLITE_PATH}')
+
+import database as db
+from locations import BANGLADESH_DISTRICTS, DIVISION_CODES, DISTRICT_CODES
+from matching import BLOOD_GROUPS
+
+# Large tables whose status-filtered reads must never be full scans
+HOT_TABLES = ('requests', 'donations')
+# The predicates the partial indexes cover
+HOT_PREDICATE = re.compile(r"status\s*(=|IN\b)", re.IGNORECASE)
+
+# Share of requests still active, and donation status mix
+ACTIVE_REQUEST_SHARE = 0.03
+DONATION_STATUSES = ['declined'] * 5 + ['pending'] + ['completed'] * 4
+
+
+class RecordingCursor:
+    """Cursor proxy that records every (sql, params) it executes."""
+
+    def __init__(self, cursor, statements):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_statements', statements)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def execute(self, sql, params=()):
+        self._statements.append((sql, params))
+        return self._cursor.execute(sql, params)
+
+
+class RecordingConnection:
+    def __init__(self, conn):
+        self._conn = conn
+        self.statements = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self._conn.cursor(*args, **kwargs), self.statements)
+
+
+def is_postgres():
+    return db.backend.__name__ == 'storage_postgres'
+
+
+def bulk_insert(cursor, table, columns, rows):
+    if is_postgres():
+        from psycopg2.extras import execute_values
+        execute_values(cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", rows, page_size=5000)
+    else:
+        placeholders = ', '.join(['?'] * len(columns))
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+
+def seed(request_count, seed=42):
+    """Fill the scratch database. Returns (a donor id, an active request id)."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    locations = [(division, district) for division, districts in BANGLADESH_DISTRICTS.items()
+                 for district in districts]
+    donor_count = max(1, request_count // 4)
+
+    donors = []
+    for donor_id in range(1, donor_count + 1):
+        division, district = rng.choice(locations)
+        donors.append((donor_id, 100000000 + donor_id, f"Donor {donor_id}", rng.choice(BLOOD_GROUPS),
+                       division, district, DIVISION_CODES[division], DISTRICT_CODES[district], now, False, False))
+
+    requests = []
+    for request_id in range(1, request_count + 1):
+        division, district = rng.choice(locations)
+        status = 'active' if rng.random() < ACTIVE_REQUEST_SHARE else rng.choice(['fulfilled', 'inactive', 'expired'])
+        requests.append((request_id, 900000000 + request_id, f"Patient {request_id}", rng.choice(BLOOD_GROUPS),
+                         division, district, DIVISION_CODES[division], DISTRICT_CODES[district],
+                         rng.choice(['Urgent', 'High', 'Medium', 'Low']),
+                         now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)), status))
+
+    donations = []
+    for donation_id in range(1, request_count * 2 + 1):
+        donations.append((donation_id, rng.randint(1, request_count), rng.randint(1, donor_count),
+                          rng.choice(DONATION_STATUSES), now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))))
+
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM requests')
+    if cursor.fetchone()[0]:
+        raise SystemExit("The benchmark database already has requests; point BENCH_DATABASE_URL at an empty one")
+    bulk_insert(cursor, 'donors', ('id', 'telegram_id', 'name', 'blood_group', 'division', 'district',
+                                   'division_code', 'district_code', 'registration_date', 'is_restricted',
+                                   'is_unreachable'), donors)
+    bulk_insert(cursor, 'requests', ('id', 'telegram_id', 'name', 'blood_group', 'division', 'district',
+                                     'division_code', 'district_code', 'urgency', 'request_date', 'status'), requests)
+    bulk_insert(cursor, 'donations', ('id', 'request_id', 'donor_id', 'status', 'acceptance_date'), donations)
+    conn.commit()
+    # Planner statistics, without them the planner has nothing to compare index and table scans with
+    cursor.execute('ANALYZE')
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    active_request_id = next(row[0] for row in requests if row[-1] == 'active')
+    return rng.randint(1, donor_count), active_request_id
+
+
+def record(func, *args):
+    """Run a storage function in its own session and return the statements it executed."""
+    with db.session() as active:
+        recorder = RecordingConnection(active.connection())
+        active.conn = recorder
+        func(*args)
+        active.conn = recorder._conn
+    return recorder.statements
+
+
+def explain(sql, params):
+    """Return (plan lines, names of hot tables read by a full scan with a filter)."""
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    full_scans = []
+    lines = []
+    if is_postgres():
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        nodes = [(plan[0]['Plan'], 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            relation = node.get('Relation Name')
+            line = '  ' * depth + node['Node Type']
+            if relation:
+                line += f" on {relation}"
+            if 'Index Name' in node:
+                line += f" using {node['Index Name']}"
+            lines.append(line)
+            if node['Node Type'] == 'Seq Scan' and relation in HOT_TABLES and 'Filter' in node:
+                full_scans.append(relation)
+            nodes.extend((child, depth + 1) for child in reversed(node.get('Plans', [])))
+    else:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        for _, _, _, detail in cursor.fetchall():
+            lines.append(detail)
+            words = detail.split()
+            # SQLite does not show filters, so a scan only counts if the statement has a hot predicate
+            if words[0] == 'SCAN' and words[1] in HOT_TABLES and 'INDEX' not in words and HOT_PREDICATE.search(sql):
+                full_scans.append(words[1])
+    cursor.close()
+    conn.close()
+    return lines, full_scans
+
+
+def main():
+    request_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    if not is_postgres() and os.path.exists(SCRATCH_SQLITE_PATH):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(SCRATCH_SQLITE_PATH + suffix):
+                os.remove(SCRATCH_SQLITE_PATH + suffix)
+    if not db.ensure_schema():
+        raise SystemExit("Could not set up the database schema")
+
+    started = time.perf_counter()
+    donor_id, request_id = seed(request_count)
+    print(f"backend: {db.backend.__name__}")
+    print(f"seed: {request_count} requests, {request_count * 2} donations in {time.perf_counter() - started:.1f} s")
+
+    checks = [
+        ('get_active_requests', db.get_active_requests),
+        ('get_requests_by_location (district)', db.get_requests_by_location, 'Dhaka', 'Gazipur'),
+        ('get_requests_by_location (division)', db.get_requests_by_location, 'Dhaka'),
+        ('get_operations_stats', db.get_operations_stats),
+        ('get_recent_operations', db.get_recent_operations, 10),
+        ('get_donor_stats', db.get_donor_stats, donor_id),
+        ('count_request_acceptances', db.count_request_acceptances, request_id)
+    ]
+
+    failures = 0
+    for name, func, *args in checks:
+        started = time.perf_counter()
+        statements = record(func, *args)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"\n{name}: {elapsed_ms:.1f} ms")
+        for sql, params in statements:
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            try:
+                lines, full_scans = explain(sql, params)
+            except Exception as e:
+                failures += 1
+                print(f"  FAIL could not explain: {e}")
+                continue
+            status = 'FAIL' if full_scans else 'ok'
+            failures += bool(full_scans)
+            print(f"  {status} {' '.join(sql.split())[:100]}")
+            for line in lines:
+                print(f"      {line}")
+
+    print(f"\n{'All hot queries use indexes' if not failures else f'{failures} statements scan hot tables'}")
+    db.close_pool()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,37 @@
 import logging
 import asyncio
 import os
+import time
+import shutil
+import tempfile
+
+# Startup time is measured from here, so the log includes the imports below
+STARTUP_STARTED_AT = time.perf_counter()
 from datetime import datetime
 from dotenv import load_dotenv
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, \
-    CallbackQueryHandler
+    CallbackQueryHandler, TypeHandler, ApplicationHandlerStop
 from telegram import Update
+from telegram.request import HTTPXRequest
 from telegram.ext import ContextTypes
 import json
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from locations import BANGLADESH_DIVISIONS, BANGLADESH_DISTRICTS, ALL_DISTRICTS, get_division_for_district
+from locations import BANGLADESH_DIVISIONS, BANGLADESH_DISTRICTS, ALL_DISTRICTS, get_division_for_district, get_division_name, get_location_codes
 import telegram
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
 import database as db
-from database import initialize_database
-from database import (save_broadcast_message, update_broadcast_recipient_count,
-                     get_recent_broadcasts, save_personalized_message, store_support_message,get_support_messages,record_admin_reply)
+import async_db as adb
+import matching
+import chat_cache
+import callback_router
+import notification_limits
+import request_lifecycle
+import data_export
+import donor_import
+import database_backup
+from persistence import PostgresPersistence
+from storage_session import current_session
+
+STARTUP_IMPORTED_AT = time.perf_counter()
 
 
 load_dotenv()
@@ -118,9 +133,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
 
     # Check if user is already registered as a donor
-    donor = db.get_donor_by_telegram_id(user.id)
+    donor = await adb.get_donor_by_telegram_id(user.id)
 
     if donor:
+        # A donor who talks to the bot again can be messaged again
+        if donor.get('is_unreachable') and await adb.mark_donor_reachable(user.id):
+            logger.info(f"Donor {donor['id']} is reachable again")
+            matching.invalidate_donor_index()
+
         # User is already a donor, show donor dashboard and options
         keyboard = [
             [InlineKeyboardButton("📊 My Donor Dashboard", callback_data='open_donor_dashboard')],
@@ -188,9 +208,10 @@ async def direct_donor_division(update: Update, context: ContextTypes.DEFAULT_TY
     division = update.message.text
     context.user_data['donor_division'] = division
 
-    # Get districts for this division
-    if division in BANGLADESH_DIVISIONS:
-        districts = BANGLADESH_DISTRICTS[division]
+    # Get districts for this division, accepting alternate spellings
+    canonical_division = get_division_name(division)
+    if canonical_division:
+        districts = BANGLADESH_DISTRICTS[canonical_division]
 
         # Create keyboard with districts
         keyboard = []
@@ -231,7 +252,8 @@ async def direct_donor_district(update: Update, context: ContextTypes.DEFAULT_TY
     }
 
     # Save donor to database
-    donor_id = db.save_donor(donor_data)
+    donor_id = await adb.save_donor(donor_data)
+    matching.invalidate_donor_index()
 
     # Show main menu with options
     keyboard = [
@@ -251,7 +273,7 @@ async def direct_donor_district(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
     # Find and show matching requests immediately
-    donor = db.get_donor_by_telegram_id(user_id)
+    donor = await adb.get_donor_by_telegram_id(user_id)
     if donor:
         await show_recent_matching_requests(update, context, donor)
 
@@ -261,7 +283,7 @@ async def direct_donor_district(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def view_donors(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Display a list of registered donors with limited information."""
-    donors = db.get_all_donors()
+    donors = await adb.get_all_donors()
 
     if not donors:
         if hasattr(update, 'callback_query'):
@@ -300,6 +322,7 @@ async def show_recent_matching_requests(update: Update, context: ContextTypes.DE
         blood_group = donor['blood_group']
         division = donor['division'].strip().lower()
         district = donor['district'].strip().lower()
+        _, district_code = get_location_codes(division, district)
 
         # Get compatible blood groups for matching
         compatible_blood_groups = get_compatible_recipients(blood_group)
@@ -308,7 +331,7 @@ async def show_recent_matching_requests(update: Update, context: ContextTypes.DE
         matching_requests = []
 
         # First check for exact location match (same district)
-        exact_match_requests = db.get_requests_by_location(division, district)
+        exact_match_requests = await adb.get_requests_by_location(division, district)
         for req in exact_match_requests:
             if req['blood_group'] in compatible_blood_groups:
                 req['match_type'] = 'exact'
@@ -316,9 +339,13 @@ async def show_recent_matching_requests(update: Update, context: ContextTypes.DE
 
         # Then check division-level match if we don't have enough
         if len(matching_requests) < 3:
-            division_match_requests = db.get_requests_by_location(division)
+            division_match_requests = await adb.get_requests_by_location(division)
             for req in division_match_requests:
-                if req['district'].strip().lower() != district and req['blood_group'] in compatible_blood_groups:
+                if req.get('district_code') is not None and district_code is not None:
+                    same_district = req['district_code'] == district_code
+                else:
+                    same_district = req['district'].strip().lower() == district
+                if not same_district and req['blood_group'] in compatible_blood_groups:
                     req['match_type'] = 'division'
                     matching_requests.append(req)
 
@@ -388,205 +415,204 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
 
-    # Handle donor registration with terms & conditions (original flow)
-    if query.data == 'register_donor':
-        # Show terms and conditions first
-        keyboard = [
-            [InlineKeyboardButton("✅ I Agree", callback_data='accept_donor_terms')],
-            [InlineKeyboardButton("❌ I Decline", callback_data='decline_donor_terms')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    return await BUTTON_CALLBACK_ROUTES.dispatch(update, context, default=ConversationHandler.END)
 
-        await query.edit_message_text(
-            DONOR_TERMS_TEXT,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        return DONOR_TERMS_AGREEMENT
 
-    # Handle terms and conditions response
-    elif query.data == 'accept_donor_terms':
-        # User agreed to terms, proceed with registration
-        await query.edit_message_text(
-            'Thank you for accepting the terms. Let\'s register you as a donor! What is your name?')
-        return DONOR_NAME
-    elif query.data == 'decline_donor_terms':
-        # User declined terms
-        await query.edit_message_text(
-            'You have declined the terms and conditions. Unfortunately, you cannot register as a donor without accepting them.\n\n'
-            'If you change your mind, you can start again with the /register command.'
-        )
-        return ConversationHandler.END
+async def show_donor_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Show donor registration terms & conditions (original flow)."""
+    query = update.callback_query
+    keyboard = [
+        [InlineKeyboardButton("✅ I Agree", callback_data='accept_donor_terms')],
+        [InlineKeyboardButton("❌ I Decline", callback_data='decline_donor_terms')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    # Handle donation terms response - CHECK THIS BEFORE THE GENERIC accept_ PATTERN
-    elif query.data == 'accept_donation_terms':
-        try:
-            # User agreed to terms, check if name and phone are already provided
-            donor_id = context.user_data.get('pending_accept_donor_id')
-            donor = db.get_donor_by_id(donor_id)
-
-            logger.info(f"User accepted donation terms, donor_id={donor_id}")
-
-            if not donor:
-                logger.error(f"Donor not found: {donor_id}")
-                await query.message.reply_text("Error: Donor information not found.")
-                return ConversationHandler.END
-
-            # Send a new message instead of editing - avoids "message not modified" error
-            if donor['name'] == 'Not provided' or donor['phone'] == 'Not provided':
-                # Need to collect name and phone
-                await query.message.reply_text(
-                    "Thank you for agreeing to donate! Before we connect you with the recipient, "
-                    "please provide your full name:"
-                )
-                logger.info(f"Asking for donor name, transitioning to DONOR_NAME_AFTER_ACCEPT")
-                return DONOR_NAME_AFTER_ACCEPT
-            else:
-                # Donor already has complete info, proceed directly
-                request_id = context.user_data.get('pending_accept_request_id')
-                await query.message.reply_text("Processing your donation...")
-                await handle_donation_acceptance(update, context, request_id, donor_id)
-                return ConversationHandler.END
-        except Exception as e:
-            logger.error(f"Error in accept_donation_terms: {e}")
-            await query.message.reply_text("Sorry, there was an error processing your donation acceptance.")
-            return ConversationHandler.END
+    await query.edit_message_text(
+        DONOR_TERMS_TEXT,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+    return DONOR_TERMS_AGREEMENT
 
-    elif query.data == 'decline_donation_terms':
-        # User declined donation terms
-        try:
-            request_id = context.user_data.get('pending_accept_request_id')
-            donor_id = context.user_data.get('pending_accept_donor_id')
 
-            await query.edit_message_text(
-                "You have declined the donation terms. Your donation has been cancelled.\n\n"
-                "Thank you for considering to donate. You can always accept other requests in the future."
-            )
+async def accept_donor_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """User agreed to registration terms, proceed with registration."""
+    query = update.callback_query
+    await query.edit_message_text(
+        'Thank you for accepting the terms. Let\'s register you as a donor! What is your name?')
+    return DONOR_NAME
 
-            if request_id and donor_id:
-                await handle_donation_decline(update, context, request_id, donor_id)
-            return ConversationHandler.END
-        except Exception as e:
-            logger.error(f"Error in decline_donation_terms: {e}")
-            await query.message.reply_text("Sorry, there was an error processing your response.")
-            return ConversationHandler.END
 
-    # Handle donation acceptance with agreement - AFTER the specific accept_donation_terms check
-    elif query.data.startswith('accept_') and 'donation' not in query.data and 'donor' not in query.data:
-        try:
-            # Extract request_id and donor_id more safely
-            parts = query.data.split('_')
-            if len(parts) >= 3:
-                request_id = parts[1]
-                donor_id = parts[2]
-            else:
-                logger.error(f"Invalid callback data format: {query.data}")
-                await query.message.reply_text("Error: Invalid callback data format.")
-                return ConversationHandler.END
+async def decline_donor_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """User declined registration terms."""
+    query = update.callback_query
+    await query.edit_message_text(
+        'You have declined the terms and conditions. Unfortunately, you cannot register as a donor without accepting them.\n\n'
+        'If you change your mind, you can start again with the /register command.'
+    )
+    return ConversationHandler.END
 
-            # Store in context for later use
-            context.user_data['pending_accept_request_id'] = request_id
-            context.user_data['pending_accept_donor_id'] = donor_id
 
-            logger.info(f"User accepting donation: request_id={request_id}, donor_id={donor_id}")
+async def accept_donation_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Donor agreed to donation terms; collect missing details or complete the acceptance."""
+    query = update.callback_query
+    try:
+        # User agreed to terms, check if name and phone are already provided
+        donor_id = context.user_data.get('pending_accept_donor_id')
+        donor = await adb.get_donor_by_id(donor_id)
 
-            # Show donation agreement terms
-            keyboard = [
-                [InlineKeyboardButton("✅ I Agree", callback_data='accept_donation_terms')],
-                [InlineKeyboardButton("❌ I Decline", callback_data='decline_donation_terms')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        logger.info(f"User accepted donation terms, donor_id={donor_id}")
 
-            await query.edit_message_text(
-                DONATION_TERMS_TEXT,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
+        if not donor:
+            logger.error(f"Donor not found: {donor_id}")
+            await query.message.reply_text("Error: Donor information not found.")
+            return ConversationHandler.END
+
+        # Send a new message instead of editing - avoids "message not modified" error
+        if donor['name'] == 'Not provided' or donor['phone'] == 'Not provided':
+            # Need to collect name and phone
+            await query.message.reply_text(
+                "Thank you for agreeing to donate! Before we connect you with the recipient, "
+                "please provide your full name:"
             )
-            return DONOR_TERMS_AFTER_ACCEPT
-        except Exception as e:
-            logger.error(f"Error in accept_ handler: {e}")
-            await query.message.reply_text("Sorry, there was an error processing your donation acceptance.")
+            logger.info(f"Asking for donor name, transitioning to DONOR_NAME_AFTER_ACCEPT")
+            return DONOR_NAME_AFTER_ACCEPT
+        else:
+            # Donor already has complete info, proceed directly
+            request_id = context.user_data.get('pending_accept_request_id')
+            await query.message.reply_text("Processing your donation...")
+            await handle_donation_acceptance(update, context, request_id, donor_id)
             return ConversationHandler.END
+    except Exception as e:
+        logger.error(f"Error in accept_donation_terms: {e}")
+        await query.message.reply_text("Sorry, there was an error processing your donation acceptance.")
+        return ConversationHandler.END
 
 
-    elif query.data == 'request_blood':
+async def decline_donation_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Donor declined donation terms, cancel the pending acceptance."""
+    query = update.callback_query
+    try:
+        request_id = context.user_data.get('pending_accept_request_id')
+        donor_id = context.user_data.get('pending_accept_donor_id')
 
-        try:
+        await query.edit_message_text(
+            "You have declined the donation terms. Your donation has been cancelled.\n\n"
+            "Thank you for considering to donate. You can always accept other requests in the future."
+        )
 
-            # Try to edit the message with new text
+        if request_id and donor_id:
+            await handle_donation_decline(update, context, request_id, donor_id)
+        return ConversationHandler.END
+    except Exception as e:
+        logger.error(f"Error in decline_donation_terms: {e}")
+        await query.message.reply_text("Sorry, there was an error processing your response.")
+        return ConversationHandler.END
 
-            await query.edit_message_text('Let\'s create a blood request. What is the patient\'s name?')
 
-        except telegram.error.BadRequest as e:
+async def show_donation_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle accept_<request_id>_<donor_id>: show the donation agreement terms."""
+    query = update.callback_query
+    try:
+        request_id, donor_id = (str(value) for value in context.args)
 
-            # If the error is about identical content, send a new message instead
+        # Store in context for later use
+        context.user_data['pending_accept_request_id'] = request_id
+        context.user_data['pending_accept_donor_id'] = donor_id
 
-            if "Message is not modified" in str(e):
+        logger.info(f"User accepting donation: request_id={request_id}, donor_id={donor_id}")
 
-                await query.message.reply_text('Let\'s create a blood request. What is the patient\'s name?')
+        # Show donation agreement terms
+        keyboard = [
+            [InlineKeyboardButton("✅ I Agree", callback_data='accept_donation_terms')],
+            [InlineKeyboardButton("❌ I Decline", callback_data='decline_donation_terms')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-            else:
+        await query.edit_message_text(
+            DONATION_TERMS_TEXT,
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return DONOR_TERMS_AFTER_ACCEPT
+    except Exception as e:
+        logger.error(f"Error in accept_ handler: {e}")
+        await query.message.reply_text("Sorry, there was an error processing your donation acceptance.")
+        return ConversationHandler.END
 
-                # For other types of BadRequest errors, re-raise
 
-                raise
+async def decline_donation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle decline_<request_id>_<donor_id> from a request notification."""
+    query = update.callback_query
+    try:
+        request_id, donor_id = (str(value) for value in context.args)
+        await handle_donation_decline(update, context, request_id, donor_id)
+        return ConversationHandler.END
+    except Exception as e:
+        logger.error(f"Error handling decline: {e}")
+        await query.message.reply_text("Sorry, there was an error processing your response.")
+        return ConversationHandler.END
 
-        return REQUEST_NAME
-    elif query.data == 'view_donors':
-        try:
-            await view_donors(update, context)
 
-            return ConversationHandler.END
-        except Exception as e:
-            logger.error(f"Error in view_donors handler: {e}")
-            await query.message.reply_text("Error showing donors. Please try again later.")
-            return ConversationHandler.END
-    elif query.data == 'view_requests':
-        # Only allow the admin to view all requests
-        if update.effective_user.id == int(os.getenv('ADMIN_ID', '0')):
-            try:
-                await view_requests(update, context)
-            except Exception as e:
-                logger.error(f"Error in view_requests handler: {e}")
-                await query.message.reply_text("Error showing requests. Please try again later.")
-        else:
-            await query.message.reply_text("Only administrators can view all requests.")
-        return ConversationHandler.END
-    elif query.data == 'open_admin_dashboard':
-        # Open admin dashboard if user is admin
-        if update.effective_user.id == int(os.getenv('ADMIN_ID', '0')):
-            await admin_dashboard_message(update, context)
+async def start_blood_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start the blood request flow from the main menu."""
+    query = update.callback_query
+    try:
+        # Try to edit the message with new text
+        await query.edit_message_text('Let\'s create a blood request. What is the patient\'s name?')
+    except telegram.error.BadRequest as e:
+        # If the error is about identical content, send a new message instead
+        if "Message is not modified" in str(e):
+            await query.message.reply_text('Let\'s create a blood request. What is the patient\'s name?')
         else:
-            await query.message.reply_text("Only administrators can access the dashboard.")
-        return ConversationHandler.END
-    elif query.data == 'open_donor_dashboard':
-        # User wants to open their donor dashboard
-        try:
-            # Create a fake update with callback_query for the dashboard handler
-            await refresh_donor_dashboard(update)
-        except Exception as e:
-            logger.error(f"Error opening donor dashboard: {e}")
-            await query.message.reply_text("Error opening donor dashboard. Please try again later.")
-        return ConversationHandler.END
+            # For other types of BadRequest errors, re-raise
+            raise
+    return REQUEST_NAME
+
+
+async def open_view_donors(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Show the donor list from the main menu."""
+    query = update.callback_query
+    try:
+        await view_donors(update, context)
+    except Exception as e:
+        logger.error(f"Error in view_donors handler: {e}")
+        await query.message.reply_text("Error showing donors. Please try again later.")
+    return ConversationHandler.END
 
-    # Handle donation decline - also check pattern more specifically
-    elif query.data.startswith('decline_') and 'donation' not in query.data and 'donor' not in query.data:
-        # Handle donation decline
+
+async def open_view_requests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Show all active requests - only the admin may view them."""
+    query = update.callback_query
+    if update.effective_user.id == int(os.getenv('ADMIN_ID', '0')):
         try:
-            parts = query.data.split('_')
-            if len(parts) >= 3:
-                request_id = parts[1]
-                donor_id = parts[2]
-                await handle_donation_decline(update, context, request_id, donor_id)
-            else:
-                logger.error(f"Invalid decline callback format: {query.data}")
-                await query.message.reply_text("Error: Invalid callback data format.")
-            return ConversationHandler.END
+            await view_requests(update, context)
         except Exception as e:
-            logger.error(f"Error handling decline: {e}")
-            await query.message.reply_text("Sorry, there was an error processing your response.")
-            return ConversationHandler.END
+            logger.error(f"Error in view_requests handler: {e}")
+            await query.message.reply_text("Error showing requests. Please try again later.")
+    else:
+        await query.message.reply_text("Only administrators can view all requests.")
+    return ConversationHandler.END
+
+
+async def open_admin_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Open the admin dashboard if the user is admin."""
+    query = update.callback_query
+    if update.effective_user.id == int(os.getenv('ADMIN_ID', '0')):
+        await admin_dashboard_message(update, context)
+    else:
+        await query.message.reply_text("Only administrators can access the dashboard.")
+    return ConversationHandler.END
 
+
+async def open_donor_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Open the user's donor dashboard."""
+    query = update.callback_query
+    try:
+        await refresh_donor_dashboard(update)
+    except Exception as e:
+        logger.error(f"Error opening donor dashboard: {e}")
+        await query.message.reply_text("Error opening donor dashboard. Please try again later.")
     return ConversationHandler.END
 
 # Handle donor name collection after accepting a request
@@ -625,7 +651,7 @@ async def donor_phone_after_accept(update: Update, context: ContextTypes.DEFAULT
             'name': context.user_data['donor_name'],
             'phone': context.user_data['donor_phone']
         }
-        db.update_donor(donor_id, update_data)
+        await adb.update_donor(donor_id, update_data)
 
         # Now proceed with the donation acceptance
         try:
@@ -688,9 +714,10 @@ async def donor_division(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     division = update.message.text
     context.user_data['donor_division'] = division
 
-    # Get districts for this division
-    if division in BANGLADESH_DIVISIONS:
-        districts = BANGLADESH_DISTRICTS[division]
+    # Get districts for this division, accepting alternate spellings
+    canonical_division = get_division_name(division)
+    if canonical_division:
+        districts = BANGLADESH_DISTRICTS[canonical_division]
 
         # Create keyboard with districts
         keyboard = []
@@ -763,7 +790,8 @@ async def donor_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     }
 
     # Save donor to database
-    donor_id = db.save_donor(donor_data)
+    donor_id = await adb.save_donor(donor_data)
+    matching.invalidate_donor_index()
 
     await update.message.reply_text(
         f'Member registration completed successfully!\n\n'
@@ -831,9 +859,10 @@ async def request_division(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     division = update.message.text
     context.user_data['request_division'] = division
 
-    # Get districts for this division
-    if division in BANGLADESH_DIVISIONS:
-        districts = BANGLADESH_DISTRICTS[division]
+    # Get districts for this division, accepting alternate spellings
+    canonical_division = get_division_name(division)
+    if canonical_division:
+        districts = BANGLADESH_DISTRICTS[canonical_division]
 
         # Create keyboard with districts
         keyboard = []
@@ -909,7 +938,7 @@ async def request_blood_group(update: Update, context: ContextTypes.DEFAULT_TYPE
     }
 
     # Save request to database
-    request_id = db.save_request(request_data)
+    request_id = await adb.save_request(request_data)
 
     await update.message.reply_text(
         f'Your blood request has been submitted successfully!\n\n'
@@ -929,7 +958,7 @@ async def find_matching_donors(context: ContextTypes.DEFAULT_TYPE, request_id: s
     # Debug log start of function
     logger.info(f"Starting donor matching process for request {request_id}")
 
-    request = db.get_request_by_id(request_id)
+    request = await adb.get_request_by_id(request_id)
     if not request:
         logger.error(f"Request with ID {request_id} not found!")
         return
@@ -942,151 +971,219 @@ async def find_matching_donors(context: ContextTypes.DEFAULT_TYPE, request_id: s
         logger.error(f"Request {request_id} has no blood_group!")
         return
 
-    logger.info(f"Request details: Blood Group={blood_group}, Division={division}, District={district}")
+    division_code, district_code = request.get('division_code'), request.get('district_code')
+    if division_code is None and district_code is None:
+        division_code, district_code = get_location_codes(division, district)
 
-    # Define compatible blood groups
-    compatible_blood_groups = get_compatible_donors(blood_group)
-    logger.info(f"Compatible blood groups: {compatible_blood_groups}")
+    logger.info(f"Request details: Blood Group={blood_group}, Division={division}, District={district}")
 
-    # Find donors matching blood group
-    all_compatible_donors = db.get_donors_by_blood_groups(compatible_blood_groups)
-    logger.info(f"Found {len(all_compatible_donors)} donors with compatible blood groups")
+    # Rank compatible donors by distance with the columnar donor index, rebuilt off the event loop when stale
+    donor_index = await adb.run(matching.get_donor_index)
+    plan = await adb.run(donor_index.escalation_plan, blood_group, division_code, district_code)
+    logger.info(f"Found {len(plan)} eligible compatible donors out of {len(donor_index)} indexed donors")
 
-    if not all_compatible_donors:
+    if not plan:
         logger.info(f"No compatible donors found for blood group {blood_group}")
         return
 
-    # Categorize donors by location match
-    exact_match_donors = []  # Same district and division
-    division_match_donors = []  # Same division, different district
-    blood_only_match_donors = []  # Just blood type match, different location
-
-    for donor in all_compatible_donors:
-        donor_division = donor.get('division', '').strip().lower()
-        donor_district = donor.get('district', '').strip().lower()
-        donor_id = donor.get('id', 'unknown')
-        donor_tg_id = donor.get('telegram_id', 'unknown')
-
-        logger.debug(
-            f"Checking donor ID={donor_id}, TG_ID={donor_tg_id}, Division={donor_division}, District={donor_district}")
-
-        # Check for exact location match (same district and division)
-        if donor_division == division and donor_district == district:
-            exact_match_donors.append(donor)
-            logger.debug(f"Added donor {donor_id} to exact match list")
-        # Check for division match only
-        elif donor_division == division:
-            division_match_donors.append(donor)
-            logger.debug(f"Added donor {donor_id} to division match list")
-        # All others are blood-only matches
-        else:
-            blood_only_match_donors.append(donor)
-            logger.debug(f"Added donor {donor_id} to blood-only match list")
+    logger.info("Matching donors by ring: " + ", ".join(
+        f"{count} {matching.RING_NAMES[ring]}" for ring, count in enumerate(plan.ring_counts())))
 
-    # Create prioritized list: exact matches first, then division matches, then blood-only matches
-    matching_donors = exact_match_donors + division_match_donors + blood_only_match_donors
+    # Donors already notified about this request (e.g. if matching is re-triggered) are not sent again
+    previously_notified = [donor_id for donor_id in (request.get('notified_donors') or '').split(',') if donor_id]
+    plan.mark_done([int(donor_id) for donor_id in previously_notified])
 
-    logger.info(f"Matching donors categorized: {len(exact_match_donors)} exact matches, "
-                f"{len(division_match_donors)} division matches, and "
-                f"{len(blood_only_match_donors)} blood-only matches")
+    escalation = {
+        'request_id': request_id,
+        'plan': plan,
+        'ring': matching.RING_DISTRICT,
+        'notified': previously_notified,
+        'wave': 0
+    }
 
-    if not matching_donors:
-        logger.info(f"No donors found after location filtering for request {request_id}")
+    if context.job_queue is None:
+        # Without a job queue nothing can widen the search later, so notify everyone now
+        logger.warning("Job queue not available, notifying all matching donors at once")
+        while await send_escalation_wave(context, request, escalation):
+            pass
         return
 
-    # Track notified donors to update in the database
-    notified_donors = []
+    await send_escalation_wave(context, request, escalation)
+    schedule_escalation(context, request, escalation)
 
-    # Notify donors
-    logger.info(f"Starting notification process for {len(matching_donors)} donors")
-    for i, donor in enumerate(matching_donors):
-        try:
-            donor_id = str(donor.get('id', ''))
-            donor_tg_id = donor.get('telegram_id')
 
-            if not donor_id or not donor_tg_id:
-                logger.warning(f"Skipping donor with missing ID or Telegram ID: {donor}")
-                continue
+def is_permanent_delivery_error(error: Exception) -> bool:
+    """Return True for send errors that will keep failing for this chat (blocked bot, deleted chat)."""
+    if isinstance(error, telegram.error.Forbidden):
+        return True
+    return isinstance(error, telegram.error.BadRequest) and 'chat not found' in str(error).lower()
 
-            logger.info(f"Processing donor {i + 1}/{len(matching_donors)}: ID={donor_id}, TG_ID={donor_tg_id}")
-
-            # Determine match type for the message
-            match_type = ""
-            if donor in exact_match_donors:
-                match_type = "⭐ This request is from your exact location (same district)"
-            elif donor in division_match_donors:
-                match_type = "✨ This request is from your division"
-
-            # Create a message with limited information - no patient name or contact info
-            # Use .get() with default values to avoid KeyError
-            message = (
-                f"🩸 URGENT: Blood Donation Request\n\n"
-                f"A patient needs {blood_group} blood donation\n"
-                f"Hospital: {request.get('hospital_name', 'Not specified')}\n"
-                f"Location: {request.get('area', 'Not specified')}, {request.get('district', 'Not specified')}, {request.get('division', 'Not specified')}\n"
-            )
 
-            # Add urgency if available
-            if 'urgency' in request:
-                message += f"Urgency: {request['urgency']}\n\n"
-            else:
-                message += "Urgency: High\n\n"  # Default urgency
+async def mark_donor_unreachable(donor: dict, error: Exception) -> None:
+    """Stop matching and broadcasting to a donor whose chat permanently rejects messages."""
+    logger.warning(f"Donor {donor.get('id')} is unreachable ({error}), excluding from future notifications")
+    if await adb.mark_donor_unreachable(donor.get('id')):
+        matching.invalidate_donor_index()
+
 
-            message += f"You are receiving this notification because your blood group ({donor.get('blood_group', '')}) is compatible."
+async def notify_donor(context: ContextTypes.DEFAULT_TYPE, request: dict, donor: dict, tier: int,
+                       distance_km: float = None) -> bool:
+    """Send a blood request notification to a single donor. Returns True on success."""
+    request_id = str(request.get('id', ''))
+    blood_group = request.get('blood_group', '')
+    try:
+        donor_id = str(donor.get('id', ''))
+        donor_tg_id = donor.get('telegram_id')
+
+        if not donor_id or not donor_tg_id:
+            logger.warning(f"Skipping donor with missing ID or Telegram ID: {donor}")
+            return False
+
+        # Determine match type for the message
+        match_type = ""
+        if tier == matching.TIER_EXACT:
+            match_type = "⭐ This request is from your exact location (same district)"
+        elif tier == matching.TIER_DIVISION:
+            match_type = "✨ This request is from your division"
+        if tier != matching.TIER_EXACT and distance_km is not None:
+            match_type = f"{match_type}\n📍 About {distance_km:.0f} km from your district".lstrip()
+
+        # Create a message with limited information - no patient name or contact info
+        # Use .get() with default values to avoid KeyError
+        message = (
+            f"🩸 URGENT: Blood Donation Request\n\n"
+            f"A patient needs {blood_group} blood donation\n"
+            f"Hospital: {request.get('hospital_name', 'Not specified')}\n"
+            f"Location: {request.get('area', 'Not specified')}, {request.get('district', 'Not specified')}, {request.get('division', 'Not specified')}\n"
+        )
 
-            # Add location match note if applicable
-            if match_type:
-                message += f"\n\n{match_type}"
+        # Add urgency if available
+        if 'urgency' in request:
+            message += f"Urgency: {request['urgency']}\n\n"
+        else:
+            message += "Urgency: High\n\n"  # Default urgency
 
-            # Create accept button with callback data
-            keyboard = [
-                [InlineKeyboardButton("I Can Donate", callback_data=f"accept_{request_id}_{donor_id}")],
-                [InlineKeyboardButton("Not Available", callback_data=f"decline_{request_id}_{donor_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        message += f"You are receiving this notification because your blood group ({donor.get('blood_group', '')}) is compatible."
 
-            logger.info(f"Sending notification to donor {donor_id} (TG_ID: {donor_tg_id})")
+        # Add location match note if applicable
+        if match_type:
+            message += f"\n\n{match_type}"
 
-            # Send notification to donor with buttons
-            await context.bot.send_message(
-                chat_id=donor_tg_id,  # Using the telegram_id directly
-                text=message,
-                reply_markup=reply_markup
-            )
+        # Create accept button with callback data
+        keyboard = [
+            [InlineKeyboardButton("I Can Donate", callback_data=f"accept_{request_id}_{donor_id}")],
+            [InlineKeyboardButton("Not Available", callback_data=f"decline_{request_id}_{donor_id}")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        logger.info(f"Sending notification to donor {donor_id} (TG_ID: {donor_tg_id})")
 
-            logger.info(f"Successfully sent notification to donor {donor_id}")
+        # Send notification to donor with buttons
+        await context.bot.send_message(
+            chat_id=donor_tg_id,  # Using the telegram_id directly
+            text=message,
+            reply_markup=reply_markup
+        )
 
-            # Add donor to notified list
-            notified_donors.append(donor_id)
+        logger.info(f"Successfully sent notification to donor {donor_id}")
+        return True
 
-        except Exception as e:
-            logger.error(f"Failed to notify donor {donor.get('id', 'unknown')}: {e}")
-            # Print the full error traceback for detailed debugging
-            import traceback
-            logger.error(traceback.format_exc())
+    except Exception as e:
+        if is_permanent_delivery_error(e):
+            await mark_donor_unreachable(donor, e)
+            return False
+        logger.error(f"Failed to notify donor {donor.get('id', 'unknown')}: {e}")
+        # Print the full error traceback for detailed debugging
+        import traceback
+        logger.error(traceback.format_exc())
+        return False
+
+
+async def send_escalation_wave(context: ContextTypes.DEFAULT_TYPE, request: dict, escalation: dict) -> bool:
+    """Notify the next wave of donors for a request. Returns False once every ring is exhausted."""
+    request_id = escalation['request_id']
+    donor_index = await adb.run(matching.get_donor_index)
+    wave, escalation['ring'], dropped = matching.select_wave(escalation['plan'], donor_index, escalation['ring'])
+    if dropped:
+        # The plan dates from the first wave; donors deleted, restricted or unreachable since are left out
+        logger.info(f"Dropped {dropped} donors who can no longer be notified from the plan for request {request_id}")
+    if not wave:
+        logger.info(f"No donors left to notify for request {request_id}")
+        return False
+
+    escalation['wave'] += 1
+    logger.info(f"Sending wave {escalation['wave']} for request {request_id} "
+                f"({matching.RING_NAMES[escalation['ring']]} ring, {len(wave)} donors)")
+
+    skipped = {notification_limits.SKIP_DUPLICATE: 0, notification_limits.SKIP_CAPPED: 0}
+    for donor, tier, distance_km in wave:
+        donor_id = str(donor.get('id', ''))
+
+        # Frequency cap and per-request dedup
+        skip_reason = notification_limits.check_notification(request_id, donor_id)
+        if skip_reason:
+            skipped[skip_reason] += 1
+            continue
+
+        # Donors are marked as notified even if sending fails, so they are not retried every wave
+        escalation['notified'].append(donor_id)
+        if await notify_donor(context, request, donor, tier, distance_km):
+            notification_limits.record_notification(request_id, donor_id)
+
+    if any(skipped.values()):
+        logger.info(f"Skipped {skipped[notification_limits.SKIP_DUPLICATE]} already-notified and "
+                    f"{skipped[notification_limits.SKIP_CAPPED]} frequency-capped donors for request {request_id}")
 
     # Update request with the list of notified donors
-    if notified_donors:
-        logger.info(f"Updating request {request_id} with {len(notified_donors)} notified donors")
-        success = db.update_request_notified_donors(request_id, notified_donors)
-        logger.info(f"Database update {'successful' if success else 'failed'}")
-    else:
-        logger.warning(f"No donors were successfully notified for request {request_id}")
+    logger.info(f"Updating request {request_id} with {len(escalation['notified'])} notified donors")
+    success = await adb.update_request_notified_donors(request_id, escalation['notified'])
+    logger.info(f"Database update {'successful' if success else 'failed'}")
+    return True
+
+
+def schedule_escalation(context: ContextTypes.DEFAULT_TYPE, request: dict, escalation: dict) -> None:
+    """Schedule the next escalation wave after the request's urgency window."""
+    window = matching.escalation_window_seconds(request.get('urgency'))
+    context.job_queue.run_once(
+        escalate_request,
+        when=window,
+        data=escalation,
+        name=f"escalate_{escalation['request_id']}"
+    )
+    logger.info(f"Next wave for request {escalation['request_id']} in {window // 60} minutes")
+
+
+async def escalate_request(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback: widen the donor search if a request is still waiting for donors."""
+    escalation = context.job.data
+    request_id = escalation['request_id']
+
+    request = await adb.get_request_by_id(request_id)
+    if not request or request.get('status') != 'active':
+        logger.info(f"Stopping escalation for request {request_id}: request is no longer active")
+        return
+
+    acceptances = await adb.count_request_acceptances(request_id)
+    if acceptances >= matching.ESCALATION_TARGET_ACCEPTANCES:
+        logger.info(f"Stopping escalation for request {request_id}: {acceptances} donors accepted")
+        return
+
+    if await send_escalation_wave(context, request, escalation):
+        schedule_escalation(context, request, escalation)
+
+
+def cancel_escalation(context: ContextTypes.DEFAULT_TYPE, request_id: str) -> None:
+    """Cancel any pending escalation waves for a request."""
+    if context.job_queue is None:
+        return
+    for job in context.job_queue.get_jobs_by_name(f"escalate_{request_id}"):
+        job.schedule_removal()
+        logger.info(f"Cancelled pending escalation for request {request_id}")
 
 
 def get_compatible_donors(requested_blood_group: str) -> list:
     """Return a list of compatible donor blood groups for the requested blood group."""
-    compatibility = {
-        'A+': ['A+', 'A-', 'O+', 'O-'],
-        'A-': ['A-', 'O-'],
-        'B+': ['B+', 'B-', 'O+', 'O-'],
-        'B-': ['B-', 'O-'],
-        'AB+': ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'],
-        'AB-': ['A-', 'B-', 'AB-', 'O-'],
-        'O+': ['O+', 'O-'],
-        'O-': ['O-']
-    }
-    return compatibility.get(requested_blood_group, [])
+    return matching.COMPATIBLE_DONOR_GROUPS.get(requested_blood_group, [])
 
 
 def get_total_successful_operations() -> int:
@@ -1112,13 +1209,13 @@ async def handle_donation_decline(update: Update, context: ContextTypes.DEFAULT_
     )
 
     # Record the decline in the database
-    db.add_donor_to_declined_request(request_id, donor_id)
+    await adb.add_donor_to_declined_request(request_id, donor_id)
 
 
 async def handle_donation_acceptance(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: str, donor_id: str) -> None:
+    started = time.perf_counter()
 
-    donor = db.get_donor_by_id(donor_id)
-    request = db.get_request_by_id(request_id)
+    donor, request = await asyncio.gather(adb.get_donor_by_id(donor_id), adb.get_request_by_id(request_id))
 
     if not donor or not request:
         if hasattr(update, 'callback_query') and update.callback_query:
@@ -1128,25 +1225,17 @@ async def handle_donation_acceptance(update: Update, context: ContextTypes.DEFAU
         return
 
     # Update the request to record the donor's acceptance
-    db.add_donor_to_request(request_id, donor_id)
-
-    # Get usernames if available
-    donor_username = None
-    requester_username = None
+    await adb.add_donor_to_request(request_id, donor_id)
 
-    try:
-        # Try to get donor's username
-        donor_user = await context.bot.get_chat(donor['telegram_id'])
-        donor_username = donor_user.username
-    except Exception as e:
-        logger.error(f"Error getting donor username: {e}")
+    # Stop widening the search once enough donors have accepted
+    if await adb.count_request_acceptances(request_id) >= matching.ESCALATION_TARGET_ACCEPTANCES:
+        cancel_escalation(context, request_id)
 
-    try:
-        # Try to get requester's username
-        requester_user = await context.bot.get_chat(request['telegram_id'])
-        requester_username = requester_user.username
-    except Exception as e:
-        logger.error(f"Error getting requester username: {e}")
+    # Get usernames if available - both lookups run concurrently and are cached per chat
+    donor_username, requester_username = await asyncio.gather(
+        chat_cache.get_username(context.bot, donor['telegram_id']),
+        chat_cache.get_username(context.bot, request['telegram_id'])
+    )
 
     # Notify the donor with complete request details including contact info
     donor_msg = (
@@ -1173,27 +1262,6 @@ async def handle_donation_acceptance(update: Update, context: ContextTypes.DEFAU
     ]
     donor_reply_markup = InlineKeyboardMarkup(donor_feedback_keyboard)
 
-    # Use the correct method to send the message based on update type
-    if hasattr(update, 'callback_query') and update.callback_query:
-        try:
-            await update.callback_query.edit_message_text(donor_msg, reply_markup=None)
-            # Send a follow-up message with the feedback buttons
-            await update.callback_query.message.reply_text(
-                "After your donation, we'd love to hear about your experience!",
-                reply_markup=donor_reply_markup
-            )
-        except Exception as e:
-            logger.error(f"Error editing message: {e}")
-            await update.callback_query.message.reply_text(
-                donor_msg,
-                reply_markup=donor_reply_markup
-            )
-    else:
-        await update.message.reply_text(
-            donor_msg,
-            reply_markup=donor_reply_markup
-        )
-
     # Create feedback keyboard for requester
     requester_feedback_keyboard = [
         [InlineKeyboardButton("📝 Share Feedback About Donor", callback_data='open_support')],
@@ -1216,63 +1284,106 @@ async def handle_donation_acceptance(update: Update, context: ContextTypes.DEFAU
     else:
         requester_msg += f"Please contact the donor using the phone number provided above.\n"
 
-    try:
-        await context.bot.send_message(
-            chat_id=request['telegram_id'],
-            text=requester_msg,
-            reply_markup=requester_reply_markup
-        )
-
-        try:
-            # Get admin ID from environment variables
-            admin_id = os.getenv('ADMIN_ID', '0')
-
-            # Get total operations count
-            total_operations = get_total_successful_operations()
-
-            # Create a detailed admin notification
-            admin_msg = (
-                f"🎉 *SUCCESSFUL DONATION OPERATION #{total_operations}*\n\n"
-                f"*DONOR DETAILS:*\n"
-                f"ID: `{donor['id']}`\n"
-                f"Name: {donor['name']}\n"
-                f"Age: {donor['age']}\n"
-                f"Gender: {donor['gender']}\n"
-                f"Blood Group: {donor['blood_group']}\n"
-                f"Phone: `{donor['phone']}`\n"
-                f"Location: {donor['area']}, {donor['district']}, {donor['division']}\n"
-                f"Username: {f'@{donor_username}' if donor_username else 'Not available'}\n\n"
-
-                f"*RECIPIENT DETAILS:*\n"
-                f"ID: `{request['id']}`\n"
-                f"Patient: {request['name']}\n"
-                f"Age: {request['age']}\n"
-                f"Blood Group: {request['blood_group']}\n"
-                f"Hospital: {request['hospital_name']}\n"
-                f"Address: {request['hospital_address']}\n"
-                f"Urgency: {request['urgency']}\n"
-                f"Phone: `{request['phone']}`\n"
-                f"Username: {f'@{requester_username}' if requester_username else 'Not available'}\n\n"
-
-                f"*OPERATION DETAILS:*\n"
-                f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"Status: Donor has accepted request\n\n"
-                f"Total successful operations to date: {total_operations}"
+    async def send_donor_confirmation():
+        # Use the correct method to send the message based on update type
+        if hasattr(update, 'callback_query') and update.callback_query:
+            try:
+                await update.callback_query.edit_message_text(donor_msg, reply_markup=None)
+                # Send a follow-up message with the feedback buttons
+                await update.callback_query.message.reply_text(
+                    "After your donation, we'd love to hear about your experience!",
+                    reply_markup=donor_reply_markup
+                )
+            except Exception as e:
+                logger.error(f"Error editing message: {e}")
+                await update.callback_query.message.reply_text(
+                    donor_msg,
+                    reply_markup=donor_reply_markup
+                )
+        else:
+            await update.message.reply_text(
+                donor_msg,
+                reply_markup=donor_reply_markup
             )
 
-            # Send notification to admin
+    async def send_requester_notification():
+        try:
             await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_msg,
-                parse_mode='Markdown'
+                chat_id=request['telegram_id'],
+                text=requester_msg,
+                reply_markup=requester_reply_markup
             )
-
-            # Log the successful notification
-            logger.info(f"Admin notified about donation operation #{total_operations}")
+            return True
         except Exception as e:
-            logger.error(f"Error notifying admin about donation: {e}")
+            logger.error(f"Error notifying requester: {e}")
+            return False
+
+    # The donor and requester messages do not depend on each other
+    _, requester_notified = await asyncio.gather(send_donor_confirmation(), send_requester_notification())
+
+    # The admin summary is not needed for the donor or requester, so send it in the background,
+    # outside this update's database session
+    if requester_notified:
+        context.application.create_task(
+            adb.outside_session(notify_admin_of_donation(context, donor, request, donor_username, requester_username)),
+            update=update
+        )
+
+    logger.info(f"Handled donation acceptance for request {request_id} by donor {donor_id} "
+                f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+async def notify_admin_of_donation(context: ContextTypes.DEFAULT_TYPE, donor: dict, request: dict,
+                                   donor_username: str, requester_username: str) -> None:
+    """Send the admin a summary of an accepted donation."""
+    try:
+        # Get admin ID from environment variables
+        admin_id = os.getenv('ADMIN_ID', '0')
+
+        # Get total operations count without blocking the event loop
+        total_operations = await adb.run(get_total_successful_operations)
+
+        # Create a detailed admin notification
+        admin_msg = (
+            f"🎉 *SUCCESSFUL DONATION OPERATION #{total_operations}*\n\n"
+            f"*DONOR DETAILS:*\n"
+            f"ID: `{donor['id']}`\n"
+            f"Name: {donor['name']}\n"
+            f"Age: {donor['age']}\n"
+            f"Gender: {donor['gender']}\n"
+            f"Blood Group: {donor['blood_group']}\n"
+            f"Phone: `{donor['phone']}`\n"
+            f"Location: {donor['area']}, {donor['district']}, {donor['division']}\n"
+            f"Username: {f'@{donor_username}' if donor_username else 'Not available'}\n\n"
+
+            f"*RECIPIENT DETAILS:*\n"
+            f"ID: `{request['id']}`\n"
+            f"Patient: {request['name']}\n"
+            f"Age: {request['age']}\n"
+            f"Blood Group: {request['blood_group']}\n"
+            f"Hospital: {request['hospital_name']}\n"
+            f"Address: {request['hospital_address']}\n"
+            f"Urgency: {request['urgency']}\n"
+            f"Phone: `{request['phone']}`\n"
+            f"Username: {f'@{requester_username}' if requester_username else 'Not available'}\n\n"
+
+            f"*OPERATION DETAILS:*\n"
+            f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Status: Donor has accepted request\n\n"
+            f"Total successful operations to date: {total_operations}"
+        )
+
+        # Send notification to admin
+        await context.bot.send_message(
+            chat_id=admin_id,
+            text=admin_msg,
+            parse_mode='Markdown'
+        )
+
+        # Log the successful notification
+        logger.info(f"Admin notified about donation operation #{total_operations}")
     except Exception as e:
-        logger.error(f"Error notifying requester: {e}")
+        logger.error(f"Error notifying admin about donation: {e}")
 
 async def send_thanks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Send a thank you message to the donor."""
@@ -1289,7 +1400,7 @@ async def send_thanks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     return SUPPORT_MESSAGE
 async def view_requests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Display a list of active blood requests - ADMIN ONLY."""
-    active_requests = db.get_active_requests()
+    active_requests = await adb.get_active_requests()
 
     if not active_requests:
         if hasattr(update, 'callback_query'):
@@ -1329,7 +1440,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """Send a message when the command /help is issued."""
     # Check if user is a donor
     user_id = update.effective_user.id
-    donor = db.get_donor_by_telegram_id(user_id)
+    donor = await adb.get_donor_by_telegram_id(user_id)
 
     help_text = (
         "🩸 *Blood Donation Bot - Help*\n\n"
@@ -1356,7 +1467,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "*/dashboard* - Same as /admin - opens the admin panel\n"
             "*/requests* - View all active blood requests\n"
             "*/stats* - View donation operation statistics\n"
-            "*/operations* - List all successful donations\n"
+            "*/operations [page]* - List successful donations, newest first\n"
+            "*/import_donors* - Add or update donors from a CSV or XLSX file\n"
         )
         help_text += admin_help
 
@@ -1402,7 +1514,7 @@ async def handle_terms_response(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def donors_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show registered donors with limited information."""
-    donors = db.get_all_donors()
+    donors = await adb.get_all_donors()
 
     if not donors:
         await update.message.reply_text("No donors registered yet.")
@@ -1433,7 +1545,7 @@ async def requests_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         user_id = update.effective_user.id
 
         if user_id == admin_id:
-            active_requests = db.get_active_requests()
+            active_requests = await adb.get_active_requests()
 
             if not active_requests:
                 await update.message.reply_text("No active blood requests at the moment.")
@@ -1473,7 +1585,7 @@ async def donor_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user = update.effective_user
 
         # Find the donor by telegram ID
-        donor = db.get_donor_by_telegram_id(user_id)
+        donor = await adb.get_donor_by_telegram_id(user_id)
 
         if not donor:
             # User is not registered as a donor
@@ -1493,17 +1605,17 @@ async def donor_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         # Get donor statistics
-        donor_stats = db.get_donor_stats(donor['id'])
+        donor_stats = await adb.get_donor_stats(donor['id'])
 
         if not donor_stats:
             await update.message.reply_text("Error retrieving your donor statistics. Please try again later.")
             return
 
         # Get top donors of all time
-        top_donors_all_time = db.get_top_donors(3)
+        top_donors_all_time = await adb.get_top_donors(3)
 
         # Get top donors of this month
-        top_donors_month = db.get_top_donors(3, 'month')
+        top_donors_month = await adb.get_top_donors(3, 'month')
 
         # Create the dashboard message
         dashboard_msg = (
@@ -1580,7 +1692,7 @@ async def refresh_donor_dashboard(update: Update) -> None:
 
     try:
         # Find the donor by telegram ID
-        donor = db.get_donor_by_telegram_id(user_id)
+        donor = await adb.get_donor_by_telegram_id(user_id)
 
         if not donor:
             # User is not registered as a donor
@@ -1600,7 +1712,7 @@ async def refresh_donor_dashboard(update: Update) -> None:
             return
 
         # Get donor statistics
-        donor_stats = db.get_donor_stats(donor['id'])
+        donor_stats = await adb.get_donor_stats(donor['id'])
 
         if not donor_stats:
             keyboard = [[InlineKeyboardButton("📱 Main Menu", callback_data='show_main_menu')]]
@@ -1613,10 +1725,10 @@ async def refresh_donor_dashboard(update: Update) -> None:
             return
 
         # Get top donors of all time
-        top_donors_all_time = db.get_top_donors(3)
+        top_donors_all_time = await adb.get_top_donors(3)
 
         # Get top donors of this month
-        top_donors_month = db.get_top_donors(3, 'month')
+        top_donors_month = await adb.get_top_donors(3, 'month')
 
         # Create the dashboard message
         dashboard_msg = (
@@ -1706,7 +1818,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     try:
         # Check if user is already registered as a donor
-        donor = db.get_donor_by_telegram_id(user.id)
+        donor = await adb.get_donor_by_telegram_id(user.id)
 
         # Default keyboard for all users
         keyboard = [
@@ -1771,8 +1883,29 @@ async def admin_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"⚠️ Error: {str(e)}")
 
 
+# Operations listed per page by /operations and the admin dashboard
+OPERATIONS_PAGE_SIZE = 10
+
+
+async def get_operations_page(page):
+    """Return (operations on 1-based page, whether a next page exists)."""
+    # One extra row tells whether there is a next page without counting them all
+    operations = await adb.get_recent_operations(OPERATIONS_PAGE_SIZE + 1, (page - 1) * OPERATIONS_PAGE_SIZE)
+    return operations[:OPERATIONS_PAGE_SIZE], len(operations) > OPERATIONS_PAGE_SIZE
+
+
+def operations_page_buttons(page, has_next):
+    """Newer/older buttons for a page of operations, empty if there is only one page."""
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=f'admin_view_operations_{page - 1}'))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Older ➡️", callback_data=f'admin_view_operations_{page + 1}'))
+    return [buttons] if buttons else []
+
+
 async def admin_operation_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Command to list all successful donation operations."""
+    """Command to list successful donation operations: /operations [page]."""
     try:
         user_id = update.effective_user.id
         admin_id = int(os.getenv('ADMIN_ID', '0'))
@@ -1782,12 +1915,15 @@ async def admin_operation_list_command(update: Update, context: ContextTypes.DEF
             await update.message.reply_text("⛔ This command is restricted to administrators only.")
             return
 
+        page = int(context.args[0]) if context.args and context.args[0].isdigit() else 1
+        page = max(page, 1)
+
         # Get successful operations from database
         try:
-            successful_operations = db.get_recent_operations(15)  # Get up to 15 recent operations
+            successful_operations, has_next = await get_operations_page(page)
         except Exception as e:
             logger.error(f"Failed to get recent operations: {e}")
-            successful_operations = []
+            successful_operations, has_next = [], False
 
         if not successful_operations:
             # Create keyboard with buttons
@@ -1798,7 +1934,8 @@ async def admin_operation_list_command(update: Update, context: ContextTypes.DEF
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await update.message.reply_text(
-                "No successful donation operations recorded yet.",
+                "No successful donation operations recorded yet." if page == 1
+                else f"There are no operations on page {page}.",
                 reply_markup=reply_markup
             )
             return
@@ -1808,15 +1945,15 @@ async def admin_operation_list_command(update: Update, context: ContextTypes.DEF
 
         # Get total operations count
         try:
-            stats = db.get_operations_stats()
+            stats = await adb.get_operations_stats()
             total_ops = stats.get('total_operations', len(successful_operations))
         except:
             total_ops = len(successful_operations)
 
-        operations_msg += f"Total operations: {total_ops}\n\n"
+        operations_msg += f"Total operations: {total_ops} | Page {page}\n\n"
 
         # Display operations
-        for i, op in enumerate(successful_operations, 1):
+        for i, op in enumerate(successful_operations, (page - 1) * OPERATIONS_PAGE_SIZE + 1):
             try:
                 req = op.get('request', {})
                 donor = op.get('donor', {})
@@ -1835,7 +1972,7 @@ async def admin_operation_list_command(update: Update, context: ContextTypes.DEF
                 continue
 
         # Create keyboard with buttons
-        keyboard = [
+        keyboard = operations_page_buttons(page, has_next) + [
             [InlineKeyboardButton("📊 View Dashboard", callback_data='admin_back_to_dashboard')],
             [InlineKeyboardButton("📱 Main Menu", callback_data='show_main_menu')]
         ]
@@ -1909,7 +2046,7 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
 
         # Get statistics from database
-        stats = db.get_operations_stats()
+        stats = await adb.get_operations_stats()
 
         # Calculate fulfillment rates
         fulfillment_rate = 0
@@ -1925,12 +2062,13 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"• Total blood requests: {stats['total_requests']}\n"
             f"• Active blood requests: {stats['active_requests']}\n"
             f"• Successful donations: {stats['total_operations']}\n"
-            f"• Request fulfillment rate: {fulfillment_rate:.1f}%\n\n"
+            f"• Request fulfillment rate: {fulfillment_rate:.1f}%\n"
+            f"• Unreachable donors: {stats.get('unreachable_donors', 0)}\n\n"
         )
 
         # Add blood group statistics
         stats_msg += "*DONOR BLOOD GROUPS:*\n"
-        blood_counts = count_donors_by_blood_type()
+        blood_counts = await adb.run(count_donors_by_blood_type)
         for blood_type, count in blood_counts.items():
             if count > 0:
                 stats_msg += f"• {blood_type}: {count} donors\n"
@@ -1969,11 +2107,12 @@ async def admin_dashboard_message(update: Update, context: ContextTypes.DEFAULT_
     """Display the admin dashboard with statistics and action buttons."""
     try:
         # Get statistics from the database module
-        stats = db.get_operations_stats()
+        stats = await adb.get_operations_stats()
         total_donors = stats.get('total_donors', 0)
         total_requests = stats.get('total_requests', 0)
         active_requests = stats.get('active_requests', 0)
         successful_operations = stats.get('total_operations', 0)
+        unreachable_donors = stats.get('unreachable_donors', 0)
 
         # Create keyboard with admin actions - PROPERLY STRUCTURED
         keyboard = [
@@ -1999,12 +2138,13 @@ async def admin_dashboard_message(update: Update, context: ContextTypes.DEFAULT_
             f"• Total donors: {total_donors}\n"
             f"• Total requests: {total_requests}\n"
             f"• Active requests: {active_requests}\n"
-            f"• Successful donations: {successful_operations}\n\n"
+            f"• Successful donations: {successful_operations}\n"
+            f"• Unreachable donors: {unreachable_donors}\n\n"
         )
 
         # Add blood type statistics
         message += f"*ACTIVE REQUESTS BY BLOOD TYPE:*\n"
-        blood_counts = count_donors_by_blood_type()
+        blood_counts = await adb.run(count_donors_by_blood_type)
         for blood_type, count in blood_counts.items():
             if count > 0:
                 message += f"• {blood_type}: {count} donors\n"
@@ -2070,7 +2210,7 @@ async def admin_manage_requests(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
 
     # Get all active requests
-    active_requests = db.get_active_requests()
+    active_requests = await adb.get_active_requests()
 
     if not active_requests:
         # No active requests
@@ -2128,7 +2268,7 @@ async def admin_confirm_deactivate(update: Update, context: ContextTypes.DEFAULT
 
     # Update database
     try:
-        success = db.update_request_status(request_id, 'inactive')
+        success = await adb.update_request_status(request_id, 'inactive')
 
         if success:
             await query.message.reply_text(f"Request #{request_id} marked as inactive.")
@@ -2144,12 +2284,12 @@ async def admin_confirm_deactivate(update: Update, context: ContextTypes.DEFAULT
 
 
 async def admin_view_operations(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """View successful donation operations."""
+    """View successful donation operations, one page at a time (admin_view_operations_<page>)."""
     query = update.callback_query
     await query.answer()
 
-    # Get recent operations (limit to 10 for now)
-    operations = db.get_recent_operations(10)
+    page = max(context.args[0], 1) if context.args else 1
+    operations, has_next = await get_operations_page(page)
 
     if not operations:
         keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
@@ -2164,9 +2304,9 @@ async def admin_view_operations(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     # Create operations list
-    message = "✅ *SUCCESSFUL OPERATIONS*\n\n"
+    message = f"✅ *SUCCESSFUL OPERATIONS* (page {page})\n\n"
 
-    for i, op in enumerate(operations, 1):
+    for i, op in enumerate(operations, (page - 1) * OPERATIONS_PAGE_SIZE + 1):
         req = op['request']
         donor = op['donor']
 
@@ -2180,7 +2320,7 @@ async def admin_view_operations(update: Update, context: ContextTypes.DEFAULT_TY
         )
 
     # Add buttons
-    keyboard = [
+    keyboard = operations_page_buttons(page, has_next) + [
         [InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -2202,7 +2342,7 @@ async def admin_manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     # Get all donors
-    all_donors = db.get_all_donors()
+    all_donors = await adb.get_all_donors()
 
     if not all_donors:
         # No donors registered
@@ -2260,7 +2400,7 @@ async def admin_edit_user(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     donor_id = parts[3]
 
     # Get donor details
-    donor = db.get_donor_by_id(donor_id)
+    donor = await adb.get_donor_by_id(donor_id)
     if not donor:
         await query.message.reply_text(f"User with ID {donor_id} not found.")
         return
@@ -2308,7 +2448,7 @@ async def admin_delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
     donor_id = parts[3]
 
     # Get donor details
-    donor = db.get_donor_by_id(donor_id)
+    donor = await adb.get_donor_by_id(donor_id)
     if not donor:
         await query.message.reply_text(f"User with ID {donor_id} not found.")
         return
@@ -2344,7 +2484,8 @@ async def admin_confirm_delete_user(update: Update, context: ContextTypes.DEFAUL
 
     # Delete from database
     try:
-        success = db.delete_donor(donor_id)
+        success = await adb.delete_donor(donor_id)
+        matching.invalidate_donor_index()
 
         if success:
             await query.message.reply_text(f"User with ID {donor_id} has been deleted.")
@@ -2365,7 +2506,7 @@ async def admin_view_donors(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     # Get donors (limit to 15 for now)
-    donors = db.get_all_donors()[:15]
+    donors = (await adb.get_all_donors())[:15]
 
     if not donors:
         keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
@@ -2415,7 +2556,7 @@ async def admin_view_requests(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
 
     # Get active requests
-    active_requests = db.get_active_requests()
+    active_requests = await adb.get_active_requests()
 
     if not active_requests:
         keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
@@ -2474,7 +2615,8 @@ async def admin_unrestrict_user(update: Update, context: ContextTypes.DEFAULT_TY
 
     # Update database
     try:
-        success = db.update_donor_restriction(donor_id, False)
+        success = await adb.update_donor_restriction(donor_id, False)
+        matching.invalidate_donor_index()
 
         if success:
             await query.message.reply_text(f"Restriction removed from user with ID {donor_id}.")
@@ -2536,7 +2678,8 @@ async def admin_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     keyboard = [
         [InlineKeyboardButton("Notification Settings", callback_data='admin_notification_settings')],
         [InlineKeyboardButton("System Maintenance", callback_data='admin_system_maintenance')],
-        [InlineKeyboardButton("Database Backup", callback_data='admin_database_backup')],
+        [InlineKeyboardButton("Backups & Export", callback_data='admin_database_backup')],
+        [InlineKeyboardButton("Import Donors", callback_data='admin_import_donors')],
         [InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -2562,7 +2705,7 @@ async def admin_edit_request(update: Update, context: ContextTypes.DEFAULT_TYPE)
     request_id = parts[3]
 
     # Get request details
-    request = db.get_request_by_id(request_id)
+    request = await adb.get_request_by_id(request_id)
     if not request:
         await query.message.reply_text(f"Request with ID {request_id} not found.")
         return
@@ -2647,7 +2790,7 @@ async def admin_set_urgency(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Update database
     try:
         # Modify your database function to update urgency field
-        success = db.update_request_field(request_id, 'urgency', urgency)
+        success = await adb.update_request_field(request_id, 'urgency', urgency)
 
         if success:
             await query.message.reply_text(f"Urgency for request #{request_id} set to {urgency}.")
@@ -2704,9 +2847,14 @@ async def admin_confirm_fulfill(update: Update, context: ContextTypes.DEFAULT_TY
 
     # Update database
     try:
-        success = db.update_request_status(request_id, 'fulfilled')
+        success = await adb.update_request_status(request_id, 'fulfilled')
 
         if success:
+            # Accepted donors have now donated, so they are deferred from matching
+            completed_donors = await adb.complete_request_donations(request_id)
+            if completed_donors:
+                logger.info(f"Recorded completed donations for donors {completed_donors} on request #{request_id}")
+                matching.invalidate_donor_index()
             await query.message.reply_text(f"Request #{request_id} marked as fulfilled.")
         else:
             await query.message.reply_text(f"Failed to update request #{request_id}.")
@@ -2762,7 +2910,7 @@ async def admin_confirm_delete_request(update: Update, context: ContextTypes.DEF
 
     # Delete from database
     try:
-        success = db.delete_request(request_id)
+        success = await adb.delete_request(request_id)
 
         if success:
             await query.message.reply_text(f"Request #{request_id} has been deleted.")
@@ -2783,7 +2931,7 @@ async def admin_manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     # Get all donors
-    all_donors = db.get_all_donors()
+    all_donors = await adb.get_all_donors()
 
     if not all_donors:
         # No donors registered
@@ -2844,7 +2992,7 @@ async def admin_edit_user(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     donor_id = parts[3]
 
     # Get donor details
-    donor = db.get_donor_by_id(donor_id)
+    donor = await adb.get_donor_by_id(donor_id)
     if not donor:
         await query.message.reply_text(f"User with ID {donor_id} not found.")
         return
@@ -2894,13 +3042,13 @@ async def admin_user_history(update: Update, context: ContextTypes.DEFAULT_TYPE)
     donor_id = parts[3]
 
     # Get donor details and stats
-    donor = db.get_donor_by_id(donor_id)
+    donor = await adb.get_donor_by_id(donor_id)
     if not donor:
         await query.message.reply_text(f"User with ID {donor_id} not found.")
         return
 
     # Get donor stats and donation history
-    donor_stats = db.get_donor_stats(donor_id)
+    donor_stats = await adb.get_donor_stats(donor_id)
 
     # Create message
     message = (
@@ -2938,7 +3086,7 @@ async def admin_restrict_user(update: Update, context: ContextTypes.DEFAULT_TYPE
     donor_id = parts[3]
 
     # Get donor details
-    donor = db.get_donor_by_id(donor_id)
+    donor = await adb.get_donor_by_id(donor_id)
     if not donor:
         await query.message.reply_text(f"User with ID {donor_id} not found.")
         return
@@ -2991,7 +3139,8 @@ async def admin_confirm_restrict(update: Update, context: ContextTypes.DEFAULT_T
     # Update database to restrict user
     try:
         # You'll need to implement this function
-        success = db.update_donor_restriction(donor_id, True)
+        success = await adb.update_donor_restriction(donor_id, True)
+        matching.invalidate_donor_index()
 
         if success:
             await query.message.reply_text(f"User with ID {donor_id} has been restricted.")
@@ -3020,7 +3169,7 @@ async def admin_delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
     donor_id = parts[3]
 
     # Get donor details
-    donor = db.get_donor_by_id(donor_id)
+    donor = await adb.get_donor_by_id(donor_id)
     if not donor:
         await query.message.reply_text(f"User with ID {donor_id} not found.")
         return
@@ -3055,7 +3204,8 @@ async def admin_confirm_delete_user(update: Update, context: ContextTypes.DEFAUL
 
     # Delete from database
     try:
-        success = db.delete_donor(donor_id)
+        success = await adb.delete_donor(donor_id)
+        matching.invalidate_donor_index()
 
         if success:
             await query.message.reply_text(f"User with ID {donor_id} has been deleted.")
@@ -3088,7 +3238,7 @@ async def admin_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     search_term = update.message.text.strip()
 
     # Search for donors
-    matching_donors = db.search_donors(search_term)
+    matching_donors = await adb.search_donors(search_term)
 
     if not matching_donors:
         keyboard = [[InlineKeyboardButton("Back to User Management", callback_data='admin_manage_users')]]
@@ -3137,7 +3287,7 @@ async def admin_system_maintenance(update: Update, context: ContextTypes.DEFAULT
     message = (
         "⚙️ *SYSTEM MAINTENANCE*\n\n"
         "*Available Operations:*\n"
-        "• Clear old requests (inactive for 30+ days)\n"
+        f"• Clear old requests (closed for {request_lifecycle.REQUEST_ARCHIVE_AFTER_DAYS}+ days)\n"
         "• Check database integrity\n"
         "• View system logs\n\n"
         "Select an operation:"
@@ -3158,221 +3308,368 @@ async def admin_system_maintenance(update: Update, context: ContextTypes.DEFAULT
     )
 
 
-# Add this function to check if a user is restricted
-def is_user_restricted(telegram_id: int) -> bool:
-    """Check if a user is restricted from using the bot."""
-    try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+async def admin_clear_old_requests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Run the request lifecycle job now: expire stale requests and archive old closed ones."""
+    query = update.callback_query
 
-        # Check if user is restricted
-        cursor.execute(
-            'SELECT is_restricted FROM donors WHERE telegram_id = %s',
-            (telegram_id,)
-        )
+    # Outside the update's session: ensure_partitions rolls back on its own connection
+    # and archiving commits batch by batch
+    expired_ids, archived = await adb.outside_session(adb.run(request_lifecycle.run_lifecycle))
+    for request_id in expired_ids:
+        cancel_escalation(context, str(request_id))
 
-        result = cursor.fetchone()
-        conn.close()
+    keyboard = [[InlineKeyboardButton("Back to Maintenance", callback_data='admin_system_maintenance')]]
+    await query.edit_message_text(
+        "🧹 *OLD REQUESTS CLEARED*\n\n"
+        f"• Expired stale requests: {len(expired_ids)}\n"
+        f"• Archived closed requests: {archived}\n\n"
+        f"Requests closed for more than {request_lifecycle.REQUEST_ARCHIVE_AFTER_DAYS} days are moved "
+        "to the archive together with their donations.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
 
-        if result and result['is_restricted']:
-            return True
-        return False
 
-    except Exception as e:
-        logger.error(f"Error checking user restriction: {e}")
-        return False
+# Add this function to check if a user is restricted
+def is_user_restricted(telegram_id: int) -> bool:
+    """Check if a user is restricted from using the bot."""
+    return db.is_telegram_id_restricted(telegram_id)
 
 
-# Use this function in key action handlers, for example:
-async def request_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Start blood request process."""
-    user_id = update.effective_user.id
+async def restriction_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop restricted users before any other handler or database work runs."""
+    user = update.effective_user
+    if user is None or not is_user_restricted(user.id):
+        return
+    if user.id == int(os.getenv('ADMIN_ID', '0')):
+        return
 
-    # Check if user is restricted
-    if is_user_restricted(user_id):
-        await update.message.reply_text(
+    logger.info(f"Blocked update from restricted user {user.id}")
+    if update.callback_query:
+        await update.callback_query.answer(
+            "⛔ You are currently restricted from using this bot.", show_alert=True
+        )
+    elif update.effective_message:
+        await update.effective_message.reply_text(
             "⛔ *ACCESS RESTRICTED*\n\n"
-            "You are currently restricted from making blood requests.\n"
+            "You are currently restricted from using this bot.\n"
             "Please contact an administrator if you believe this is an error.",
             parse_mode='Markdown'
         )
-        return ConversationHandler.END
+    raise ApplicationHandlerStop
+
 
+# Use this function in key action handlers, for example:
+async def request_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start blood request process."""
+    # Restricted users are stopped by restriction_guard before this runs
     await update.message.reply_text('Let\'s create a blood request. What is the patient\'s name?')
     return REQUEST_NAME
 
 
+def backup_summary(backup):
+    """One line describing a snapshot from database_backup.list_backups()."""
+    rows = sum(table['rows'] for table in backup['tables'].values())
+    created_at = datetime.fromisoformat(backup['created_at'])
+    return (f"{created_at:%Y-%m-%d %H:%M}: {rows} rows, {backup['bytes'] / 1024 / 1024:.1f} MB "
+            f"in {backup['duration_seconds']:.1f} s")
+
+
 async def admin_database_backup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Explain PostgreSQL backup options."""
-    message = "⚠️ *DATABASE BACKUP NOTICE*\n\n" + \
-              "Your database is now PostgreSQL which cannot be backed up with a simple file copy.\n\n" + \
-              "Please use standard PostgreSQL backup tools like:\n" + \
-              "- `pg_dump` command line tool\n" + \
-              "- Database management tools\n" + \
-              "- Railway's built-in backup features\n\n" + \
-              "Contact your database administrator for more details."
+    """Show the latest backups and offer a data export of donors, requests and donations (button or /backup)."""
+    backups = database_backup.list_backups()
+    if database_backup.BACKUP_INTERVAL_HOURS:
+        schedule = f"every {database_backup.BACKUP_INTERVAL_HOURS:g} h"
+    else:
+        schedule = "off"
+
+    message = "💾 *BACKUPS*\n\n" + \
+              f"Snapshots of every table, taken {schedule}; the newest " + \
+              f"{database_backup.BACKUP_RETENTION_COUNT} are kept on the server.\n" + \
+              ("Latest: " + backup_summary(backups[0]) if backups else "No backups yet.") + "\n\n" + \
+              "📤 *DATA EXPORT*\n\n" + \
+              "Export donors, requests and donations as gzip-compressed files, sent to this chat.\n\n" + \
+              "- *CSV* opens in spreadsheets\n" + \
+              "- *JSON Lines* keeps types, one record per line\n\n" + \
+              "Large tables are split into several files."
+
+    keyboard = [
+        [InlineKeyboardButton("💾 Back Up Now", callback_data='admin_backup_now')],
+        [InlineKeyboardButton("📄 CSV", callback_data='admin_export_csv'),
+         InlineKeyboardButton("🧾 JSON Lines", callback_data='admin_export_jsonl')],
+        [InlineKeyboardButton("Back to Settings", callback_data='admin_settings')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        if hasattr(update, 'callback_query'):
+        if update.callback_query:
             query = update.callback_query
             await query.answer()
 
-            keyboard = [[InlineKeyboardButton("Back to Settings", callback_data='admin_settings')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
             await query.edit_message_text(
                 message,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
         else:
+            if update.effective_user.id != int(os.getenv('ADMIN_ID', '0')):
+                await update.message.reply_text("⛔ This command is restricted to administrators only.")
+                return
+
             await update.message.reply_text(
                 message,
+                reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
     except Exception as e:
-        logger.error(f"Error displaying database backup information: {e}")
+        logger.error(f"Error displaying data export options: {e}")
 
-        # Handle error based on update type
-        if hasattr(update, 'callback_query'):
-            keyboard = [[InlineKeyboardButton("Back to Settings", callback_data='admin_settings')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await update.callback_query.edit_message_text(
-                "❌ *DATABASE BACKUP ERROR*\n\n"
-                f"Error: {str(e)}",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        else:
-            await update.message.reply_text(
-                "❌ *DATABASE BACKUP ERROR*\n\n"
-                f"Error: {str(e)}",
-                parse_mode='Markdown'
-            )
+async def admin_backup_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Take a database snapshot now, as the scheduled backup job does."""
+    query = update.callback_query
+    await query.answer()
 
-async def handle_admin_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle callback queries for admin dashboard."""
+    keyboard = [[InlineKeyboardButton("Back to Backups", callback_data='admin_database_backup')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text("⏳ Taking a backup...")
+    try:
+        backup = await adb.run(database_backup.create_backup)
+        await query.edit_message_text(
+            "✅ *BACKUP COMPLETE*\n\n"
+            f"{backup_summary(backup)}\n\n"
+            f"The newest {database_backup.BACKUP_RETENTION_COUNT} backups are kept.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.error(f"Error taking backup: {e}")
+        await query.edit_message_text(
+            "❌ BACKUP ERROR\n\n"
+            f"Error: {str(e)}",
+            reply_markup=reply_markup
+        )
+
+
+async def admin_export_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Export the tables in the chosen format (admin_export_<format>) and send them as documents."""
     query = update.callback_query
-    user_id = update.effective_user.id
-    admin_id = int(os.getenv('ADMIN_ID', '0'))
+    await query.answer()
+
+    export_format = context.args[0]
+    keyboard = [[InlineKeyboardButton("Back to Settings", callback_data='admin_settings')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    if export_format not in data_export.EXPORT_FORMATS:
+        await query.edit_message_text("❌ Unknown export format.", reply_markup=reply_markup)
+        return
+
+    await query.edit_message_text(f"⏳ Exporting data as {export_format.upper()}...")
 
+    directory = None
     try:
-        # Always acknowledge the callback query first
-        await query.answer()
+        # Tables are streamed to disk off the event loop; only one file part is read at a time to upload
+        directory, exported = await adb.run(data_export.export_tables, export_format)
+
+        summary = []
+        for table, paths, rows in exported:
+            for number, path in enumerate(paths, 1):
+                part = f" (part {number} of {len(paths)})" if len(paths) > 1 else ""
+                with open(path, 'rb') as document:
+                    await context.bot.send_document(
+                        chat_id=query.message.chat_id,
+                        document=document,
+                        filename=os.path.basename(path),
+                        caption=f"{table}: {rows} rows{part}"
+                    )
+            summary.append(f"• {table}: {rows} rows, {len(paths)} file(s)")
 
-        # Check if user is admin
-        if user_id != admin_id:
-            await query.edit_message_text("⛔ This action is restricted to administrators only.")
-            return
+        await query.message.reply_text(
+            "✅ *EXPORT COMPLETE*\n\n" + "\n".join(summary),
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.error(f"Error exporting data: {e}")
+        await query.message.reply_text(
+            "❌ *DATA EXPORT ERROR*\n\n"
+            f"Error: {str(e)}",
+            reply_markup=reply_markup
+        )
+    finally:
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+# Conversation state for the donor import upload
+DONOR_IMPORT_FILE = 505
+
+# Largest file the Bot API lets a bot download
+DONOR_IMPORT_MAX_BYTES = 20 * 1024 * 1024
+
+DONOR_IMPORT_INSTRUCTIONS = (
+    "📥 *IMPORT DONORS*\n\n"
+    "Upload a *CSV* or *XLSX* file (up to 20 MB) with a header row and these columns:\n"
+    "- *name*, *district*, *blood_group* (required)\n"
+    "- *telegram_id* and/or *phone*\n"
+    "- *age*, *division*, *area*, *gender* (optional)\n\n"
+    "Rows with a Telegram ID update that donor or add a new one. "
+    "Rows with only a phone number update the donor with that number.\n"
+    "Invalid rows are skipped and listed in an error report."
+)
 
-        callback_data = query.data
 
-        if callback_data == 'admin_messaging_menu':
-            await admin_messaging_menu(update, context)
-            return
+async def admin_import_donors_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Explain how to import donors (settings button)."""
+    query = update.callback_query
+    await query.answer()
 
-        # Handle different admin actions based on the callback data
-        if callback_data == 'admin_stats':
-            await admin_stats_command(update, context)
-        elif callback_data == 'admin_view_donors':
-            # Handle viewing donors
-            donors = db.get_all_donors()
+    keyboard = [[InlineKeyboardButton("Back to Settings", callback_data='admin_settings')]]
+    await query.edit_message_text(
+        DONOR_IMPORT_INSTRUCTIONS + "\n\nSend /import\\_donors to start.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
 
-            if not donors:
-                await query.edit_message_text("No donors registered yet.")
-                return
 
-            # Create a simple donor list for now
-            donor_list = "👑 *ADMIN: ALL DONORS*\n\n"
-            for donor in donors[:15]:  # Show first 15 to avoid message too long
-                donor_list += (
-                    f"*ID:* {donor['id']} | *Name:* {donor['name']}\n"
-                    f"*Blood:* {donor['blood_group']} | *Phone:* {donor['phone']}\n"
-                    f"*Location:* {donor['district']}, {donor['division']}\n"
-                    f"---------------------\n"
-                )
+async def admin_import_donors_init(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start the donor import flow (/import_donors) - ADMIN ONLY."""
+    if update.effective_user.id != int(os.getenv('ADMIN_ID', '0')):
+        await update.message.reply_text("⛔ This command is restricted to administrators only.")
+        return ConversationHandler.END
 
-            # Add back button
-            keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(
+        DONOR_IMPORT_INSTRUCTIONS + "\n\nSend the file now or use /cancel to abort.",
+        parse_mode='Markdown'
+    )
 
-            await query.edit_message_text(donor_list, reply_markup=reply_markup, parse_mode='Markdown')
-        elif callback_data == 'admin_view_requests':
-            # Handle viewing requests
-            active_requests = db.get_active_requests()
+    return DONOR_IMPORT_FILE
 
-            if not active_requests:
-                await query.edit_message_text("No active requests at the moment.")
-                return
 
-            req_list = "👑 *ADMIN: ACTIVE REQUESTS*\n\n"
-            for req in active_requests[:15]:  # Show first 15 to avoid message too long
-                req_list += (
-                    f"*ID:* {req['id']} | *Patient:* {req['name']}\n"
-                    f"*Blood:* {req['blood_group']} | *Urgency:* {req['urgency']}\n"
-                    f"*Hospital:* {req['hospital_name']}\n"
-                    f"*Contact:* {req['phone']}\n"
-                    f"---------------------\n"
+async def admin_import_donors_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Import the uploaded donor file and reply with a summary and the rejected rows."""
+    document = update.message.document
+    extension = os.path.splitext(document.file_name or '')[1].lower()
+    if extension not in ('.csv', '.xlsx'):
+        await update.message.reply_text("Please send a .csv or .xlsx file, or use /cancel to abort.")
+        return DONOR_IMPORT_FILE
+    if document.file_size and document.file_size > DONOR_IMPORT_MAX_BYTES:
+        await update.message.reply_text("This file is larger than 20 MB. Split it into smaller files, "
+                                        "or use /cancel to abort.")
+        return DONOR_IMPORT_FILE
+
+    status = await update.message.reply_text("⏳ Importing donors...")
+    directory = tempfile.mkdtemp(prefix='blood_bot_import_')
+    try:
+        path = os.path.join(directory, f"donors{extension}")
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+
+        # Read, validated and loaded as a stream off the event loop
+        report = await adb.run(donor_import.import_file, path)
+
+        await status.edit_text(
+            "✅ *IMPORT COMPLETE*\n\n"
+            f"• Rows read: {report['rows']}\n"
+            f"• Donors added: {report['inserted']}\n"
+            f"• Donors updated: {report['updated']}\n"
+            f"• Rows rejected: {len(report['errors'])}",
+            parse_mode='Markdown'
+        )
+
+        if report['errors']:
+            report_path = os.path.join(directory, 'donor_import_errors.csv')
+            await adb.run(donor_import.write_error_report, report['errors'], report_path)
+            with open(report_path, 'rb') as errors:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=errors,
+                    filename='donor_import_errors.csv',
+                    caption=f"{len(report['errors'])} rejected rows, by line number"
                 )
+    except donor_import.ImportFileError as e:
+        await status.edit_text(f"❌ {e}\n\nSend a corrected file or use /cancel to abort.")
+        return DONOR_IMPORT_FILE
+    except Exception as e:
+        logger.error(f"Error importing donors: {e}")
+        await status.edit_text(f"❌ DONOR IMPORT ERROR\n\nError: {str(e)}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
 
-            # Add back button
-            keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    return ConversationHandler.END
 
-            await query.edit_message_text(req_list, reply_markup=reply_markup, parse_mode='Markdown')
-        elif callback_data == 'admin_view_operations':
-            await admin_view_operations(update, context)
-        elif callback_data == 'admin_manage_requests':
-            await admin_manage_requests(update, context)
-        elif callback_data == 'admin_manage_users':
-            await admin_manage_users(update, context)
-        elif callback_data.startswith('admin_edit_user_'):
-            await admin_edit_user(update, context)
-        elif callback_data.startswith('admin_delete_user_'):
-            await admin_delete_user(update, context)
-        elif callback_data.startswith('admin_confirm_delete_user_'):
-            await admin_confirm_delete_user(update, context)
-        elif callback_data.startswith('admin_user_history_'):
-            await admin_user_history(update, context)
-        elif callback_data.startswith('admin_restrict_user_'):
-            await admin_restrict_user(update, context)
-        elif callback_data.startswith('admin_confirm_restrict_'):
-            await admin_confirm_restrict(update, context)
-        elif callback_data.startswith('admin_unrestrict_user_'):
-            await admin_unrestrict_user(update, context)
-        elif callback_data == 'admin_search_users':
-            await admin_search_users(update, context)
-        elif callback_data.startswith('admin_edit_request_'):
-            await admin_edit_request(update, context)
-        elif callback_data.startswith('admin_deactivate_request_'):
-            await admin_deactivate_request(update, context)
-        elif callback_data.startswith('admin_confirm_deactivate_'):
-            await admin_confirm_deactivate(update, context)
-        elif callback_data.startswith('admin_change_urgency_'):
-            await admin_change_urgency(update, context)
-        elif callback_data.startswith('admin_set_urgency_'):
-            await admin_set_urgency(update, context)
-        elif callback_data.startswith('admin_fulfill_request_'):
-            await admin_fulfill_request(update, context)
-        elif callback_data.startswith('admin_confirm_fulfill_'):
-            await admin_confirm_fulfill(update, context)
-        elif callback_data.startswith('admin_delete_request_'):
-            await admin_delete_request(update, context)
-        elif callback_data.startswith('admin_confirm_delete_request_'):
-            await admin_confirm_delete_request(update, context)
-        elif callback_data == 'admin_settings':
-            await admin_settings(update, context)
-        elif callback_data == 'admin_system_maintenance':
-            await admin_system_maintenance(update, context)
-        elif callback_data == 'admin_database_backup':
-            await admin_database_backup(update, context)
-        elif callback_data == 'admin_back_to_dashboard':
-            # Return to admin dashboard
-            await admin_dashboard_message(update, context)
-        else:
+async def admin_view_donors_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the first registered donors to the admin."""
+    query = update.callback_query
+    donors = await adb.get_all_donors()
+
+    if not donors:
+        await query.edit_message_text("No donors registered yet.")
+        return
+
+    # Create a simple donor list for now
+    donor_list = "👑 *ADMIN: ALL DONORS*\n\n"
+    for donor in donors[:15]:  # Show first 15 to avoid message too long
+        donor_list += (
+            f"*ID:* {donor['id']} | *Name:* {donor['name']}\n"
+            f"*Blood:* {donor['blood_group']} | *Phone:* {donor['phone']}\n"
+            f"*Location:* {donor['district']}, {donor['division']}\n"
+            f"---------------------\n"
+        )
+
+    # Add back button
+    keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text(donor_list, reply_markup=reply_markup, parse_mode='Markdown')
+
+
+async def admin_view_active_requests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the first active requests to the admin."""
+    query = update.callback_query
+    active_requests = await adb.get_active_requests()
+
+    if not active_requests:
+        await query.edit_message_text("No active requests at the moment.")
+        return
+
+    req_list = "👑 *ADMIN: ACTIVE REQUESTS*\n\n"
+    for req in active_requests[:15]:  # Show first 15 to avoid message too long
+        req_list += (
+            f"*ID:* {req['id']} | *Patient:* {req['name']}\n"
+            f"*Blood:* {req['blood_group']} | *Urgency:* {req['urgency']}\n"
+            f"*Hospital:* {req['hospital_name']}\n"
+            f"*Contact:* {req['phone']}\n"
+            f"---------------------\n"
+        )
+
+    # Add back button
+    keyboard = [[InlineKeyboardButton("Back to Dashboard", callback_data='admin_back_to_dashboard')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text(req_list, reply_markup=reply_markup, parse_mode='Markdown')
+
+
+async def handle_admin_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle callback queries for admin dashboard."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    admin_id = int(os.getenv('ADMIN_ID', '0'))
+
+    try:
+        # Always acknowledge the callback query first
+        await query.answer()
+
+        # Check if user is admin
+        if user_id != admin_id:
+            await query.edit_message_text("⛔ This action is restricted to administrators only.")
+            return
+
+        # Route to the matching admin action
+        result = await ADMIN_CALLBACK_ROUTES.dispatch(update, context)
+        if result is callback_router.NO_ROUTE:
             # For any unimplemented admin action, use edit_message_text instead of reply_text
-            await query.edit_message_text(f"Admin action '{callback_data}' is not implemented yet.")
+            await query.edit_message_text(f"Admin action '{query.data}' is not implemented yet.")
 
     except Exception as e:
         logger.error(f"Error handling admin callback: {e}")
@@ -3489,7 +3786,7 @@ async def support_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
 
             # Store in database if needed
-            store_support_message(user_info, support_message)
+            await adb.store_support_message(user_info, support_message)
 
         except Exception as e:
             logger.error(f"Error sending support message: {e}")
@@ -3528,7 +3825,7 @@ async def admin_view_support_messages(update: Update, context: ContextTypes.DEFA
             return
 
         # Get support messages from database
-        support_messages = get_support_messages()
+        support_messages = await adb.get_support_messages()
 
         if not support_messages:
             message = "📬 *SUPPORT MESSAGES*\n\nNo support messages found."
@@ -3587,19 +3884,9 @@ async def admin_mark_support_read(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
 
     try:
-        # Update database with PostgreSQL
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-        UPDATE support_messages
-        SET status = %s
-        WHERE status = %s
-        ''', ('read', 'pending'))
-
-        rows_affected = cursor.rowcount
-        conn.commit()
-        conn.close()
+        rows_affected = await adb.mark_support_messages_read()
+        if rows_affected is None:
+            raise RuntimeError("database update failed")
 
         if rows_affected > 0:
             await query.edit_message_text(
@@ -3674,7 +3961,7 @@ async def admin_reply_to_user(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
 
             # Record the reply in the database
-            record_admin_reply(target_user_id, admin_reply)
+            await adb.record_admin_reply(target_user_id, admin_reply)
 
         except ValueError:
             await update.message.reply_text("Invalid user ID. Please provide a valid numeric ID.")
@@ -3742,7 +4029,7 @@ async def send_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, t
         )
 
         # Record the reply in the database if needed
-        record_admin_reply(target_user_id, reply_message)
+        await adb.record_admin_reply(target_user_id, reply_message)
 
         return ConversationHandler.END
 
@@ -3910,10 +4197,10 @@ async def admin_broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_
     try:
         # Get donors based on target type
         if target_type == 'all':
-            donors = db.get_all_donors()
+            donors = await adb.get_all_donors(reachable_only=True)
         else:
             # Target specific blood group
-            donors = db.get_donors_by_blood_groups([target_type])
+            donors = await adb.get_donors_by_blood_groups([target_type], reachable_only=True)
 
         if not donors:
             await query.edit_message_text(
@@ -3923,7 +4210,7 @@ async def admin_broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_
             return ConversationHandler.END
 
         # Save to database - using properly imported function
-        broadcast_id = save_broadcast_message(
+        broadcast_id = await adb.save_broadcast_message(
             admin_id=update.effective_user.id,
             message_text=broadcast_message,
             target_type=target_type
@@ -3959,12 +4246,15 @@ async def admin_broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_
                 await asyncio.sleep(0.1)
 
             except Exception as e:
+                if is_permanent_delivery_error(e):
+                    await mark_donor_unreachable(donor, e)
+                    continue
                 logger.error(f"Error sending broadcast to donor {donor['id']}: {e}")
                 continue
 
         # Update database with recipient count
         if broadcast_id:
-            update_broadcast_recipient_count(broadcast_id, success_count)
+            await adb.update_broadcast_recipient_count(broadcast_id, success_count)
 
         # Final confirmation
         await context.bot.edit_message_text(
@@ -4014,7 +4304,7 @@ async def admin_personalized_user_id(update: Update, context: ContextTypes.DEFAU
         context.user_data['target_user_id'] = user_id
 
         # Check if user exists
-        donor = db.get_donor_by_telegram_id(user_id)
+        donor = await adb.get_donor_by_telegram_id(user_id)
         user_found = donor is not None
 
         if user_found:
@@ -4106,7 +4396,7 @@ async def admin_personalized_confirm(update: Update, context: ContextTypes.DEFAU
         )
 
         # Save to database
-        save_personalized_message(
+        await adb.save_personalized_message(
             admin_id=update.effective_user.id,
             user_id=user_id,
             message_text=message_text
@@ -4140,7 +4430,7 @@ async def admin_view_messages(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     try:
         # Get recent broadcasts
-        broadcasts = get_recent_broadcasts()
+        broadcasts = await adb.get_recent_broadcasts()
 
         message = "📋 *MESSAGE HISTORY*\n\n"
 
@@ -4253,28 +4543,6 @@ async def debug_admin_messaging(update: Update, context: ContextTypes.DEFAULT_TY
         parse_mode='Markdown'
     )
 
-def delete_broadcast_message(broadcast_id):
-    """Delete a broadcast message from the database."""
-    try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Execute the delete query
-        cursor.execute('DELETE FROM broadcast_messages WHERE id = %s', (broadcast_id,))
-        
-        # Get the number of affected rows to confirm deletion
-        affected_rows = cursor.rowcount
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        # Return True if a row was deleted, False otherwise
-        return affected_rows > 0
-    except Exception as e:
-        logger.error(f"Error deleting broadcast message: {e}")
-        return False
-
 # 2. Now, let's add functions to handle broadcast deletion in the main application:
 
 async def admin_delete_broadcast_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -4318,7 +4586,7 @@ async def admin_confirm_delete_broadcast(update: Update, context: ContextTypes.D
     broadcast_id = parts[4]
     
     # Delete from database
-    success = delete_broadcast_message(broadcast_id)
+    success = await adb.delete_broadcast_message(broadcast_id)
     
     if success:
         await query.edit_message_text(
@@ -4340,11 +4608,216 @@ async def admin_confirm_delete_broadcast(update: Update, context: ContextTypes.D
         reply_markup=reply_markup
     )
 
+# Callback routing tables. Exact strings are dict lookups; prefixes go through a trie and
+# typed payloads (e.g. admin_edit_user_<donor_id>) are parsed into context.args.
+BUTTON_CALLBACK_ROUTES = callback_router.CallbackRouter('button')
+BUTTON_CALLBACK_ROUTES.add_exact('register_donor', show_donor_terms)
+BUTTON_CALLBACK_ROUTES.add_exact('accept_donor_terms', accept_donor_terms)
+BUTTON_CALLBACK_ROUTES.add_exact('decline_donor_terms', decline_donor_terms)
+BUTTON_CALLBACK_ROUTES.add_exact('accept_donation_terms', accept_donation_terms)
+BUTTON_CALLBACK_ROUTES.add_exact('decline_donation_terms', decline_donation_terms)
+BUTTON_CALLBACK_ROUTES.add_exact('request_blood', start_blood_request)
+BUTTON_CALLBACK_ROUTES.add_exact('view_donors', open_view_donors)
+BUTTON_CALLBACK_ROUTES.add_exact('view_requests', open_view_requests)
+BUTTON_CALLBACK_ROUTES.add_exact('open_admin_dashboard', open_admin_dashboard)
+BUTTON_CALLBACK_ROUTES.add_exact('open_donor_dashboard', open_donor_dashboard)
+BUTTON_CALLBACK_ROUTES.add_prefix('accept_', show_donation_terms, (int, int))
+BUTTON_CALLBACK_ROUTES.add_prefix('decline_', decline_donation, (int, int))
+
+ADMIN_CALLBACK_ROUTES = callback_router.CallbackRouter('admin')
+ADMIN_CALLBACK_ROUTES.add_exact('admin_messaging_menu', admin_messaging_menu)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_stats', admin_stats_command)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_view_donors', admin_view_donors_list)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_view_requests', admin_view_active_requests)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_view_operations', admin_view_operations)
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_view_operations_', admin_view_operations, (int,))
+ADMIN_CALLBACK_ROUTES.add_exact('admin_view_messages', admin_view_messages)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_manage_requests', admin_manage_requests)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_manage_users', admin_manage_users)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_search_users', admin_search_users)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_settings', admin_settings)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_system_maintenance', admin_system_maintenance)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_clear_old_requests', admin_clear_old_requests)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_database_backup', admin_database_backup)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_backup_now', admin_backup_now)
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_export_', admin_export_data, (str,))
+ADMIN_CALLBACK_ROUTES.add_exact('admin_import_donors', admin_import_donors_info)
+ADMIN_CALLBACK_ROUTES.add_exact('admin_back_to_dashboard', admin_dashboard_message)
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_edit_user_', admin_edit_user, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_delete_user_', admin_delete_user, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_confirm_delete_user_', admin_confirm_delete_user, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_user_history_', admin_user_history, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_restrict_user_', admin_restrict_user, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_confirm_restrict_', admin_confirm_restrict, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_unrestrict_user_', admin_unrestrict_user, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_edit_request_', admin_edit_request, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_deactivate_request_', admin_deactivate_request, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_confirm_deactivate_', admin_confirm_deactivate, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_change_urgency_', admin_change_urgency, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_set_urgency_', admin_set_urgency, (int, str))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_fulfill_request_', admin_fulfill_request, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_confirm_fulfill_', admin_confirm_fulfill, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_delete_request_', admin_delete_request, (int,))
+ADMIN_CALLBACK_ROUTES.add_prefix('admin_confirm_delete_request_', admin_confirm_delete_request, (int,))
+
+# Top-level routes for callbacks that are not claimed by a conversation handler
+CALLBACK_ROUTES = callback_router.CallbackRouter('callbacks')
+CALLBACK_ROUTES.add_exact('show_main_menu', show_main_menu)
+CALLBACK_ROUTES.add_exact('refresh_donor_dashboard', open_donor_dashboard)
+CALLBACK_ROUTES.add_exact('open_donor_dashboard', open_donor_dashboard)
+CALLBACK_ROUTES.add_exact('admin_view_support', admin_view_support_messages)
+CALLBACK_ROUTES.add_exact('admin_mark_support_read', admin_mark_support_read)
+CALLBACK_ROUTES.add_exact('send_thanks', send_thanks)
+CALLBACK_ROUTES.add_prefix('admin_delete_broadcast_', admin_delete_broadcast_prompt, (int,))
+CALLBACK_ROUTES.add_prefix('admin_confirm_delete_broadcast_', admin_confirm_delete_broadcast, (int,))
+CALLBACK_ROUTES.add_prefix('admin_', handle_admin_callbacks)
+CALLBACK_ROUTES.add_prefix('', button_callback)
+
+
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Single entry point for callback queries outside conversations."""
+    await CALLBACK_ROUTES.dispatch(update, context)
+
+
+async def route_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show callback routing metrics - ADMIN ONLY."""
+    if update.effective_user.id != int(os.getenv('ADMIN_ID', '0')):
+        await update.message.reply_text("⛔ This command is restricted to administrators only.")
+        return
+
+    lines = []
+    for router in (CALLBACK_ROUTES, BUTTON_CALLBACK_ROUTES, ADMIN_CALLBACK_ROUTES):
+        lines.append(f"[{router.name}]")
+        lines.extend(router.metrics_report() or ["No callbacks routed yet"])
+        lines.append("")
+
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+
+async def db_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show database thread pool metrics - ADMIN ONLY."""
+    if update.effective_user.id != int(os.getenv('ADMIN_ID', '0')):
+        await update.message.reply_text("⛔ This command is restricted to administrators only.")
+        return
+
+    await update.message.reply_text("\n".join(adb.metrics_report())[:4000])
+
+
+async def flush_notification_log(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback: persist the in-memory donor notification log."""
+    await notification_limits.flush_notifications()
+
+
+async def flush_chat_cache(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback: persist chat info learned since the last flush."""
+    await chat_cache.flush_chats()
+
+
+async def run_request_lifecycle(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback: expire stale requests and archive old closed ones."""
+    expired_ids, _ = await adb.run(request_lifecycle.run_lifecycle)
+    for request_id in expired_ids:
+        cancel_escalation(context, str(request_id))
+
+
+async def run_database_backup(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback: snapshot the database and rotate old backups."""
+    try:
+        await adb.run(database_backup.create_backup)
+    except Exception as e:
+        logger.error(f"Scheduled backup failed: {e}")
+
+
+async def log_startup_time(application: Application) -> None:
+    """Log how long the bot took from process start until it is ready to poll."""
+    logger.info(f"Startup finished in {(time.perf_counter() - STARTUP_STARTED_AT) * 1000:.0f} ms "
+                f"(imports {(STARTUP_IMPORTED_AT - STARTUP_STARTED_AT) * 1000:.0f} ms)")
+
+
+async def flush_on_shutdown(application: Application) -> None:
+    """Persist any queued donor notifications and chat info before the bot stops."""
+    await notification_limits.flush_notifications()
+    await chat_cache.flush_chats()
+    adb.shutdown()
+    db.close_pool()
+
+
+async def remember_chat_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep the chat cache fresh from every incoming update, saving later get_chat calls."""
+    chat_cache.remember_user(update.effective_user)
+
+
+class UnitOfWorkApplication(Application):
+    """Application that gives each update one database session (see async_db.session).
+
+    All database work done while handling an update shares one connection and
+    transaction. It is committed before each Bot API call (see
+    CommitBeforeSendRequest) and once the update is processed; if a handler
+    raises, the writes since the last commit are rolled back.
+    """
+
+    async def process_update(self, update: object) -> None:
+        async with adb.session():
+            await super().process_update(update)
+
+    async def process_error(self, update, error, job=None, coroutine=None) -> bool:
+        active = current_session.get()
+        if active is not None:
+            active.failed = True
+        return await super().process_error(update, error, job=job, coroutine=coroutine)
+
+
+class CommitBeforeSendRequest(HTTPXRequest):
+    """Bot API requests that first commit the update's database session (see async_db.commit).
+
+    Donors and admins are then only told about rows that are saved, and the
+    session's connection goes back to the pool instead of idling in a
+    transaction while Telegram answers.
+    """
+
+    async def do_request(self, *args, **kwargs):
+        await adb.commit()
+        return await super().do_request(*args, **kwargs)
+
+
 def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder().application_class(UnitOfWorkApplication).token(BOT_TOKEN).persistence(PostgresPersistence()).post_init(log_startup_time)
+        .request(CommitBeforeSendRequest(connection_pool_size=256)).post_shutdown(flush_on_shutdown).build()
+    )
 
-    # Initialize database tables
-    initialize_database()
+    # Check the schema version, migrating only when it is behind
+    if not db.ensure_schema():
+        raise SystemExit("The database schema is not ready (see the errors above), not starting the bot")
+
+    # Restore per-donor notification counters and schedule their persistence
+    notification_limits.load_notification_history()
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            flush_notification_log,
+            interval=notification_limits.NOTIFICATION_FLUSH_INTERVAL_SECONDS,
+            first=notification_limits.NOTIFICATION_FLUSH_INTERVAL_SECONDS,
+            name='flush_notification_log'
+        )
+        application.job_queue.run_repeating(
+            flush_chat_cache,
+            interval=chat_cache.CHAT_CACHE_FLUSH_INTERVAL_SECONDS,
+            first=chat_cache.CHAT_CACHE_FLUSH_INTERVAL_SECONDS,
+            name='flush_chat_cache'
+        )
+        application.job_queue.run_repeating(
+            run_request_lifecycle,
+            interval=request_lifecycle.REQUEST_LIFECYCLE_INTERVAL_SECONDS,
+            first=60,
+            name='run_request_lifecycle'
+        )
+        if database_backup.BACKUP_INTERVAL_HOURS:
+            application.job_queue.run_repeating(
+                run_database_backup,
+                interval=database_backup.BACKUP_INTERVAL_HOURS * 3600,
+                first=300,
+                name='run_database_backup'
+            )
 
     # Define error handler
     async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -4357,6 +4830,13 @@ def main():
                 "Sorry, something went wrong. Please try again later."
             )
 
+    # Short-circuit restricted users before anything else runs
+    db.load_restricted_telegram_ids()
+    application.add_handler(TypeHandler(Update, restriction_guard), group=-3)
+
+    # Learn usernames from every update before any other handler runs
+    application.add_handler(TypeHandler(Update, remember_chat_info), group=-2)
+
     # Add debugging handlers
     application.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND,
@@ -4380,7 +4860,7 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
-        persistent=False,  # Set to True only if you have persistence configured
+        persistent=True,
         name="support_conversation",
         allow_reentry=True,
         per_message=False
@@ -4397,7 +4877,9 @@ def main():
             DIRECT_DONOR_DIVISION: [MessageHandler(filters.TEXT & ~filters.COMMAND, direct_donor_division)],
             DIRECT_DONOR_DISTRICT: [MessageHandler(filters.TEXT & ~filters.COMMAND, direct_donor_district)],
         },
-        fallbacks=[CommandHandler("cancel", help_command)]
+        fallbacks=[CommandHandler("cancel", help_command)],
+        persistent=True,
+        name="direct_donor_registration"
     )
 
     # Post-acceptance donor info collection conversation handler
@@ -4408,6 +4890,7 @@ def main():
             DONOR_PHONE_AFTER_ACCEPT: [MessageHandler(filters.TEXT & ~filters.COMMAND, donor_phone_after_accept)],
         },
         fallbacks=[CommandHandler("cancel", help_command)],
+        persistent=True,
         name="post_accept_conversation"
     )
 
@@ -4435,6 +4918,7 @@ def main():
         },
         fallbacks=[CommandHandler("cancel", help_command)],
         per_message=True,
+        persistent=True,
         name="donor_registration"
     )
 
@@ -4458,6 +4942,7 @@ def main():
         },
         fallbacks=[CommandHandler("cancel", help_command)],
         per_message=False,
+        persistent=True,
         name="blood_request"
     )
     # Admin messaging conversation handlers
@@ -4471,6 +4956,7 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        persistent=True,
         name="admin_broadcast_conversation"
     )
 
@@ -4485,12 +4971,24 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        persistent=True,
         name="admin_personalized_conversation"
     )
 
+    donor_import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("import_donors", admin_import_donors_init)],
+        states={
+            DONOR_IMPORT_FILE: [MessageHandler(filters.Document.ALL, admin_import_donors_file)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        persistent=True,
+        name="admin_donor_import_conversation"
+    )
+
     # Add these handlers to your application
     application.add_handler(broadcast_conv_handler, group=1)
     application.add_handler(personalized_conv_handler, group=1)
+    application.add_handler(donor_import_conv_handler, group=1)
 
     # Add command handler for admin messaging
     application.add_handler(CommandHandler("message", admin_messaging_menu))
@@ -4501,6 +4999,7 @@ def main():
             ADMIN_REPLY_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_reply_message)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        persistent=True,
         name="admin_reply_conversation"
     )
 
@@ -4531,6 +5030,8 @@ def main():
     application.add_handler(CommandHandler("dashboard", admin_dashboard))
     application.add_handler(CommandHandler("stats", admin_stats_command))
     application.add_handler(CommandHandler("operations", admin_operation_list_command))
+    application.add_handler(CommandHandler("routestats", route_stats_command))
+    application.add_handler(CommandHandler("dbstats", db_stats_command))
 
     # Only add these if the functions are actually defined
     if 'admin_manage_requests' in globals():
@@ -4542,25 +5043,8 @@ def main():
     if 'admin_database_backup' in globals():
         application.add_handler(CommandHandler("backup", admin_database_backup))
 
-    # Add specific callback handlers
-    application.add_handler(CallbackQueryHandler(show_main_menu, pattern='^show_main_menu$'))
-    application.add_handler(CallbackQueryHandler(lambda update, context: refresh_donor_dashboard(update),
-                                                 pattern='^refresh_donor_dashboard$'))
-    application.add_handler(CallbackQueryHandler(lambda update, context: refresh_donor_dashboard(update),
-                                                 pattern='^open_donor_dashboard$'))
-    application.add_handler(CallbackQueryHandler(admin_delete_broadcast_prompt, pattern='^admin_delete_broadcast_'))
-    application.add_handler(CallbackQueryHandler(admin_confirm_delete_broadcast, pattern='^admin_confirm_delete_broadcast_'))
-
-    # Update the callback handler to include admin_view_support
-    application.add_handler(CallbackQueryHandler(admin_view_support_messages, pattern='^admin_view_support$'))
-    application.add_handler(CallbackQueryHandler(admin_mark_support_read, pattern='^admin_mark_support_read$'))
-    application.add_handler(CallbackQueryHandler(send_thanks, pattern='^send_thanks$'))
-
-    # Admin callback handlers - these should be before the general button_callback
-    application.add_handler(CallbackQueryHandler(handle_admin_callbacks, pattern='^admin_'))
-
-    # Add general callback handler last (catch-all)
-    application.add_handler(CallbackQueryHandler(button_callback))
+    # All remaining callbacks go through the callback router (see CALLBACK_ROUTES)
+    application.add_handler(CallbackQueryHandler(route_callback))
 
     # Add unhandled message handler to help with debugging
     application.add_handler(MessageHandler(filters.ALL, unhandled_message), group=999)
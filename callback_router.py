@@ -0,0 +1,117 @@
+import time
+import logging
+
+logger = logging.getLogger('callback_router')
+
+# Returned by CallbackRouter.dispatch when no route matches and no default is given
+NO_ROUTE = object()
+
+
+class CallbackRouter:
+    """Dispatch callback_data strings to handlers.
+
+    Exact routes are a dict lookup. Prefix routes are stored in a character
+    trie and the longest registered prefix wins, so routing costs at most one
+    step per character of callback_data however many routes there are.
+
+    A prefix route may declare arg_types: the rest of the callback_data is
+    split on '_' into that many fields (the last field keeps any remaining
+    underscores), each field is converted with its type, and the values are
+    handed to the handler as context.args. Payloads that do not parse do not
+    match that route.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._exact = {}
+        self._trie = {}
+        # route -> {'calls', 'errors', 'total_ms', 'max_ms'}
+        self.metrics = {}
+
+    def add_exact(self, data, handler):
+        """Route callback_data equal to data."""
+        self._exact[data] = (data, handler)
+
+    def add_prefix(self, prefix, handler, arg_types=()):
+        """Route callback_data starting with prefix, parsing the rest with arg_types."""
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = (prefix + '*', handler, tuple(arg_types))
+
+    @staticmethod
+    def _parse(payload, arg_types):
+        if not arg_types:
+            return []
+        fields = payload.split('_', len(arg_types) - 1)
+        if len(fields) != len(arg_types):
+            return None
+        try:
+            return [arg_type(field) for arg_type, field in zip(arg_types, fields)]
+        except ValueError:
+            return None
+
+    def resolve(self, data):
+        """Return (route, handler, args) for callback_data, or None if nothing matches."""
+        exact = self._exact.get(data)
+        if exact is not None:
+            return exact[0], exact[1], []
+
+        # Collect every prefix route along the path, then try the longest first
+        matches = []
+        node = self._trie
+        if None in node:
+            matches.append((0, node[None]))
+        for depth, char in enumerate(data, 1):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                matches.append((depth, node[None]))
+
+        for depth, (route, handler, arg_types) in reversed(matches):
+            args = self._parse(data[depth:], arg_types)
+            if args is not None:
+                return route, handler, args
+        return None
+
+    def _record(self, route, elapsed_ms, failed=False):
+        stats = self.metrics.setdefault(route, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['calls'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if failed:
+            stats['errors'] += 1
+
+    async def dispatch(self, update, context, default=NO_ROUTE):
+        """Run the handler for update.callback_query.data and return its result.
+
+        Returns default (NO_ROUTE unless given) when no route matches.
+        """
+        data = update.callback_query.data or ''
+        match = self.resolve(data)
+        if match is None:
+            logger.debug(f"[{self.name}] No route for callback data '{data}'")
+            self._record('<unmatched>', 0.0)
+            return default
+
+        route, handler, args = match
+        context.args = args
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(update, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(route, (time.perf_counter() - started) * 1000, failed)
+
+    def metrics_report(self):
+        """Return one line per route, busiest first."""
+        lines = []
+        for route, stats in sorted(self.metrics.items(), key=lambda item: item[1]['calls'], reverse=True):
+            mean_ms = stats['total_ms'] / stats['calls'] if stats['calls'] else 0.0
+            lines.append(f"{route}: {stats['calls']} calls, {stats['errors']} errors, "
+                         f"mean {mean_ms:.1f} ms, max {stats['max_ms']:.1f} ms")
+        return lines
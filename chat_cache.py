@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import async_db as adb
+
+logger = logging.getLogger('chat_cache')
+
+# How long a looked-up Telegram username is trusted before asking the Bot API again
+CHAT_CACHE_TTL_SECONDS = int(os.getenv('CHAT_CACHE_TTL_SECONDS', '3600'))
+
+# Most chats kept in memory; the least recently used are evicted first
+CHAT_CACHE_MAX_SIZE = int(os.getenv('CHAT_CACHE_MAX_SIZE', '10000'))
+
+# How often changed chat info is written to the telegram_chats table
+CHAT_CACHE_FLUSH_INTERVAL_SECONDS = int(os.getenv('CHAT_CACHE_FLUSH_INTERVAL_SECONDS', '60'))
+
+# chat_id -> (username or None, expires_at, stored_at), ordered from least to most recently used.
+# stored_at is when the chat's telegram_chats row was last written, or queued to be.
+_usernames = OrderedDict()
+# chat_id -> (username, first_name, updated_at) waiting to be written to the database
+_dirty = {}
+
+
+def get_cached_username(chat_id):
+    """Return (found, username) for a chat without calling the Bot API."""
+    chat_id = int(chat_id)
+    entry = _usernames.get(chat_id)
+    if entry is None:
+        return False, None
+    if entry[1] < time.monotonic():
+        del _usernames[chat_id]
+        return False, None
+    _usernames.move_to_end(chat_id)
+    return True, entry[0]
+
+
+def remember_username(chat_id, username, first_name=None, ttl=None, persist=True, stored_at=None):
+    """Store a chat's username (None if it has none) and queue it for the database.
+
+    stored_at is the updated_at of the row a username was loaded from.
+    """
+    chat_id = int(chat_id)
+    now = datetime.now()
+    previous = _usernames.get(chat_id)
+    if stored_at is None and previous is not None:
+        stored_at = previous[2]
+
+    # Write when something new was learned, or when the stored row is half way to
+    # going stale, so it is still trusted after a restart
+    stale = stored_at is None or now - stored_at > timedelta(seconds=CHAT_CACHE_TTL_SECONDS / 2)
+    if persist and (stale or previous is None or previous[0] != username):
+        _dirty[chat_id] = (username, first_name, now)
+        stored_at = now
+
+    _usernames[chat_id] = (username, time.monotonic() + (CHAT_CACHE_TTL_SECONDS if ttl is None else ttl), stored_at)
+    _usernames.move_to_end(chat_id)
+    while len(_usernames) > CHAT_CACHE_MAX_SIZE:
+        _usernames.popitem(last=False)
+
+
+def remember_user(user):
+    """Refresh the cache from an incoming update's effective_user."""
+    if user is None or user.is_bot:
+        return
+    remember_username(user.id, user.username, user.first_name)
+
+
+async def _load_username(chat_id):
+    """Return (found, username) from the telegram_chats table if the row is still fresh."""
+    row = await adb.get_telegram_chat(chat_id)
+    if not row or not row['updated_at']:
+        return False, None
+    age = datetime.now() - row['updated_at']
+    if age > timedelta(seconds=CHAT_CACHE_TTL_SECONDS):
+        return False, None
+    remember_username(chat_id, row['username'], ttl=CHAT_CACHE_TTL_SECONDS - age.total_seconds(), persist=False,
+                      stored_at=row['updated_at'])
+    return True, row['username']
+
+
+async def get_username(bot, chat_id):
+    """Return a chat's username from memory, then the database, then get_chat.
+
+    Lookup failures are logged and return None so callers can fall back to
+    phone contact details.
+    """
+    found, username = get_cached_username(chat_id)
+    if found:
+        return username
+
+    found, username = await _load_username(chat_id)
+    if found:
+        return username
+
+    try:
+        chat = await bot.get_chat(chat_id)
+    except Exception as e:
+        logger.error(f"Error getting username for chat {chat_id}: {e}")
+        return None
+
+    remember_username(chat_id, chat.username, chat.first_name)
+    return chat.username
+
+
+async def flush_chats():
+    """Write queued chat info to the database. Returns the number of rows written.
+
+    Only the write runs on the DB thread pool; _dirty is read and cleared here
+    on the event loop, which is the only thread changing it.
+    """
+    if not _dirty:
+        return 0
+
+    rows = [(chat_id, username, first_name, updated_at)
+            for chat_id, (username, first_name, updated_at) in _dirty.items()]
+    if not await adb.save_telegram_chats(rows):
+        # Keep the rows queued and try again on the next flush
+        return 0
+    for chat_id, _, _, updated_at in rows:
+        if _dirty.get(chat_id, (None, None, None))[2] == updated_at:
+            del _dirty[chat_id]
+
+    logger.info(f"Flushed {len(rows)} Telegram chats")
+    return len(rows)
@@ -0,0 +1,161 @@
+import os
+import io
+import csv
+import gzip
+import json
+import logging
+import tempfile
+from datetime import datetime
+import database as db
+
+logger = logging.getLogger('data_export')
+
+# Tables the admin export can write, in the order they are sent
+EXPORT_TABLES = ('donors', 'requests', 'donations')
+
+# File formats: CSV with a header row, or one JSON object per line
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Largest compressed file sent in one message; the Bot API refuses uploads over 50 MB
+EXPORT_PART_MAX_BYTES = int(os.getenv('EXPORT_PART_MAX_BYTES', str(45 * 1024 * 1024)))
+
+
+class SplitGzipWriter:
+    """File-like sink that gzips what it is given into numbered part files.
+
+    Data may arrive in chunks of any size. A new part is only started between
+    records once the current one reaches max_bytes compressed, and CSV parts
+    repeat the header, so every part can be read on its own. A CSV record
+    ends at a newline outside double quotes; JSON lines never contain one.
+    """
+
+    def __init__(self, directory, name, extension, max_bytes=None, csv_records=False, compresslevel=9):
+        self.directory = directory
+        self.name = name
+        self.extension = extension
+        self.max_bytes = max_bytes or EXPORT_PART_MAX_BYTES
+        self.csv_records = csv_records
+        self.compresslevel = compresslevel
+        self.bytes = 0
+        self.paths = []
+        self.rows = 0
+        self._header = None
+        self._pending = b''
+        self._record = b''
+        self._raw = None
+        self._gzip = None
+
+    def _open_part(self):
+        self._close_part()
+        path = os.path.join(self.directory, f"{self.name}.part{len(self.paths) + 1}.{self.extension}.gz")
+        self._raw = open(path, 'wb')
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=self.compresslevel)
+        self.paths.append(path)
+        if self._header is not None:
+            self._gzip.write(self._header)
+
+    def _close_part(self):
+        if self._gzip is not None:
+            self._gzip.close()
+            self.bytes += self._raw.tell()
+            self._raw.close()
+            self._gzip = self._raw = None
+
+    def _write_line(self, line):
+        record = self._record + line
+        if self.csv_records and record.count(b'"') % 2:
+            # Inside a quoted field that contains a newline
+            self._record = record
+            return
+        self._record = b''
+
+        if self.csv_records and self._header is None:
+            self._header = record
+            self._open_part()
+            return
+        # tell() lags behind by what the compressor still buffers, well under the margin left to the limit
+        if self._gzip is None or self._raw.tell() >= self.max_bytes:
+            self._open_part()
+        self._gzip.write(record)
+        self.rows += 1
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        lines = (self._pending + data).split(b'\n')
+        self._pending = lines.pop()
+        for line in lines:
+            self._write_line(line + b'\n')
+        return len(data)
+
+    def close(self):
+        """Flush the last line and part. Returns the part paths; .bytes is then their total size."""
+        if self._pending or self._record:
+            self._write_line(self._pending + b'\n')
+            self._pending = b''
+        if not self.paths:
+            self._open_part()
+        self._close_part()
+        return self.paths
+
+
+def _csv_value(value):
+    # Booleans the way Postgres COPY writes them
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return value
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot export {type(value).__name__} as JSON")
+
+
+def write_rows(columns, batches, export_format, out):
+    """Encode batches of row tuples like Postgres COPY would and write them to out.
+
+    For backends without COPY; the output matches storage_postgres.export_table.
+    """
+    if export_format == 'csv':
+        text = io.StringIO()
+        writer = csv.writer(text, lineterminator='\n')
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows([_csv_value(value) for value in row] for row in rows)
+            out.write(text.getvalue())
+            text.seek(0)
+            text.truncate()
+        out.write(text.getvalue())
+    else:
+        for rows in batches:
+            out.write(''.join(json.dumps(dict(zip(columns, row)), default=_json_value, ensure_ascii=False) + '\n'
+                              for row in rows))
+
+
+def export_table(table, export_format, directory):
+    """Stream one table into gzipped part files in directory. Returns (part paths, row count)."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table: {table}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    writer = SplitGzipWriter(directory, table, export_format, csv_records=export_format == 'csv')
+    try:
+        exported = db.export_table(table, export_format, writer)
+    finally:
+        paths = writer.close()
+    if not exported:
+        raise RuntimeError(f"Could not export {table}")
+    return paths, writer.rows
+
+
+def export_tables(export_format, directory=None):
+    """Export every table in EXPORT_TABLES. Returns (directory, [(table, part paths, row count)])."""
+    directory = directory or tempfile.mkdtemp(prefix=f"blood_bot_export_{datetime.now():%Y%m%d_%H%M%S}_")
+    exported = []
+    for table in EXPORT_TABLES:
+        paths, rows = export_table(table, export_format, directory)
+        logger.info(f"Exported {rows} {table} rows as {export_format} into {len(paths)} file(s)")
+        exported.append((table, paths, rows))
+    return directory, exported
@@ -0,0 +1,203 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+import database as db
+from data_export import SplitGzipWriter
+
+logger = logging.getLogger('database_backup')
+
+# Every table, parents before the tables that reference them; restore loads them in this order
+BACKUP_TABLES = (
+    'donors', 'requests', 'donations', 'requests_archive', 'donations_archive', 'donor_monthly_donations',
+    'donor_notifications', 'support_messages', 'admin_replies', 'broadcast_messages', 'personalized_messages',
+    'telegram_chats', 'persistence_user_data', 'persistence_chat_data', 'persistence_conversations'
+)
+
+# Where snapshots are kept, one directory each
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+
+# How often the backup job runs; 0 turns it off
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+
+# Newest snapshots kept; older ones are deleted after each backup
+BACKUP_RETENTION_COUNT = int(os.getenv('BACKUP_RETENTION_COUNT', '7'))
+
+# gzip level, 1 (fastest) to 9 (smallest); CSV gains little past 6
+BACKUP_COMPRESSION_LEVEL = int(os.getenv('BACKUP_COMPRESSION_LEVEL', '6'))
+
+BACKUP_PREFIX = 'backup_'
+PARTIAL_SUFFIX = '.partial'
+MANIFEST_NAME = 'manifest.json'
+
+# One backup at a time, whether started by the job or an admin
+_backup_lock = threading.Lock()
+
+
+class _PartsReader:
+    """Text file-like over a table's gzipped CSV parts, with the header only once.
+
+    Every part repeats the header (see SplitGzipWriter); it is skipped in all
+    but the first. Serves both read(size), for COPY FROM, and line iteration,
+    for csv.reader.
+    """
+
+    def __init__(self, paths):
+        self._paths = list(paths)
+        self._file = None
+        self._opened = 0
+
+    def _current(self):
+        while self._file is None and self._paths:
+            self._file = gzip.open(self._paths.pop(0), 'rt', encoding='utf-8', newline='')
+            self._opened += 1
+            if self._opened > 1:
+                self._file.readline()
+        return self._file
+
+    def _read(self, read):
+        while self._current() is not None:
+            data = read(self._file)
+            if data:
+                return data
+            self._file.close()
+            self._file = None
+        return ''
+
+    def read(self, size=-1):
+        return self._read(lambda file: file.read(size))
+
+    def readline(self):
+        return self._read(lambda file: file.readline())
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def list_backups(directory=None):
+    """Return the manifests of the complete snapshots in directory, newest first, each with its 'path'."""
+    directory = directory or BACKUP_DIR
+    if not os.path.isdir(directory):
+        return []
+
+    backups = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        path = os.path.join(directory, name)
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        if name.startswith(BACKUP_PREFIX) and os.path.isfile(manifest_path):
+            with open(manifest_path) as file:
+                backups.append(dict(json.load(file), path=path))
+    return backups
+
+
+def rotate_backups(directory=None, keep=None):
+    """Delete all but the newest `keep` snapshots, and unfinished ones. Returns the deleted paths."""
+    directory = directory or BACKUP_DIR
+    keep = BACKUP_RETENTION_COUNT if keep is None else keep
+    deleted = [backup['path'] for backup in list_backups(directory)[keep:]]
+    if os.path.isdir(directory):
+        deleted += [os.path.join(directory, name) for name in os.listdir(directory)
+                    if name.startswith(BACKUP_PREFIX) and name.endswith(PARTIAL_SUFFIX)]
+    for path in deleted:
+        shutil.rmtree(path, ignore_errors=True)
+    if deleted:
+        logger.info(f"Deleted {len(deleted)} old or unfinished backup(s)")
+    return deleted
+
+
+def create_backup(directory=None):
+    """Snapshot every table in BACKUP_TABLES into a new backup directory and rotate old ones.
+
+    Each table is streamed through gzip into CSV part files as the database
+    sends it, all from one consistent snapshot. The snapshot is written under
+    a .partial name and renamed once its manifest is complete. Returns the
+    manifest, with the timing, row and size metrics and the snapshot's 'path'.
+    """
+    directory = directory or BACKUP_DIR
+    if not _backup_lock.acquire(blocking=False):
+        raise RuntimeError("A backup is already running")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        created_at = datetime.now()
+        name = f"{BACKUP_PREFIX}{created_at:%Y%m%d_%H%M%S}"
+        path = os.path.join(directory, name)
+        partial_path = path + PARTIAL_SUFFIX
+        os.makedirs(partial_path)
+
+        started = time.perf_counter()
+        writers = [(table, SplitGzipWriter(partial_path, table, 'csv', csv_records=True,
+                                           compresslevel=BACKUP_COMPRESSION_LEVEL))
+                   for table in BACKUP_TABLES]
+        try:
+            try:
+                backed_up = db.backup_tables(writers)
+            finally:
+                for _, writer in writers:
+                    writer.close()
+            if not backed_up:
+                raise RuntimeError("Could not read the database snapshot")
+        except Exception:
+            shutil.rmtree(partial_path, ignore_errors=True)
+            raise
+
+        manifest = {
+            'name': name,
+            'created_at': created_at.isoformat(),
+            'backend': db.backend.__name__,
+            'schema_version': db.get_schema_version(),
+            'duration_seconds': round(time.perf_counter() - started, 3),
+            'bytes': sum(writer.bytes for _, writer in writers),
+            'tables': {table: {'rows': writer.rows, 'bytes': writer.bytes,
+                               'files': [os.path.basename(part) for part in writer.paths]}
+                       for table, writer in writers}
+        }
+        with open(os.path.join(partial_path, MANIFEST_NAME), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        os.rename(partial_path, path)
+
+        rows = sum(table['rows'] for table in manifest['tables'].values())
+        logger.info(f"Backed up {rows} rows from {len(BACKUP_TABLES)} tables to {path} in "
+                    f"{manifest['duration_seconds']:.1f} s ({manifest['bytes'] / 1024 / 1024:.1f} MB)")
+        rotate_backups(directory)
+        return dict(manifest, path=path)
+    finally:
+        _backup_lock.release()
+
+
+def restore_backup(path):
+    """Load a snapshot into the current database, whose tables must all be empty.
+
+    The schema is created first if needed; everything is loaded in one
+    transaction. Returns {table: rows restored}.
+    """
+    with open(os.path.join(path, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    if not db.ensure_schema():
+        raise RuntimeError("Could not set up the database schema")
+
+    started = time.perf_counter()
+    sources = [(table, _PartsReader(os.path.join(path, part) for part in manifest['tables'][table]['files']))
+               for table in BACKUP_TABLES if table in manifest['tables']]
+    try:
+        restored = db.restore_tables(sources)
+    finally:
+        for _, source in sources:
+            source.close()
+    if restored is None:
+        raise RuntimeError(f"Could not restore {manifest['name']}, nothing was loaded")
+
+    mismatched = [table for table, rows in restored.items() if rows != manifest['tables'][table]['rows']]
+    if mismatched:
+        logger.warning(f"Row counts differ from the manifest for: {', '.join(mismatched)}")
+    logger.info(f"Restored {sum(restored.values())} rows from {manifest['name']} in "
+                f"{time.perf_counter() - started:.1f} s")
+    return restored
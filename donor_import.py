@@ -0,0 +1,210 @@
+import os
+import csv
+import logging
+import database as db
+import matching
+from locations import DISTRICT_NAMES, DIVISION_NAMES, DISTRICT_DIVISION_CODES, get_district_code, get_division_code
+from matching import BLOOD_GROUPS
+
+logger = logging.getLogger('donor_import')
+
+# Header spellings accepted for each donor field, compared lower-case with spaces as underscores
+COLUMN_ALIASES = {
+    'telegram_id': ('telegram_id', 'telegram', 'tg_id'),
+    'name': ('name', 'full_name', 'donor_name'),
+    'age': ('age',),
+    'phone': ('phone', 'phone_number', 'mobile', 'contact'),
+    'division': ('division',),
+    'district': ('district',),
+    'area': ('area', 'address', 'upazila'),
+    'blood_group': ('blood_group', 'blood', 'blood_type'),
+    'gender': ('gender', 'sex')
+}
+REQUIRED_COLUMNS = ('name', 'district', 'blood_group')
+
+# Longest value each field accepts, as in the donors table
+FIELD_MAX_LENGTHS = {'name': 100, 'age': 20, 'phone': 20, 'area': 100, 'gender': 20}
+
+GENDERS = {'m': 'Male', 'male': 'Male', 'f': 'Female', 'female': 'Female', 'other': 'Other'}
+
+
+class ImportFileError(ValueError):
+    """The file as a whole cannot be imported (unreadable, or missing required columns)."""
+
+
+def _cell(value):
+    # Spreadsheets hand numeric IDs and phones over as floats
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return '' if value is None else str(value)
+
+
+def read_csv_rows(path):
+    """Yield (line number, values) for every row of a CSV file, header included, one at a time."""
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        for values in reader:
+            yield reader.line_num, values
+
+
+def read_xlsx_rows(path):
+    """Yield (row number, values) for every row of the first sheet of an .xlsx file, header included."""
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportFileError("Reading .xlsx files needs openpyxl (pip install openpyxl); upload a CSV instead")
+
+    # read_only streams the sheet instead of loading the whole workbook
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for line, values in enumerate(workbook.active.iter_rows(values_only=True), 1):
+            yield line, [_cell(value) for value in values]
+    finally:
+        workbook.close()
+
+
+def normalize_phone(phone):
+    """Strip separators from a phone number and restore the leading 0 spreadsheets drop."""
+    phone = ''.join(char for char in phone if char.isdigit() or char == '+')
+    if len(phone) == 10 and phone.startswith('1'):
+        phone = '0' + phone
+    return phone
+
+
+def normalize_blood_group(blood_group):
+    """Return the BLOOD_GROUPS spelling of e.g. 'a+', 'AB Positive' or 'O neg', None if unknown."""
+    value = blood_group.upper().replace(' ', '')
+    for word, sign in (('POSITIVE', '+'), ('NEGATIVE', '-'), ('POS', '+'), ('NEG', '-'), ('VE', '')):
+        value = value.replace(word, sign)
+    return value if value in BLOOD_GROUPS else None
+
+
+def _map_header(header):
+    """Return {field: column index} for a header row."""
+    keys = ['_'.join(str(name).strip().lower().split()) for name in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for index, key in enumerate(keys):
+            if key in aliases:
+                columns[field] = index
+                break
+
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if 'telegram_id' not in columns and 'phone' not in columns:
+        missing.append('telegram_id or phone')
+    if missing:
+        raise ImportFileError(f"Missing column(s): {', '.join(missing)}")
+    return columns
+
+
+def validate_row(record):
+    """Return (import tuple without the line number, None) for a valid record, or (None, error message)."""
+    for field, max_length in FIELD_MAX_LENGTHS.items():
+        if len(record[field]) > max_length:
+            return None, f"{field} is longer than {max_length} characters"
+    if not record['name']:
+        return None, "name is empty"
+
+    blood_group = normalize_blood_group(record['blood_group'])
+    if blood_group is None:
+        return None, f"unknown blood group '{record['blood_group']}'"
+
+    district_code = get_district_code(record['district'])
+    if district_code is None:
+        return None, f"unknown district '{record['district']}'"
+    division_code = DISTRICT_DIVISION_CODES[district_code]
+    if record['division'] and get_division_code(record['division']) != division_code:
+        return None, f"{DISTRICT_NAMES[district_code]} is not in division '{record['division']}'"
+
+    telegram_id = None
+    if record['telegram_id']:
+        if not record['telegram_id'].isdigit() or int(record['telegram_id']) == 0:
+            return None, f"invalid Telegram ID '{record['telegram_id']}'"
+        telegram_id = int(record['telegram_id'])
+    phone = normalize_phone(record['phone'])
+    if record['phone'] and len(phone) < 6:
+        return None, f"invalid phone number '{record['phone']}'"
+    if telegram_id is None and not phone:
+        return None, "needs a Telegram ID or a phone number"
+
+    gender = GENDERS.get(record['gender'].lower(), record['gender'].title()) if record['gender'] else None
+    return (telegram_id, record['name'], record['age'] or None, phone or None, DISTRICT_NAMES[district_code],
+            DIVISION_NAMES[division_code], record['area'] or None, blood_group, gender,
+            division_code, district_code), None
+
+
+def validate_rows(rows, columns, report):
+    """Yield (line, telegram_id, name, age, phone, district, division, area, blood_group, gender,
+    division_code, district_code) for each valid row of a (line, values) stream, columns being
+    the _map_header of its header. Invalid rows are added to report['errors'] as (line, message)
+    and skipped.
+    """
+    # Line each Telegram ID and phone was first seen on, to reject repeats within the file
+    seen = {}
+    try:
+        for line, values in rows:
+            if not any(str(value).strip() for value in values):
+                continue
+            report['rows'] += 1
+            record = {field: (str(values[index]).strip() if index < len(values) else '')
+                      for field, index in columns.items()}
+            record.update({field: '' for field in COLUMN_ALIASES if field not in columns})
+
+            donor, error = validate_row(record)
+            keys = [] if donor is None else [key for key in (('telegram_id', donor[0]), ('phone', donor[3]))
+                                             if key[1] is not None]
+            for key in keys:
+                if key in seen:
+                    error = f"same {key[0].replace('_', ' ')} as line {seen[key]}"
+                    break
+            if error:
+                report['errors'].append((line, error))
+                continue
+
+            for key in keys:
+                seen[key] = line
+            yield (line, *donor)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # SQL backends swallow this and return None, so import_file raises it again from the report
+        report['failure'] = ImportFileError(f"Could not read the file near row {report['rows']}: {e}")
+        raise report['failure'] from e
+
+
+def import_file(path):
+    """Validate a donor CSV or XLSX file and upsert its rows into donors.
+
+    Rows are read, validated and loaded as a stream, never all at once, in a
+    single transaction. Rows with a Telegram ID update the donor with that ID
+    or add a new one; rows with only a phone number update the single donor
+    with that number. Returns {'rows', 'inserted', 'updated', 'errors': [(line, message)]}.
+    """
+    report = {'rows': 0, 'inserted': 0, 'updated': 0, 'errors': []}
+    rows = read_xlsx_rows(path) if path.lower().endswith('.xlsx') else read_csv_rows(path)
+    try:
+        header = next(rows, None)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ImportFileError(f"Could not read the file: {e}")
+    if header is None:
+        raise ImportFileError("The file is empty")
+    columns = _map_header(header[1])
+
+    result = db.import_donors(validate_rows(rows, columns, report))
+    if result is None:
+        raise report.get('failure') or RuntimeError("The database rejected the import, nothing was saved")
+
+    report['inserted'] = result['inserted']
+    report['updated'] = result['updated']
+    report['errors'] = sorted(report['errors'] + [tuple(error) for error in result['errors']])
+    if result['inserted'] or result['updated']:
+        matching.invalidate_donor_index()
+    logger.info(f"Imported donors from {os.path.basename(path)}: {report['rows']} rows, "
+                f"{report['inserted']} added, {report['updated']} updated, {len(report['errors'])} rejected")
+    return report
+
+
+def write_error_report(errors, path):
+    """Write (line, message) errors to a CSV file at path."""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['line', 'error'])
+        writer.writerows(errors)
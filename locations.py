@@ -1,3 +1,6 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0
 
 BANGLADESH_DIVISIONS = [
     "Dhaka",
@@ -48,10 +51,205 @@ BANGLADESH_DISTRICTS = {
 # Flatten the districts list for easier access
 ALL_DISTRICTS = [district for districts in BANGLADESH_DISTRICTS.values() for district in districts]
 
+# Stable integer codes for divisions and districts. Codes are stored in the
+# database, so existing values must never be renumbered - only append new ones.
+DIVISION_CODES = {
+    "Dhaka": 1, "Chittagong": 2, "Rajshahi": 3, "Khulna": 4,
+    "Barisal": 5, "Sylhet": 6, "Rangpur": 7, "Mymensingh": 8
+}
+
+DISTRICT_CODES = {
+    # Dhaka
+    "Dhaka": 1, "Gazipur": 2, "Narsingdi": 3, "Manikganj": 4, "Munshiganj": 5, "Narayanganj": 6,
+    "Tangail": 7, "Kishoreganj": 8, "Madaripur": 9, "Rajbari": 10, "Gopalganj": 11, "Faridpur": 12,
+    "Shariatpur": 13,
+    # Chittagong
+    "Chittagong": 14, "Cox's Bazar": 15, "Rangamati": 16, "Bandarban": 17, "Khagrachari": 18,
+    "Noakhali": 19, "Feni": 20, "Lakshmipur": 21, "Comilla": 22, "Brahmanbaria": 23, "Chandpur": 24,
+    # Rajshahi
+    "Rajshahi": 25, "Natore": 26, "Naogaon": 27, "Nawabganj": 28, "Pabna": 29, "Sirajganj": 30,
+    "Bogra": 31, "Joypurhat": 32,
+    # Khulna
+    "Khulna": 33, "Bagerhat": 34, "Satkhira": 35, "Jessore": 36, "Magura": 37, "Jhenaidah": 38,
+    "Narail": 39, "Kushtia": 40, "Chuadanga": 41, "Meherpur": 42,
+    # Barisal
+    "Barisal": 43, "Bhola": 44, "Patuakhali": 45, "Pirojpur": 46, "Jhalokati": 47, "Barguna": 48,
+    # Sylhet
+    "Sylhet": 49, "Moulvibazar": 50, "Habiganj": 51, "Sunamganj": 52,
+    # Rangpur
+    "Rangpur": 53, "Gaibandha": 54, "Nilphamari": 55, "Kurigram": 56, "Lalmonirhat": 57,
+    "Dinajpur": 58, "Thakurgaon": 59, "Panchagarh": 60,
+    # Mymensingh
+    "Mymensingh": 61, "Jamalpur": 62, "Sherpur": 63, "Netrokona": 64
+}
+
+# Divisions sharing a land border, used to widen donor searches ring by ring
+DIVISION_NEIGHBOURS = {
+    "Dhaka": ["Mymensingh", "Sylhet", "Chittagong", "Barisal", "Khulna", "Rajshahi"],
+    "Chittagong": ["Dhaka", "Sylhet", "Barisal"],
+    "Rajshahi": ["Rangpur", "Mymensingh", "Dhaka", "Khulna"],
+    "Khulna": ["Rajshahi", "Dhaka", "Barisal"],
+    "Barisal": ["Khulna", "Dhaka", "Chittagong"],
+    "Sylhet": ["Mymensingh", "Dhaka", "Chittagong"],
+    "Rangpur": ["Rajshahi", "Mymensingh"],
+    "Mymensingh": ["Rangpur", "Rajshahi", "Dhaka", "Sylhet"]
+}
+
+# Approximate district headquarters coordinates as (latitude, longitude)
+DISTRICT_CENTROIDS = {
+    # Dhaka
+    "Dhaka": (23.8103, 90.4125), "Gazipur": (23.9999, 90.4203), "Narsingdi": (23.9229, 90.7177),
+    "Manikganj": (23.8617, 90.0003), "Munshiganj": (23.5422, 90.5305), "Narayanganj": (23.6238, 90.5000),
+    "Tangail": (24.2513, 89.9167), "Kishoreganj": (24.4449, 90.7766), "Madaripur": (23.1641, 90.1896),
+    "Rajbari": (23.7574, 89.6445), "Gopalganj": (23.0050, 89.8266), "Faridpur": (23.6071, 89.8429),
+    "Shariatpur": (23.2423, 90.4348),
+    # Chittagong
+    "Chittagong": (22.3569, 91.7832), "Cox's Bazar": (21.4272, 92.0058), "Rangamati": (22.6533, 92.1789),
+    "Bandarban": (22.1953, 92.2184), "Khagrachari": (23.1193, 91.9847), "Noakhali": (22.8696, 91.0995),
+    "Feni": (23.0159, 91.3976), "Lakshmipur": (22.9447, 90.8282), "Comilla": (23.4607, 91.1809),
+    "Brahmanbaria": (23.9571, 91.1119), "Chandpur": (23.2333, 90.6713),
+    # Rajshahi
+    "Rajshahi": (24.3745, 88.6042), "Natore": (24.4206, 89.0003), "Naogaon": (24.7936, 88.9318),
+    "Nawabganj": (24.5965, 88.2776), "Pabna": (24.0064, 89.2372), "Sirajganj": (24.4534, 89.7007),
+    "Bogra": (24.8465, 89.3773), "Joypurhat": (25.0968, 89.0227),
+    # Khulna
+    "Khulna": (22.8456, 89.5403), "Bagerhat": (22.6516, 89.7859), "Satkhira": (22.7185, 89.0705),
+    "Jessore": (23.1664, 89.2081), "Magura": (23.4873, 89.4199), "Jhenaidah": (23.5450, 89.1726),
+    "Narail": (23.1725, 89.5127), "Kushtia": (23.9013, 89.1204), "Chuadanga": (23.6402, 88.8418),
+    "Meherpur": (23.7622, 88.6318),
+    # Barisal
+    "Barisal": (22.7010, 90.3535), "Bhola": (22.6859, 90.6482), "Patuakhali": (22.3596, 90.3299),
+    "Pirojpur": (22.5841, 89.9720), "Jhalokati": (22.6406, 90.1987), "Barguna": (22.1590, 90.1120),
+    # Sylhet
+    "Sylhet": (24.8949, 91.8687), "Moulvibazar": (24.4829, 91.7774), "Habiganj": (24.3745, 91.4155),
+    "Sunamganj": (25.0658, 91.3950),
+    # Rangpur
+    "Rangpur": (25.7439, 89.2752), "Gaibandha": (25.3288, 89.5430), "Nilphamari": (25.9310, 88.8560),
+    "Kurigram": (25.8054, 89.6362), "Lalmonirhat": (25.9923, 89.2847), "Dinajpur": (25.6217, 88.6355),
+    "Thakurgaon": (26.0336, 88.4616), "Panchagarh": (26.3411, 88.5542),
+    # Mymensingh
+    "Mymensingh": (24.7471, 90.4203), "Jamalpur": (24.9375, 89.9378), "Sherpur": (25.0205, 90.0153),
+    "Netrokona": (24.8709, 90.7279)
+}
+
+# Alternative spellings (official renames, transliterations) mapped to the names above
+DIVISION_ALIASES = {
+    "Chattogram": "Chittagong",
+    "Barishal": "Barisal"
+}
+
+DISTRICT_ALIASES = {
+    "Chattogram": "Chittagong",
+    "Barishal": "Barisal",
+    "Bogura": "Bogra",
+    "Cumilla": "Comilla",
+    "Jashore": "Jessore",
+    "Chapai Nawabganj": "Nawabganj",
+    "Chapainawabganj": "Nawabganj",
+    "Coxs Bazar": "Cox's Bazar",
+    "Khagrachhari": "Khagrachari",
+    "Laxmipur": "Lakshmipur",
+    "Maulvibazar": "Moulvibazar",
+    "Jhalakathi": "Jhalokati",
+    "Jhalokathi": "Jhalokati",
+    "Netrakona": "Netrokona",
+    "Narshingdi": "Narsingdi",
+    "Munshigonj": "Munshiganj",
+    "Kishorganj": "Kishoreganj"
+}
+
+
+def normalize_location_name(name):
+    """Return the lookup key for a free-text division or district name."""
+    if not name:
+        return ''
+    key = str(name).strip().lower().replace("'", "").replace("-", " ")
+    return ' '.join(key.split())
+
+
+def _build_lookup(codes, aliases):
+    lookup = {normalize_location_name(name): code for name, code in codes.items()}
+    for alias, name in aliases.items():
+        lookup[normalize_location_name(alias)] = codes[name]
+    return lookup
+
+
+# O(1) lookups from any accepted spelling to a code, and from a code back to its name
+DIVISION_LOOKUP = _build_lookup(DIVISION_CODES, DIVISION_ALIASES)
+DISTRICT_LOOKUP = _build_lookup(DISTRICT_CODES, DISTRICT_ALIASES)
+DIVISION_NAMES = {code: name for name, code in DIVISION_CODES.items()}
+DISTRICT_NAMES = {code: name for name, code in DISTRICT_CODES.items()}
+
+# Division code -> set of neighbouring division codes
+DIVISION_NEIGHBOUR_CODES = {
+    DIVISION_CODES[division]: {DIVISION_CODES[neighbour] for neighbour in neighbours}
+    for division, neighbours in DIVISION_NEIGHBOURS.items()
+}
+
+# District code -> division code
+DISTRICT_DIVISION_CODES = {
+    DISTRICT_CODES[district]: DIVISION_CODES[division]
+    for division, districts in BANGLADESH_DISTRICTS.items()
+    for district in districts
+}
+
+
+def haversine_km(origin, destination):
+    """Great-circle distance in kilometres between two (latitude, longitude) points."""
+    lat1, lon1 = map(math.radians, origin)
+    lat2, lon2 = map(math.radians, destination)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+# District-to-district distances in km, indexed by district code on both axes.
+# Row and column 0 are unused so codes can be used as indices directly.
+DISTRICT_DISTANCES_KM = [[0.0] * (max(DISTRICT_CODES.values()) + 1) for _ in range(max(DISTRICT_CODES.values()) + 1)]
+for _origin, _origin_code in DISTRICT_CODES.items():
+    for _destination, _destination_code in DISTRICT_CODES.items():
+        DISTRICT_DISTANCES_KM[_origin_code][_destination_code] = round(
+            haversine_km(DISTRICT_CENTROIDS[_origin], DISTRICT_CENTROIDS[_destination]), 1)
+del _origin, _origin_code, _destination, _destination_code
+
+
+def get_division_code(division):
+    """Return the integer code for a division name or alias, or None if unknown."""
+    return DIVISION_LOOKUP.get(normalize_location_name(division))
+
+
+def get_district_code(district):
+    """Return the integer code for a district name or alias, or None if unknown."""
+    return DISTRICT_LOOKUP.get(normalize_location_name(district))
+
+
+def get_division_name(division):
+    """Return the canonical division name for a name or alias, or None if unknown."""
+    return DIVISION_NAMES.get(get_division_code(division))
+
+
 # Function to get division for a district
 def get_division_for_district(district):
     """Return the division name for a given district."""
-    for division, districts in BANGLADESH_DISTRICTS.items():
-        if district in districts:
-            return division
-    return None
\ No newline at end of file
+    district_code = get_district_code(district)
+    if district_code is None:
+        return None
+    return DIVISION_NAMES[DISTRICT_DIVISION_CODES[district_code]]
+
+
+def get_location_codes(division, district):
+    """Return (division_code, district_code) for free-text names.
+
+    A recognised district always determines the division, so the pair stays
+    consistent even if the division was typed differently.
+    """
+    district_code = get_district_code(district)
+    if district_code is not None:
+        return DISTRICT_DIVISION_CODES[district_code], district_code
+    return get_division_code(division), None
+
+
+def get_district_distance(origin_district_code, destination_district_code):
+    """Return the centroid distance in km between two district codes, or None if either is unknown."""
+    if origin_district_code not in DISTRICT_NAMES or destination_district_code not in DISTRICT_NAMES:
+        return None
+    return DISTRICT_DISTANCES_KM[origin_district_code][destination_district_code]
@@ -0,0 +1,323 @@
+import os
+import time
+import logging
+import database as db
+from storage_session import after_commit
+from locations import DISTRICT_DISTANCES_KM, DIVISION_CODES, DIVISION_NEIGHBOUR_CODES, get_location_codes
+
+logger = logging.getLogger('matching')
+
+# Blood groups in a fixed order so they can be stored as small integer codes
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+BLOOD_GROUP_CODES = {group: code for code, group in enumerate(BLOOD_GROUPS)}
+
+# Donor blood groups that can give to each requested blood group
+COMPATIBLE_DONOR_GROUPS = {
+    'A+': ['A+', 'A-', 'O+', 'O-'],
+    'A-': ['A-', 'O-'],
+    'B+': ['B+', 'B-', 'O+', 'O-'],
+    'B-': ['B-', 'O-'],
+    'AB+': ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'],
+    'AB-': ['A-', 'B-', 'AB-', 'O-'],
+    'O+': ['O+', 'O-'],
+    'O-': ['O-']
+}
+
+# Match tiers, lower is notified first
+TIER_EXACT = 0      # Same district and division
+TIER_DIVISION = 1   # Same division, different district
+TIER_BLOOD_ONLY = 2  # Compatible blood group anywhere else
+
+# NumPy and the lookup tables built with it are loaded by the first DonorIndex,
+# so importing this module (and starting the bot) does not pay for them
+np = None
+# District-to-district distance lookup table, indexed by district code
+DISTRICT_DISTANCES = None
+# Division-to-division adjacency lookup table, indexed by division code
+DIVISION_NEIGHBOURS = None
+
+# Escalation rings, each wave only reaches donors inside the current ring
+RING_DISTRICT = 0
+RING_DIVISION = 1
+RING_NEIGHBOURING_DIVISIONS = 2
+RING_NATIONAL = 3
+RING_NAMES = {
+    RING_DISTRICT: 'district',
+    RING_DIVISION: 'division',
+    RING_NEIGHBOURING_DIVISIONS: 'neighbouring divisions',
+    RING_NATIONAL: 'national'
+}
+
+# Donors notified per wave, and acceptances after which a request stops escalating
+ESCALATION_WAVE_SIZE = int(os.getenv('ESCALATION_WAVE_SIZE', '20'))
+ESCALATION_TARGET_ACCEPTANCES = int(os.getenv('ESCALATION_TARGET_ACCEPTANCES', '1'))
+
+# Minutes to wait for an acceptance before widening to the next wave, by request urgency
+ESCALATION_WINDOW_MINUTES = {
+    'Urgent': 10,
+    'High': 30,
+    'Medium': 60,
+    'Low': 180
+}
+
+# Days after a completed donation during which a donor is not asked again
+DONATION_DEFERRAL_DAYS = int(os.getenv('DONATION_DEFERRAL_DAYS', '90'))
+
+# How long a loaded donor index is reused before it is rebuilt from the database
+DONOR_INDEX_TTL_SECONDS = int(os.getenv('DONOR_INDEX_TTL_SECONDS', '300'))
+
+
+def _load_numpy():
+    """Import NumPy and build the location lookup tables on first use."""
+    global np, DISTRICT_DISTANCES, DIVISION_NEIGHBOURS
+    if np is not None:
+        return
+    import numpy
+
+    DISTRICT_DISTANCES = numpy.asarray(DISTRICT_DISTANCES_KM, dtype=numpy.float32)
+    DIVISION_NEIGHBOURS = numpy.zeros((max(DIVISION_CODES.values()) + 1,) * 2, dtype=bool)
+    for division_code, neighbour_codes in DIVISION_NEIGHBOUR_CODES.items():
+        DIVISION_NEIGHBOURS[division_code, list(neighbour_codes)] = True
+    np = numpy
+
+
+def _timestamp(value):
+    """Convert a datetime (or None) to epoch seconds, NaN when unknown."""
+    if value is None:
+        return np.nan
+    try:
+        return value.timestamp()
+    except AttributeError:
+        return np.nan
+
+
+class DonorIndex:
+    """Columnar, in-memory view of the donors table used for request matching.
+
+    Every donor attribute needed to decide who gets notified is stored in a
+    NumPy array so a request can be matched with a handful of vectorized
+    comparisons instead of a Python loop over every donor row.
+    """
+
+    def __init__(self, donors):
+        _load_numpy()
+        self.donors = list(donors)
+        count = len(self.donors)
+
+        self.ids = np.full(count, -1, dtype=np.int64)
+        self.blood_codes = np.full(count, -1, dtype=np.int8)
+        self.division_codes = np.full(count, -1, dtype=np.int16)
+        self.district_codes = np.full(count, -1, dtype=np.int16)
+        self.restricted = np.zeros(count, dtype=bool)
+        self.unreachable = np.zeros(count, dtype=bool)
+        self.has_telegram = np.zeros(count, dtype=bool)
+        self.last_donation = np.full(count, np.nan, dtype=np.float64)
+
+        for i, donor in enumerate(self.donors):
+            self.ids[i] = -1 if donor.get('id') is None else donor['id']
+            self.blood_codes[i] = BLOOD_GROUP_CODES.get(donor.get('blood_group'), -1)
+            division_code, district_code = donor.get('division_code'), donor.get('district_code')
+            if division_code is None and district_code is None:
+                # Row saved before location codes existed
+                division_code, district_code = get_location_codes(donor.get('division'), donor.get('district'))
+            self.division_codes[i] = -1 if division_code is None else division_code
+            self.district_codes[i] = -1 if district_code is None else district_code
+            self.restricted[i] = bool(donor.get('is_restricted'))
+            self.unreachable[i] = bool(donor.get('is_unreachable'))
+            self.has_telegram[i] = bool(donor.get('telegram_id'))
+            self.last_donation[i] = _timestamp(donor.get('last_donation_at'))
+
+        self.built_at = time.monotonic()
+        # Positions sorting self.ids, built on first use by positions_of
+        self._id_order = None
+
+    def __len__(self):
+        return len(self.donors)
+
+    def compatible_mask(self, requested_blood_group):
+        """Boolean mask of donors whose blood group can give to the requested group."""
+        allowed = np.zeros(len(BLOOD_GROUPS) + 1, dtype=bool)
+        for group in COMPATIBLE_DONOR_GROUPS.get(requested_blood_group, []):
+            allowed[BLOOD_GROUP_CODES[group]] = True
+        # Unknown blood groups are stored as -1, which indexes the trailing False slot
+        return allowed[self.blood_codes]
+
+    def eligible_mask(self, now=None):
+        """Boolean mask of donors outside the post-donation deferral window."""
+        cutoff = (time.time() if now is None else now) - DONATION_DEFERRAL_DAYS * 86400
+        # NaN (never donated) compares False, so those donors stay eligible
+        return ~(self.last_donation > cutoff)
+
+    def positions_of(self, donor_ids):
+        """Return the positions of an array of donor ids, -1 for donors not in the index."""
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        positions = np.full(len(donor_ids), -1, dtype=np.int64)
+        if len(self.ids):
+            found = np.minimum(np.searchsorted(self.ids, donor_ids, sorter=self._id_order), len(self.ids) - 1)
+            matched = self.ids[self._id_order[found]] == donor_ids
+            positions[matched] = self._id_order[found[matched]]
+        return positions
+
+    def notifiable_positions(self, donor_ids):
+        """Return the positions of donor_ids, -1 for those rank() could no longer pick.
+
+        Donors deleted, restricted or marked unreachable since an escalation
+        plan was built, or who have donated since, get -1 whatever the blood
+        group.
+        """
+        positions = self.positions_of(donor_ids)
+        known = positions >= 0
+        mask = ~self.restricted & ~self.unreachable & self.has_telegram & self.eligible_mask()
+        known[known] = mask[positions[known]]
+        positions[~known] = -1
+        return positions
+
+    def rank(self, requested_blood_group, division_code, district_code):
+        """Return (positions, tiers, distances) of eligible donors in notification order.
+
+        Donors are ordered by the distance between their district and the
+        request's district, nearest first. Tiers break ties and order donors
+        whose distance is unknown (inf), which always come last.
+        """
+        mask = (self.compatible_mask(requested_blood_group) & ~self.restricted & ~self.unreachable
+                & self.has_telegram & self.eligible_mask())
+        candidates = np.flatnonzero(mask)
+
+        tiers = np.full(len(candidates), TIER_BLOOD_ONLY, dtype=np.int8)
+        if division_code is not None:
+            tiers[self.division_codes[candidates] == division_code] = TIER_DIVISION
+        if district_code is not None:
+            tiers[self.district_codes[candidates] == district_code] = TIER_EXACT
+
+        distances = np.full(len(candidates), np.inf, dtype=np.float32)
+        if district_code is not None:
+            donor_districts = self.district_codes[candidates]
+            known = donor_districts >= 0
+            distances[known] = DISTRICT_DISTANCES[district_code, donor_districts[known]]
+
+        # lexsort is stable and sorts by the last key first: distance, then tier, then index order
+        order = np.lexsort((tiers, distances))
+        return candidates[order], tiers[order], distances[order]
+
+    def ranked_donors(self, requested_blood_group, division_code, district_code):
+        """Return a list of (donor, tier, distance_km) tuples in notification order.
+
+        distance_km is None when either district is unknown.
+        """
+        positions, tiers, distances = self.rank(requested_blood_group, division_code, district_code)
+        return [
+            (self.donors[position], int(tier), None if np.isinf(distance) else round(distance, 1))
+            for position, tier, distance in zip(positions.tolist(), tiers.tolist(), distances.tolist())
+        ]
+
+    def escalation_plan(self, requested_blood_group, division_code, district_code):
+        """Return the EscalationPlan of a request, in the same order as ranked_donors."""
+        positions, tiers, distances = self.rank(requested_blood_group, division_code, district_code)
+
+        rings = np.full(len(positions), RING_NATIONAL, dtype=np.int8)
+        if division_code is not None:
+            donor_divisions = self.division_codes[positions]
+            known = donor_divisions >= 0
+            neighbours = np.zeros(len(positions), dtype=bool)
+            neighbours[known] = DIVISION_NEIGHBOURS[division_code, donor_divisions[known]]
+            rings[neighbours] = RING_NEIGHBOURING_DIVISIONS
+        rings[tiers == TIER_DIVISION] = RING_DIVISION
+        rings[tiers == TIER_EXACT] = RING_DISTRICT
+
+        return EscalationPlan(self.ids[positions], tiers, distances, rings)
+
+
+class EscalationPlan:
+    """The donors a request's escalation waves may notify, as arrays in notification order.
+
+    Donors are kept by id rather than by index position, so a plan outlives
+    the DonorIndex it was built from; each wave looks its donors up in the
+    current one. rings says from which wave onwards a donor may be notified,
+    and pending which donors no wave has picked yet.
+    """
+
+    def __init__(self, donor_ids, tiers, distances, rings):
+        self.donor_ids = donor_ids
+        self.tiers = tiers
+        self.distances = distances
+        self.rings = rings
+        self.pending = np.ones(len(donor_ids), dtype=bool)
+
+    def __len__(self):
+        return len(self.donor_ids)
+
+    def ring_counts(self):
+        """Return how many donors each ring adds, indexed by ring."""
+        return np.bincount(self.rings, minlength=RING_NATIONAL + 1).tolist()
+
+    def mark_done(self, donor_ids):
+        """Stop offering donor_ids (e.g. already notified) to later waves."""
+        self.pending[np.isin(self.donor_ids, np.asarray(donor_ids, dtype=np.int64))] = False
+
+    def distance_km(self, entry):
+        """Return an entry's distance rounded for display, None when unknown."""
+        distance = float(self.distances[entry])
+        return None if np.isinf(distance) else round(distance, 1)
+
+
+def escalation_window_seconds(urgency):
+    """Return how long to wait for an acceptance before the next wave."""
+    return ESCALATION_WINDOW_MINUTES.get((urgency or '').strip().capitalize(), ESCALATION_WINDOW_MINUTES['High']) * 60
+
+
+def select_wave(plan, donor_index, ring, size=None):
+    """Pick the next donors to notify from an escalation plan and mark them done.
+
+    Donors still pending in the current ring are sent first; the ring only
+    widens once it has nobody left. Only the wave's candidates are checked
+    against donor_index, and those that can no longer be notified are dropped
+    and replaced from the same ring. Returns (wave, ring, dropped), wave being
+    (donor, tier, distance_km) tuples with the donors from donor_index, empty
+    once every ring is exhausted.
+    """
+    size = size or ESCALATION_WAVE_SIZE
+    wave, dropped = [], 0
+    while ring <= RING_NATIONAL:
+        entries = np.flatnonzero(plan.pending & (plan.rings <= ring))[:size - len(wave)]
+        if not len(entries):
+            if wave:
+                break
+            ring += 1
+            continue
+        plan.pending[entries] = False
+        positions = donor_index.notifiable_positions(plan.donor_ids[entries])
+        dropped += int(np.count_nonzero(positions < 0))
+        wave.extend((donor_index.donors[position], int(plan.tiers[entry]), plan.distance_km(entry))
+                    for entry, position in zip(entries.tolist(), positions.tolist()) if position >= 0)
+        if len(wave) >= size:
+            break
+    return wave, ring, dropped
+
+
+_donor_index = None
+
+
+def get_donor_index():
+    """Return the cached donor index, rebuilding it when stale or invalidated."""
+    global _donor_index
+    if _donor_index is None or time.monotonic() - _donor_index.built_at > DONOR_INDEX_TTL_SECONDS:
+        started = time.perf_counter()
+        _donor_index = DonorIndex(db.get_donor_index_rows())
+        logger.info(f"Built donor index with {len(_donor_index)} donors in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    return _donor_index
+
+
+def _drop_donor_index():
+    global _donor_index
+    _donor_index = None
+
+
+def invalidate_donor_index():
+    """Drop the cached donor index so the next match reloads it from the database.
+
+    Inside a database session this waits until the session commits, so a
+    rebuild cannot miss the change and a rollback leaves the index alone.
+    """
+    after_commit(_drop_donor_index)
@@ -0,0 +1,44 @@
+"""Apply pending database migrations.
+
+Usage:
+    python migrate.py              apply pending migrations
+    python migrate.py --status     show the current and latest schema versions
+    python migrate.py --partition  also partition requests and donations by month (migration 10),
+                                   which rewrites both tables; run it when the bot is quiet
+"""
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import database as db
+
+
+def main():
+    db.print_db_info()
+
+    if '--status' in sys.argv[1:]:
+        version = db.get_schema_version()
+        if version is None:
+            return 1
+        if db.backend.__name__ != 'storage_postgres':
+            print(f"Schema version: {version} (latest {db.backend.SCHEMA_VERSION})")
+            return 0
+        import migrations
+        print(f"Schema version: {version} (latest {migrations.SCHEMA_VERSION})")
+        for number, description, _ in migrations.MIGRATIONS:
+            print(f"  {'applied' if number <= version else 'pending'}  {number:>3}  {description}")
+        return 0
+
+    if '--partition' in sys.argv[1:]:
+        if db.backend.__name__ != 'storage_postgres':
+            print("Only PostgreSQL tables can be partitioned")
+            return 1
+        import migrations
+        return 0 if migrations.migrate(partition_tables=True) else 1
+
+    return 0 if db.migrate() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,566 @@
+import os
+import time
+import logging
+from datetime import datetime
+import storage_postgres as db
+from periods import month_start, add_months
+
+logger = logging.getLogger('migrations')
+
+# Apply pending migrations at startup instead of refusing to start when the schema is behind
+AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+
+# pg_advisory_lock key so two processes never migrate at the same time
+MIGRATION_LOCK_ID = 72150001
+
+# Migrations that rewrite whole tables, locking them for as long as that takes. They only
+# run when asked for with migrate(partition_tables=True) ('python migrate.py --partition'),
+# never as a side effect of AUTO_MIGRATE at startup; otherwise they are recorded as skipped.
+OPT_IN_MIGRATIONS = {10}
+
+
+def _create_base_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS donors (
+        id SERIAL PRIMARY KEY,
+        telegram_id BIGINT UNIQUE NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        age VARCHAR(20),
+        phone VARCHAR(20),
+        district VARCHAR(50),
+        division VARCHAR(50),
+        area VARCHAR(100),
+        blood_group VARCHAR(5),
+        gender VARCHAR(20),
+        registration_date TIMESTAMP,
+        is_restricted BOOLEAN DEFAULT FALSE
+    )
+    ''')
+
+    # Older databases were created with a shorter gender column
+    cursor.execute('''
+    SELECT character_maximum_length FROM information_schema.columns
+    WHERE table_name = 'donors' AND column_name = 'gender'
+    ''')
+    row = cursor.fetchone()
+    if row and row[0] is not None and row[0] < 20:
+        cursor.execute('ALTER TABLE donors ALTER COLUMN gender TYPE VARCHAR(20)')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS requests (
+        id SERIAL PRIMARY KEY,
+        telegram_id BIGINT NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        age VARCHAR(20),
+        hospital_name VARCHAR(100),
+        hospital_address TEXT,
+        area VARCHAR(100),
+        division VARCHAR(50),
+        district VARCHAR(50),
+        urgency VARCHAR(20),
+        phone VARCHAR(20),
+        blood_group VARCHAR(5),
+        request_date TIMESTAMP,
+        status VARCHAR(20) DEFAULT 'active',
+        notified_donors TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS donations (
+        id SERIAL PRIMARY KEY,
+        request_id INTEGER REFERENCES requests(id),
+        donor_id INTEGER REFERENCES donors(id),
+        status VARCHAR(20) DEFAULT 'pending',
+        acceptance_date TIMESTAMP,
+        completion_date TIMESTAMP,
+        notes TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS support_messages (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        user_name VARCHAR(100),
+        message TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status VARCHAR(20) DEFAULT 'pending'
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS admin_replies (
+        id SERIAL PRIMARY KEY,
+        admin_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        message TEXT,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_messages (
+        id SERIAL PRIMARY KEY,
+        admin_id BIGINT NOT NULL,
+        message_text TEXT,
+        target_type VARCHAR(20),
+        sent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        recipient_count INTEGER DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS personalized_messages (
+        id SERIAL PRIMARY KEY,
+        admin_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        message_text TEXT,
+        sent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _add_location_codes(cursor):
+    for table in ('donors', 'requests'):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS division_code SMALLINT')
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS district_code SMALLINT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_donors_location_codes ON donors (division_code, district_code)')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_requests_location_codes
+    ON requests (status, division_code, district_code)
+    ''')
+
+    # Fill in codes for rows saved before the columns existed
+    for table in ('donors', 'requests'):
+        db.backfill_location_codes(cursor, table)
+
+
+def _add_last_donation(cursor):
+    cursor.execute('ALTER TABLE donors ADD COLUMN IF NOT EXISTS last_donation_at TIMESTAMP')
+    cursor.execute('''
+    UPDATE donors AS d
+    SET last_donation_at = c.last_completed
+    FROM (
+        SELECT donor_id, MAX(COALESCE(completion_date, acceptance_date)) AS last_completed
+        FROM donations
+        WHERE status = 'completed'
+        GROUP BY donor_id
+    ) AS c
+    WHERE d.id = c.donor_id AND d.last_donation_at IS NULL
+    ''')
+
+
+def _add_unreachable_donors(cursor):
+    cursor.execute('ALTER TABLE donors ADD COLUMN IF NOT EXISTS is_unreachable BOOLEAN DEFAULT FALSE')
+    cursor.execute('ALTER TABLE donors ADD COLUMN IF NOT EXISTS unreachable_at TIMESTAMP')
+
+
+def _create_donor_notifications(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS donor_notifications (
+        id SERIAL PRIMARY KEY,
+        request_id INTEGER NOT NULL,
+        donor_id INTEGER NOT NULL,
+        sent_at TIMESTAMP NOT NULL,
+        UNIQUE (request_id, donor_id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_donor_notifications_sent_at ON donor_notifications (sent_at)')
+
+
+def _create_telegram_chats(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS telegram_chats (
+        chat_id BIGINT PRIMARY KEY,
+        username VARCHAR(64),
+        first_name VARCHAR(100),
+        updated_at TIMESTAMP NOT NULL
+    )
+    ''')
+
+
+def _create_persistence_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS persistence_user_data (
+        user_id BIGINT PRIMARY KEY,
+        data JSONB NOT NULL,
+        updated_at TIMESTAMP NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS persistence_chat_data (
+        chat_id BIGINT PRIMARY KEY,
+        data JSONB NOT NULL,
+        updated_at TIMESTAMP NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS persistence_conversations (
+        name VARCHAR(100) NOT NULL,
+        conversation_key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (name, conversation_key)
+    )
+    ''')
+
+
+def _create_request_archive(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS requests_archive (
+        id INTEGER PRIMARY KEY,
+        telegram_id BIGINT NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        age VARCHAR(20),
+        hospital_name VARCHAR(100),
+        hospital_address TEXT,
+        area VARCHAR(100),
+        division VARCHAR(50),
+        district VARCHAR(50),
+        urgency VARCHAR(20),
+        phone VARCHAR(20),
+        blood_group VARCHAR(5),
+        request_date TIMESTAMP,
+        status VARCHAR(20),
+        notified_donors TEXT,
+        division_code SMALLINT,
+        district_code SMALLINT,
+        archived_at TIMESTAMP NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS donations_archive (
+        id INTEGER PRIMARY KEY,
+        request_id INTEGER NOT NULL,
+        donor_id INTEGER,
+        status VARCHAR(20),
+        acceptance_date TIMESTAMP,
+        completion_date TIMESTAMP,
+        notes TEXT,
+        archived_at TIMESTAMP NOT NULL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_archive_donor ON donations_archive (donor_id)')
+
+
+def _add_partial_indexes(cursor):
+    # Hot reads only ever look at active requests, newest first
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_requests_active_date
+    ON requests (request_date DESC) WHERE status = 'active'
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_requests_active_division
+    ON requests (division_code, request_date DESC) WHERE status = 'active'
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_requests_active_district
+    ON requests (district_code, request_date DESC) WHERE status = 'active'
+    ''')
+    # Superseded by the partial indexes above
+    cursor.execute('DROP INDEX IF EXISTS idx_requests_location_codes')
+
+    # Operations are donations that were accepted, whether or not completed yet
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_donations_operations
+    ON donations (acceptance_date DESC) WHERE status IN ('pending', 'completed')
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_donor_status ON donations (donor_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_donations_request ON donations (request_id, donor_id)')
+
+
+def _partition_by_month(cursor):
+    # Opt-in (see OPT_IN_MIGRATIONS): every row is copied while both tables are locked.
+    # Requests looked up by id alone probe every partition's primary key index, since
+    # the key is now (id, request_date); storage_postgres tries recent partitions first.
+    if _is_partitioned(cursor):
+        return
+
+    # A foreign key to a partitioned table has to include its partition key, which
+    # donations does not carry; the triggers from _check_request_references replace it
+    cursor.execute('ALTER TABLE donations DROP CONSTRAINT IF EXISTS donations_request_id_fkey')
+    for table in db.PARTITION_KEYS:
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+        cursor.execute(f'ALTER TABLE {table}_unpartitioned RENAME CONSTRAINT {table}_pkey TO {table}_unpartitioned_pkey')
+        # Keep the id sequence alive when the old table is dropped
+        cursor.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY NONE')
+
+    # Primary keys of partitioned tables must include the partition key, so it cannot be NULL
+    cursor.execute('''
+    CREATE TABLE requests (
+        id INTEGER NOT NULL DEFAULT nextval('requests_id_seq'),
+        telegram_id BIGINT NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        age VARCHAR(20),
+        hospital_name VARCHAR(100),
+        hospital_address TEXT,
+        area VARCHAR(100),
+        division VARCHAR(50),
+        district VARCHAR(50),
+        urgency VARCHAR(20),
+        phone VARCHAR(20),
+        blood_group VARCHAR(5),
+        request_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        status VARCHAR(20) DEFAULT 'active',
+        notified_donors TEXT,
+        division_code SMALLINT,
+        district_code SMALLINT,
+        PRIMARY KEY (id, request_date)
+    ) PARTITION BY RANGE (request_date)
+    ''')
+    cursor.execute('''
+    CREATE TABLE donations (
+        id INTEGER NOT NULL DEFAULT nextval('donations_id_seq'),
+        request_id INTEGER,
+        donor_id INTEGER REFERENCES donors(id),
+        status VARCHAR(20) DEFAULT 'pending',
+        acceptance_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        completion_date TIMESTAMP,
+        notes TEXT,
+        PRIMARY KEY (id, acceptance_date)
+    ) PARTITION BY RANGE (acceptance_date)
+    ''')
+
+    for table, key in db.PARTITION_KEYS.items():
+        cursor.execute(f'SELECT MIN({key}) FROM {table}_unpartitioned')
+        oldest = cursor.fetchone()[0] or datetime.now()
+        upcoming = add_months(month_start(datetime.now()), db.PARTITION_MONTHS_AHEAD)
+        created = db.create_month_partitions(cursor, table, min(oldest, datetime.now()), upcoming)
+        # Catches rows dated past the created months if the partition job stops running
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+        cursor.execute(f'''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = '{table}_unpartitioned' ORDER BY ordinal_position
+        ''')
+        columns = [row[0] for row in cursor.fetchall()]
+        values = [f'COALESCE({column}, CURRENT_TIMESTAMP)' if column == key else column for column in columns]
+        cursor.execute(f'''
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(values)} FROM {table}_unpartitioned
+        ''')
+        logger.info(f"Moved {cursor.rowcount} {table} rows into {len(created)} monthly partitions")
+
+    for table in db.PARTITION_KEYS:
+        cursor.execute(f'DROP TABLE {table}_unpartitioned')
+        cursor.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+
+    # The old indexes went with the old tables; indexes on the parent cascade to every partition
+    _add_partial_indexes(cursor)
+    _check_request_references(cursor)
+    cursor.execute('ANALYZE requests')
+    cursor.execute('ANALYZE donations')
+
+
+def _is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'requests'::regclass")
+    return cursor.fetchone()[0] == 'p'
+
+
+def _check_request_references(cursor):
+    # What donations.request_id REFERENCES requests(id) enforced before partitioning:
+    # a donation needs its request, and a request cannot be deleted while donations
+    # still point at it. The delete check runs at the end of the statement, so the
+    # archive job can still move a request and its donations in one statement.
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION check_donation_request() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.request_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM requests WHERE id = NEW.request_id) THEN
+            RAISE foreign_key_violation USING MESSAGE = format('request %s of donation %s does not exist',
+                                                               NEW.request_id, NEW.id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('''
+    CREATE OR REPLACE FUNCTION check_request_donations() RETURNS trigger AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM donations WHERE request_id = OLD.id) THEN
+            RAISE foreign_key_violation USING MESSAGE = format('request %s still has donations', OLD.id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS donations_request_exists ON donations')
+    cursor.execute('''
+    CREATE TRIGGER donations_request_exists
+    AFTER INSERT OR UPDATE OF request_id ON donations
+    FOR EACH ROW EXECUTE FUNCTION check_donation_request()
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS requests_without_donations ON requests')
+    cursor.execute('''
+    CREATE TRIGGER requests_without_donations
+    AFTER DELETE ON requests
+    FOR EACH ROW EXECUTE FUNCTION check_request_donations()
+    ''')
+
+
+def _check_partitioned_request_references(cursor):
+    # Databases partitioned before the checks existed; unpartitioned ones keep the foreign key
+    if _is_partitioned(cursor):
+        _check_request_references(cursor)
+
+
+def _create_donor_monthly_donations(cursor):
+    # Completed donations per donor per month, archived ones included; kept in step by
+    # storage_postgres._count_completed_donations so leaderboards never count donations
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS donor_monthly_donations (
+        donor_id INTEGER NOT NULL REFERENCES donors(id) ON DELETE CASCADE,
+        month DATE NOT NULL,
+        donation_count INTEGER NOT NULL,
+        PRIMARY KEY (donor_id, month)
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_donor_monthly_donations_month
+    ON donor_monthly_donations (month, donor_id, donation_count)
+    ''')
+    cursor.execute(f'''
+    INSERT INTO donor_monthly_donations (donor_id, month, donation_count)
+    SELECT don.donor_id, date_trunc('month', don.acceptance_date)::date, COUNT(*)
+    FROM {db.ALL_DONATIONS} AS don
+    JOIN donors d ON d.id = don.donor_id
+    WHERE don.status = 'completed' AND don.acceptance_date IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (donor_id, month) DO UPDATE SET donation_count = EXCLUDED.donation_count
+    ''')
+
+
+# Schema changes in the order they are applied. Append new ones with the next
+# version number; never edit or renumber a migration that has been released.
+# Every migration is idempotent so databases created before versioning upgrade cleanly.
+MIGRATIONS = [
+    (1, 'Create base tables', _create_base_tables),
+    (2, 'Add location codes', _add_location_codes),
+    (3, 'Add donor last donation date', _add_last_donation),
+    (4, 'Add unreachable donor flags', _add_unreachable_donors),
+    (5, 'Create donor notification log', _create_donor_notifications),
+    (6, 'Create Telegram chat cache', _create_telegram_chats),
+    (7, 'Create conversation persistence tables', _create_persistence_tables),
+    (8, 'Create request and donation archive tables', _create_request_archive),
+    (9, 'Add partial indexes for active requests and operations', _add_partial_indexes),
+    (10, 'Partition requests and donations by month', _partition_by_month),
+    (11, 'Create monthly donor donation counts', _create_donor_monthly_donations),
+    (12, 'Check donation request references on partitioned tables', _check_partitioned_request_references),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(cursor):
+    """Return the highest applied migration, 0 if versioning was never set up."""
+    cursor.execute("SELECT to_regclass('schema_migrations')")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
+
+
+def get_schema_version():
+    """Return the database's schema version with a single query, None if it cannot be read."""
+    try:
+        conn = db.get_db_connection()
+        cursor = conn.cursor()
+
+        version = _current_version(cursor)
+
+        cursor.close()
+        conn.close()
+
+        return version
+    except Exception as e:
+        logger.error(f"Error reading schema version: {e}")
+        return None
+
+
+def migrate(partition_tables=False):
+    """Apply every pending migration, each in its own transaction. Returns True on success.
+
+    Migrations in OPT_IN_MIGRATIONS are skipped unless partition_tables is
+    set, which also partitions a database where migration 10 was skipped.
+    """
+    try:
+        conn = db.get_db_connection()
+    except Exception as e:
+        logger.error(f"Error applying migrations: {e}")
+        return False
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(200) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                duration_ms INTEGER
+            )
+            ''')
+            conn.commit()
+
+            # Read again under the lock in case another process just migrated
+            current = _current_version(cursor)
+            pending = [migration for migration in MIGRATIONS if migration[0] > current]
+            if not pending:
+                logger.info(f"Schema is up to date (version {current})")
+
+            for version, description, apply in pending:
+                if version in OPT_IN_MIGRATIONS and not partition_tables:
+                    logger.info(f"Skipping migration {version}: {description} "
+                                f"(run 'python migrate.py --partition' to apply it)")
+                    description = f"{description} (skipped)"
+                    apply = None
+                else:
+                    logger.info(f"Applying migration {version}: {description}...")
+                started = time.perf_counter()
+                if apply is not None:
+                    apply(cursor)
+                duration_ms = int((time.perf_counter() - started) * 1000)
+                cursor.execute('''
+                INSERT INTO schema_migrations (version, description, duration_ms)
+                VALUES (%s, %s, %s)
+                ''', (version, description, duration_ms))
+                conn.commit()
+                logger.info(f"Applied migration {version} in {duration_ms} ms")
+
+            if partition_tables and not _is_partitioned(cursor):
+                logger.info("Partitioning requests and donations by month...")
+                started = time.perf_counter()
+                _partition_by_month(cursor)
+                conn.commit()
+                db.requests_partitioned(cursor, refresh=True)
+                logger.info(f"Partitioned requests and donations in {time.perf_counter() - started:.1f} s")
+        finally:
+            # The lock belongs to the connection, not the transaction, and would stay held
+            # by it back in the pool. A failed migration leaves the transaction aborted, so
+            # roll back before unlocking.
+            conn.rollback()
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+            conn.commit()
+
+        return True
+    except Exception as e:
+        logger.error(f"Error applying migrations: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def ensure_schema():
+    """Startup check: one query when the schema is current, migrate only when it is behind."""
+    version = get_schema_version()
+    if version is None:
+        return False
+    if version >= SCHEMA_VERSION:
+        logger.info(f"Schema is up to date (version {version})")
+        return True
+
+    if not AUTO_MIGRATE:
+        logger.error(f"Schema is at version {version} but {SCHEMA_VERSION} is required, "
+                     f"run 'python migrate.py'")
+        return False
+    logger.warning(f"Schema is at version {version}, migrating to {SCHEMA_VERSION}...")
+    return migrate()
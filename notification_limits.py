@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+import database as db
+import async_db as adb
+
+logger = logging.getLogger('notification_limits')
+
+# A donor receives at most this many request notifications per sliding window
+NOTIFICATION_CAP_PER_WINDOW = int(os.getenv('NOTIFICATION_CAP_PER_WINDOW', '5'))
+NOTIFICATION_CAP_WINDOW_HOURS = int(os.getenv('NOTIFICATION_CAP_WINDOW_HOURS', '24'))
+
+# How often the in-memory notification log is written to the database
+NOTIFICATION_FLUSH_INTERVAL_SECONDS = int(os.getenv('NOTIFICATION_FLUSH_INTERVAL_SECONDS', '60'))
+
+# Reasons returned by check_notification
+SKIP_DUPLICATE = 'duplicate'
+SKIP_CAPPED = 'capped'
+
+# donor_id -> deque of epoch timestamps of notifications inside the window
+_sent_times = {}
+# (request_id, donor_id) -> epoch timestamp, for pairs notified inside the window. Older
+# pairs are forgotten as on a restart, which only loads the window; by then escalation
+# has long finished and the request's notified_donors still stops repeats.
+_notified_pairs = {}
+# Rows waiting to be written to donor_notifications
+_pending = []
+
+
+def _window_seconds():
+    return NOTIFICATION_CAP_WINDOW_HOURS * 3600
+
+
+def _key(request_id, donor_id):
+    return int(request_id), int(donor_id)
+
+
+def _prune(times, now):
+    cutoff = now - _window_seconds()
+    while times and times[0] <= cutoff:
+        times.popleft()
+
+
+def load_notification_history():
+    """Seed the counters and pair set from notifications stored in the database."""
+    since = datetime.now() - timedelta(seconds=_window_seconds())
+    rows = db.get_recent_donor_notifications(since)
+    for request_id, donor_id, sent_at in rows:
+        _notified_pairs[_key(request_id, donor_id)] = sent_at.timestamp()
+        _sent_times.setdefault(int(donor_id), deque()).append(sent_at.timestamp())
+    logger.info(f"Loaded {len(rows)} recent donor notifications")
+
+
+def check_notification(request_id, donor_id, now=None):
+    """Return None if the donor may be notified about the request, otherwise the skip reason."""
+    if _key(request_id, donor_id) in _notified_pairs:
+        return SKIP_DUPLICATE
+
+    times = _sent_times.get(int(donor_id))
+    if times:
+        _prune(times, time.time() if now is None else now)
+        if len(times) >= NOTIFICATION_CAP_PER_WINDOW:
+            return SKIP_CAPPED
+    return None
+
+
+def record_notification(request_id, donor_id, now=None):
+    """Count a notification against the donor's window and queue it for persistence."""
+    now = time.time() if now is None else now
+    _notified_pairs[_key(request_id, donor_id)] = now
+    _sent_times.setdefault(int(donor_id), deque()).append(now)
+    _pending.append((int(request_id), int(donor_id), datetime.fromtimestamp(now)))
+
+
+async def flush_notifications():
+    """Write queued notifications to the database. Returns the number of rows written.
+
+    Only the write runs on the DB thread pool; the in-memory state is read and
+    pruned here on the event loop, which is the only thread changing it.
+    """
+    if not _pending:
+        return 0
+
+    rows = _pending[:]
+    if not await adb.save_donor_notifications(rows):
+        # Keep the rows queued and try again on the next flush
+        return 0
+    del _pending[:len(rows)]
+
+    # Forget donors whose window has emptied and pairs older than it so neither grows forever
+    now = time.time()
+    for donor_id in list(_sent_times):
+        _prune(_sent_times[donor_id], now)
+        if not _sent_times[donor_id]:
+            del _sent_times[donor_id]
+    cutoff = now - _window_seconds()
+    for key in [key for key, sent_at in _notified_pairs.items() if sent_at <= cutoff]:
+        del _notified_pairs[key]
+
+    logger.info(f"Flushed {len(rows)} donor notifications")
+    return len(rows)
@@ -0,0 +1,30 @@
+"""Calendar month helpers shared by the storage backends.
+
+Period filters are expressed as half-open [start, end) timestamp ranges so
+they can use an index on the date column (and, on Postgres, prune monthly
+partitions) instead of evaluating EXTRACT/strftime on every row.
+"""
+from datetime import datetime
+
+
+def month_start(value):
+    """Return midnight on the first day of value's month."""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """Return the first day of the month `count` months after `month` (a month_start)."""
+    year, index = divmod(month.month - 1 + count, 12)
+    return datetime(month.year + year, index + 1, 1)
+
+
+def period_range(period, now=None):
+    """Return the [start, end) range for 'month' or 'year' containing now, None for any other period."""
+    now = now or datetime.now()
+    if period == 'month':
+        start = month_start(now)
+        return start, add_months(start, 1)
+    if period == 'year':
+        start = datetime(now.year, 1, 1)
+        return start, datetime(now.year + 1, 1, 1)
+    return None
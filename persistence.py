@@ -0,0 +1,215 @@
+import os
+import json
+import asyncio
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+import async_db as adb
+
+logger = logging.getLogger('persistence')
+
+# How often python-telegram-bot hands changed user_data/chat_data/conversations to the persistence
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '10'))
+
+
+def _encode_key(key):
+    return json.dumps(list(key))
+
+
+def _decode_key(key):
+    return tuple(json.loads(key))
+
+
+class PostgresPersistence(BasePersistence):
+    """Keep user_data, chat_data and conversation states in Postgres.
+
+    Everything is read once at startup and served from memory afterwards.
+    Changes are only queued by the update_* and drop_* methods: the first
+    one queued schedules a single write task, so all changes handed over in
+    one persistence cycle go to the database in one transaction on a worker
+    thread of the database pool and never hold up update processing. flush() writes whatever is
+    still queued when the application shuts down.
+
+    bot_data and callback_data are not used by this bot and are not stored.
+    """
+
+    def __init__(self, update_interval=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=PERSISTENCE_UPDATE_INTERVAL if update_interval is None else update_interval
+        )
+        self._user_data = None
+        self._chat_data = None
+        self._conversations = None
+        # Last written JSON per id, so unchanged data is not written again
+        self._user_json = {}
+        self._chat_json = {}
+
+        # Queued changes, later changes to the same key replace earlier ones
+        self._pending_users = {}
+        self._pending_chats = {}
+        self._pending_conversations = {}
+        self._dropped_users = set()
+        self._dropped_chats = set()
+        self._write_task = None
+        self._write_lock = asyncio.Lock()
+
+    # Loading
+
+    async def get_user_data(self):
+        if self._user_data is None:
+            self._user_data = await adb.load_persisted_data('user')
+            self._user_json = {user_id: json.dumps(data, default=str) for user_id, data in self._user_data.items()}
+            logger.info(f"Loaded persisted user_data for {len(self._user_data)} users")
+        return {user_id: dict(data) for user_id, data in self._user_data.items()}
+
+    async def get_chat_data(self):
+        if self._chat_data is None:
+            self._chat_data = await adb.load_persisted_data('chat')
+            self._chat_json = {chat_id: json.dumps(data, default=str) for chat_id, data in self._chat_data.items()}
+            logger.info(f"Loaded persisted chat_data for {len(self._chat_data)} chats")
+        return {chat_id: dict(data) for chat_id, data in self._chat_data.items()}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        if self._conversations is None:
+            # One query for every ConversationHandler instead of one each
+            stored = await adb.load_persisted_conversations()
+            self._conversations = {
+                handler: {_decode_key(key): json.loads(state) for key, state in rows.items()}
+                for handler, rows in stored.items()
+            }
+            logger.info(f"Loaded {sum(len(rows) for rows in stored.values())} persisted conversations")
+        return dict(self._conversations.get(name, {}))
+
+    # Queueing changes
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def update_user_data(self, user_id, data):
+        encoded = json.dumps(data, default=str)
+        if self._user_json.get(user_id) == encoded:
+            return
+        self._user_json[user_id] = encoded
+        self._dropped_users.discard(user_id)
+        self._pending_users[user_id] = encoded
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        encoded = json.dumps(data, default=str)
+        if self._chat_json.get(chat_id) == encoded:
+            return
+        self._chat_json[chat_id] = encoded
+        self._dropped_chats.discard(chat_id)
+        self._pending_chats[chat_id] = encoded
+        self._schedule_write()
+
+    async def update_conversation(self, name, key, new_state):
+        if self._conversations is None:
+            self._conversations = {}
+        conversations = self._conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._pending_conversations[(name, _encode_key(key))] = (
+            None if new_state is None else json.dumps(new_state)
+        )
+        self._schedule_write()
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._user_json.pop(user_id, None)
+        self._pending_users.pop(user_id, None)
+        self._dropped_users.add(user_id)
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id):
+        self._chat_json.pop(chat_id, None)
+        self._pending_chats.pop(chat_id, None)
+        self._dropped_chats.add(chat_id)
+        self._schedule_write()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Writing
+
+    def _take_pending(self):
+        batch = (
+            list(self._pending_users.items()),
+            list(self._pending_chats.items()),
+            [(name, key, state) for (name, key), state in self._pending_conversations.items()],
+            set(self._dropped_users),
+            set(self._dropped_chats)
+        )
+        self._pending_users.clear()
+        self._pending_chats.clear()
+        self._pending_conversations.clear()
+        self._dropped_users.clear()
+        self._dropped_chats.clear()
+        return batch
+
+    def _requeue(self, batch):
+        """Put a batch that failed to save back, without overwriting newer changes."""
+        users, chats, conversations, dropped_users, dropped_chats = batch
+        for user_id, data in users:
+            if user_id not in self._dropped_users:
+                self._pending_users.setdefault(user_id, data)
+        for chat_id, data in chats:
+            if chat_id not in self._dropped_chats:
+                self._pending_chats.setdefault(chat_id, data)
+        for name, key, state in conversations:
+            self._pending_conversations.setdefault((name, key), state)
+        self._dropped_users.update(user_id for user_id in dropped_users if user_id not in self._pending_users)
+        self._dropped_chats.update(chat_id for chat_id in dropped_chats if chat_id not in self._pending_chats)
+
+    def _has_pending(self):
+        return bool(self._pending_users or self._pending_chats or self._pending_conversations
+                    or self._dropped_users or self._dropped_chats)
+
+    async def _write_pending(self):
+        # Let the rest of this persistence cycle queue its changes first
+        await asyncio.sleep(0)
+        async with self._write_lock:
+            if not self._has_pending():
+                return
+            batch = self._take_pending()
+            saved = await adb.save_persistence_batch(*batch)
+            if not saved:
+                # Retried with the next batch or at shutdown
+                self._requeue(batch)
+                return
+            logger.debug(f"Persisted {len(batch[0])} user_data, {len(batch[1])} chat_data and "
+                         f"{len(batch[2])} conversation changes")
+
+    async def flush(self):
+        if self._write_task is not None and not self._write_task.done():
+            await self._write_task
+        async with self._write_lock:
+            if not self._has_pending():
+                return
+            batch = self._take_pending()
+            if not await adb.save_persistence_batch(*batch):
+                logger.error("Could not persist conversation state at shutdown")
+                return
+        logger.info("Flushed persisted conversation state")
@@ -0,0 +1,71 @@
+import os
+import logging
+from datetime import datetime, timedelta
+import database as db
+
+logger = logging.getLogger('request_lifecycle')
+
+# Hours an unanswered request stays active, by urgency; unknown urgencies use 'High'
+REQUEST_TTL_HOURS = {
+    'Urgent': int(os.getenv('REQUEST_TTL_HOURS_URGENT', '24')),
+    'High': int(os.getenv('REQUEST_TTL_HOURS_HIGH', '72')),
+    'Medium': int(os.getenv('REQUEST_TTL_HOURS_MEDIUM', '168')),
+    'Low': int(os.getenv('REQUEST_TTL_HOURS_LOW', '336'))
+}
+
+# Closed (fulfilled, deactivated or expired) requests older than this move to the archive tables
+REQUEST_ARCHIVE_AFTER_DAYS = int(os.getenv('REQUEST_ARCHIVE_AFTER_DAYS', '30'))
+
+# Rows expired or archived per statement, so no single transaction holds many locks
+REQUEST_LIFECYCLE_BATCH_SIZE = int(os.getenv('REQUEST_LIFECYCLE_BATCH_SIZE', '500'))
+
+# How often the lifecycle job runs
+REQUEST_LIFECYCLE_INTERVAL_SECONDS = int(os.getenv('REQUEST_LIFECYCLE_INTERVAL_SECONDS', '3600'))
+
+
+def expire_stale_requests(now=None):
+    """Expire active requests that outlived their urgency's TTL. Returns the expired request IDs."""
+    now = now or datetime.now()
+    cutoffs = {urgency.lower(): now - timedelta(hours=hours) for urgency, hours in REQUEST_TTL_HOURS.items()}
+    default_cutoff = cutoffs['high']
+
+    expired_ids = []
+    while True:
+        batch = db.expire_stale_requests(cutoffs, default_cutoff, REQUEST_LIFECYCLE_BATCH_SIZE)
+        expired_ids.extend(batch)
+        if len(batch) < REQUEST_LIFECYCLE_BATCH_SIZE:
+            break
+
+    if expired_ids:
+        logger.info(f"Expired {len(expired_ids)} stale requests")
+    return expired_ids
+
+
+def archive_closed_requests(now=None, archive_after_days=None):
+    """Move old closed requests and their donations to the archive tables. Returns the number archived."""
+    days = REQUEST_ARCHIVE_AFTER_DAYS if archive_after_days is None else archive_after_days
+    closed_before = (now or datetime.now()) - timedelta(days=days)
+
+    archived = 0
+    while True:
+        batch = db.archive_closed_requests(closed_before, REQUEST_LIFECYCLE_BATCH_SIZE)
+        if not batch:
+            break
+        archived += batch
+        if batch < REQUEST_LIFECYCLE_BATCH_SIZE:
+            break
+
+    if archived:
+        logger.info(f"Archived {archived} closed requests older than {days} days")
+    return archived
+
+
+def run_lifecycle(now=None, archive_after_days=None):
+    """Create upcoming monthly partitions, expire stale requests, then archive old closed ones.
+
+    Returns (expired request IDs, archived count).
+    """
+    db.ensure_partitions()
+    expired_ids = expire_stale_requests(now)
+    archived = archive_closed_requests(now, archive_after_days)
+    return expired_ids, archived
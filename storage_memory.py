@@ -0,0 +1,745 @@
+import os
+import json
+import logging
+import threading
+from itertools import chain
+from contextlib import contextmanager
+from datetime import datetime
+from locations import get_location_codes
+from storage_session import Session, active_session, current_session
+from periods import month_start, period_range
+
+logger = logging.getLogger('storage_memory')
+
+# Workers async_db runs storage calls on. Calls only hold the lock for a few
+# microseconds, so a handful is plenty.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '4'))
+
+SCHEMA_VERSION = 1
+
+# Writes are applied at once, there is no transaction to take savepoints in
+SUPPORTS_SAVEPOINTS = False
+# Each call holds the lock only while it runs
+SINGLE_WRITER = False
+
+# Every row a table returns has all of its columns, like the SQL backends
+DONOR_COLUMNS = {
+    'telegram_id': None, 'name': None, 'age': None, 'phone': None, 'district': None, 'division': None,
+    'area': None, 'blood_group': None, 'gender': None, 'registration_date': None, 'is_restricted': False,
+    'division_code': None, 'district_code': None, 'last_donation_at': None, 'is_unreachable': False,
+    'unreachable_at': None
+}
+REQUEST_COLUMNS = {
+    'telegram_id': None, 'name': None, 'age': None, 'hospital_name': None, 'hospital_address': None,
+    'area': None, 'division': None, 'district': None, 'urgency': None, 'phone': None, 'blood_group': None,
+    'request_date': None, 'status': 'active', 'notified_donors': None, 'division_code': None,
+    'district_code': None
+}
+
+# One lock for all tables; every function holds it for its whole read or write
+_lock = threading.RLock()
+
+class _Table:
+    """Rows by auto-increment id."""
+
+    def __init__(self):
+        self.rows = {}
+        self.next_id = 1
+
+    def insert(self, row):
+        row_id = self.next_id
+        self.next_id += 1
+        row['id'] = row_id
+        self.rows[row_id] = row
+        return row_id
+
+def _new_store():
+    return {
+        'donors': _Table(),
+        'requests': _Table(),
+        'donations': _Table(),
+        'support_messages': _Table(),
+        'admin_replies': _Table(),
+        'broadcast_messages': _Table(),
+        'personalized_messages': _Table(),
+        # Indexes kept in step with the tables above
+        'donor_by_telegram_id': {},           # telegram_id -> donor id
+        'donors_by_blood_group': {},          # blood group -> set of donor ids
+        'donations_by_request': {},           # request id -> {donor id: donation id}
+        'donations_by_donor': {},             # donor id -> set of donation ids, archived ones included
+        'donor_monthly_donations': {},        # (donor id, month start) -> completed donations, archived included
+        # Archived rows by id, see archive_closed_requests
+        'requests_archive': {},
+        'donations_archive': {},
+        # Keyed tables
+        'donor_notifications': {},            # (request_id, donor_id) -> sent_at
+        'telegram_chats': {},                 # chat_id -> row
+        'persistence_user_data': {},          # user_id -> data JSON
+        'persistence_chat_data': {},          # chat_id -> data JSON
+        'persistence_conversations': {},      # (name, key JSON) -> state JSON
+        'restricted_telegram_ids': set()
+    }
+
+_store = _new_store()
+
+def clear():
+    """Drop all stored data, e.g. between benchmark runs."""
+    global _store
+    with _lock:
+        _store = _new_store()
+
+def _int(value):
+    return int(value) if value is not None else None
+
+def _copy(row):
+    return dict(row) if row is not None else None
+
+def _newest_first(rows, column):
+    return sorted(rows, key=lambda row: (row[column] is not None, row[column] or datetime.min), reverse=True)
+
+# Connections, sessions and schema
+def get_db_connection():
+    """There is no SQL connection behind this backend."""
+    raise NotImplementedError("The in-memory storage backend has no database connection")
+
+def new_session():
+    """Create a Session so units of work behave as on the SQL backends.
+
+    Writes are applied immediately and are not rolled back when the unit of
+    work fails.
+    """
+    return Session(get_db_connection)
+
+@contextmanager
+def session():
+    """Mark a unit of work; nested blocks just join the outer one."""
+    active = active_session()
+    if active is not None:
+        yield active
+        return
+    new = new_session()
+    token = current_session.set(new)
+    try:
+        yield new
+    finally:
+        current_session.reset(token)
+        new.close()
+
+def close_pool():
+    """Nothing to close."""
+
+def print_db_info():
+    """Log what the in-memory store holds."""
+    with _lock:
+        counts = {table: len(_store[table].rows) for table in ('donors', 'requests', 'donations')}
+    logger.info("Database connection info:")
+    logger.info("- Connection type: in-memory (data is lost on exit)")
+    logger.info(f"- Rows: {counts['donors']} donors, {counts['requests']} requests, {counts['donations']} donations")
+    return True
+
+def ensure_schema():
+    return True
+
+def migrate():
+    return True
+
+def get_schema_version():
+    return SCHEMA_VERSION
+
+def ensure_partitions(months_ahead=None):
+    return []
+
+# Donor functions
+def save_donor(donor_data):
+    """Save a new donor."""
+    with _lock:
+        telegram_id = _int(donor_data['telegram_id'])
+        if telegram_id in _store['donor_by_telegram_id']:
+            logger.error(f"Error saving donor: duplicate donor Telegram ID: {telegram_id}")
+            return None
+
+        division_code, district_code = get_location_codes(donor_data['division'], donor_data['district'])
+        row = dict(DONOR_COLUMNS)
+        row.update({key: donor_data[key] for key in DONOR_COLUMNS if key in donor_data})
+        row.update(telegram_id=telegram_id, division_code=division_code, district_code=district_code)
+        donor_id = _store['donors'].insert(row)
+
+        _store['donor_by_telegram_id'][telegram_id] = donor_id
+        _store['donors_by_blood_group'].setdefault(row['blood_group'], set()).add(donor_id)
+        return donor_id
+
+def get_donor_by_telegram_id(telegram_id):
+    """Get donor information by Telegram ID."""
+    with _lock:
+        donor_id = _store['donor_by_telegram_id'].get(_int(telegram_id))
+        return _copy(_store['donors'].rows.get(donor_id))
+
+def get_donor_by_id(donor_id):
+    """Get donor information by ID."""
+    with _lock:
+        return _copy(_store['donors'].rows.get(_int(donor_id)))
+
+def update_donor(donor_id, update_data):
+    """Update donor information."""
+    with _lock:
+        row = _store['donors'].rows.get(_int(donor_id))
+        if row is None:
+            return True
+        if 'telegram_id' in update_data:
+            del _store['donor_by_telegram_id'][row['telegram_id']]
+            _store['donor_by_telegram_id'][_int(update_data['telegram_id'])] = row['id']
+        if 'blood_group' in update_data:
+            _store['donors_by_blood_group'][row['blood_group']].discard(row['id'])
+            _store['donors_by_blood_group'].setdefault(update_data['blood_group'], set()).add(row['id'])
+        row.update(update_data)
+        return True
+
+def get_all_donors(reachable_only=False):
+    """Get all registered donors, optionally skipping donors marked unreachable."""
+    with _lock:
+        rows = [_copy(row) for row in _store['donors'].rows.values()
+                if not (reachable_only and row['is_unreachable'])]
+    return _newest_first(rows, 'registration_date')
+
+def search_donors(search_term):
+    """Search for donors by name, blood group, or location."""
+    term = search_term.lower()
+    with _lock:
+        rows = [_copy(row) for row in _store['donors'].rows.values()
+                if any(term in (row[column] or '').lower()
+                       for column in ('name', 'blood_group', 'district', 'division', 'phone'))]
+    return _newest_first(rows, 'registration_date')
+
+def get_donors_by_blood_groups(blood_groups, reachable_only=False):
+    """Get donors with specific blood groups, optionally skipping donors marked unreachable."""
+    with _lock:
+        donors = _store['donors'].rows
+        return [_copy(donors[donor_id])
+                for blood_group in blood_groups
+                for donor_id in sorted(_store['donors_by_blood_group'].get(blood_group, ()))
+                if not (reachable_only and donors[donor_id]['is_unreachable'])]
+
+def get_donor_index_rows():
+    """Get the donor columns needed to build the matching index."""
+    columns = ('id', 'telegram_id', 'blood_group', 'division', 'district', 'division_code', 'district_code',
+               'is_restricted', 'is_unreachable', 'last_donation_at')
+    with _lock:
+        return [{column: row[column] for column in columns} for row in _store['donors'].rows.values()]
+
+def delete_donor(donor_id):
+    """Delete a donor."""
+    with _lock:
+        row = _store['donors'].rows.pop(_int(donor_id), None)
+        if row is not None:
+            del _store['donor_by_telegram_id'][row['telegram_id']]
+            _store['donors_by_blood_group'][row['blood_group']].discard(row['id'])
+            _store['restricted_telegram_ids'].discard(row['telegram_id'])
+            monthly = _store['donor_monthly_donations']
+            for key in [key for key in monthly if key[0] == row['id']]:
+                del monthly[key]
+        return True
+
+def update_donor_restriction(donor_id, is_restricted):
+    """Update donor restriction status."""
+    with _lock:
+        row = _store['donors'].rows.get(_int(donor_id))
+        if row is not None:
+            row['is_restricted'] = bool(is_restricted)
+            if is_restricted:
+                _store['restricted_telegram_ids'].add(row['telegram_id'])
+            else:
+                _store['restricted_telegram_ids'].discard(row['telegram_id'])
+        return True
+
+def load_restricted_telegram_ids():
+    """Rebuild the restricted Telegram ID set from the donors."""
+    with _lock:
+        restricted = {row['telegram_id'] for row in _store['donors'].rows.values() if row['is_restricted']}
+        _store['restricted_telegram_ids'] = restricted
+    logger.info(f"Loaded {len(restricted)} restricted users")
+    return True
+
+def is_telegram_id_restricted(telegram_id):
+    """Check the restricted set."""
+    return telegram_id in _store['restricted_telegram_ids']
+
+def mark_donor_unreachable(donor_id):
+    """Flag a donor whose Telegram chat permanently rejects messages."""
+    with _lock:
+        row = _store['donors'].rows.get(_int(donor_id))
+        if row is not None and not row['is_unreachable']:
+            row.update(is_unreachable=True, unreachable_at=datetime.now())
+        return True
+
+def mark_donor_reachable(telegram_id):
+    """Clear the unreachable flag once a donor talks to the bot again. Returns True if it was set."""
+    with _lock:
+        row = _store['donors'].rows.get(_store['donor_by_telegram_id'].get(_int(telegram_id)))
+        if row is None or not row['is_unreachable']:
+            return False
+        row.update(is_unreachable=False, unreachable_at=None)
+        return True
+
+def get_donor_stats(donor_id):
+    """Get statistics for a specific donor."""
+    donor_id = _int(donor_id)
+    with _lock:
+        donations = _store['donations'].rows
+        archived = _store['donations_archive']
+        statuses = [(donations.get(donation_id) or archived[donation_id])['status']
+                    for donation_id in _store['donations_by_donor'].get(donor_id, ())]
+        donation_count = len(statuses)
+        donor_rank = None
+        if donor_id in _store['donors'].rows:
+            # Same as RANK() OVER (ORDER BY donation count DESC)
+            donor_rank = 1 + sum(1 for other_id in _store['donors'].rows
+                                 if len(_store['donations_by_donor'].get(other_id, ())) > donation_count)
+
+    return {
+        'total_donations': donation_count,
+        'fulfilled_donations': statuses.count('completed'),
+        'pending_donations': statuses.count('pending'),
+        'donor_rank': donor_rank
+    }
+
+def get_top_donors(limit=10, period=None):
+    """Get top donors by donation count."""
+    date_range = period_range(period)
+    counts = {}
+    with _lock:
+        donors = _store['donors'].rows
+        for (donor_id, month), count in _store['donor_monthly_donations'].items():
+            if donor_id in donors and (not date_range or date_range[0] <= month < date_range[1]):
+                counts[donor_id] = counts.get(donor_id, 0) + count
+        top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{'id': donor_id, 'name': donors[donor_id]['name'], 'blood_group': donors[donor_id]['blood_group'],
+                 'donation_count': count} for donor_id, count in top]
+
+# Columns of the rows import_donors takes, in order
+DONOR_IMPORT_COLUMNS = ('line', 'telegram_id', 'name', 'age', 'phone', 'district', 'division', 'area', 'blood_group',
+                        'gender', 'division_code', 'district_code')
+
+# Columns an import leaves alone when the file has no value for them
+DONOR_IMPORT_OPTIONAL = ('age', 'phone', 'area', 'gender')
+
+def _normalized_phone(phone):
+    for separator in (' ', '-', '(', ')', '.'):
+        phone = phone.replace(separator, '')
+    return phone
+
+def import_donors(rows):
+    """Upsert validated donor rows (tuples in DONOR_IMPORT_COLUMNS order).
+
+    Rows match donors by Telegram ID, or by phone number for rows without one;
+    those can only update an existing donor. Returns
+    {'inserted', 'updated', 'errors': [(line, message)]}.
+    """
+    staged = [dict(zip(DONOR_IMPORT_COLUMNS, row)) for row in rows]
+    errors = []
+    with _lock:
+        phones = {}
+        for row in _store['donors'].rows.values():
+            if row['phone'] is not None:
+                phones.setdefault(_normalized_phone(row['phone']), []).append(row['id'])
+        for item in staged:
+            item['donor_id'] = _store['donor_by_telegram_id'].get(item['telegram_id'])
+        claimed = {item['donor_id']: item['line'] for item in staged if item['donor_id'] is not None}
+
+        for item in staged:
+            if item['telegram_id'] is not None:
+                continue
+            matches = phones.get(item['phone'], [])
+            if len(matches) > 1:
+                errors.append((item['line'], f"phone number belongs to {len(matches)} donors"))
+            elif not matches:
+                errors.append((item['line'], "no donor has this phone number, new donors need a Telegram ID"))
+            elif matches[0] in claimed:
+                errors.append((item['line'], f"phone number belongs to the donor on line {claimed[matches[0]]}"))
+            else:
+                item['donor_id'] = matches[0]
+
+        inserted = updated = 0
+        now = datetime.now()
+        for item in staged:
+            donor = {key: item[key] for key in DONOR_IMPORT_COLUMNS[1:]
+                     if item[key] is not None or key not in DONOR_IMPORT_OPTIONAL}
+            if item['donor_id'] is not None:
+                donor.pop('telegram_id', None)
+                update_donor(item['donor_id'], donor)
+                updated += 1
+            elif item['telegram_id'] is not None:
+                save_donor(dict(donor, registration_date=now))
+                inserted += 1
+        return {'inserted': inserted, 'updated': updated, 'errors': errors}
+
+# Request functions
+def save_request(request_data):
+    """Save a new blood request."""
+    with _lock:
+        division_code, district_code = get_location_codes(request_data['division'], request_data['district'])
+        row = dict(REQUEST_COLUMNS)
+        row.update({key: request_data[key] for key in REQUEST_COLUMNS if key in request_data})
+        row.update(division_code=division_code, district_code=district_code)
+        return _store['requests'].insert(row)
+
+def get_request_by_id(request_id):
+    """Get request information by ID."""
+    with _lock:
+        return _copy(_store['requests'].rows.get(_int(request_id)))
+
+def get_active_requests():
+    """Get all active blood requests."""
+    with _lock:
+        rows = [_copy(row) for row in _store['requests'].rows.values() if row['status'] == 'active']
+    return _newest_first(rows, 'request_date')
+
+def get_requests_by_location(division, district=None):
+    """Get active requests by location."""
+    division_code, district_code = get_location_codes(division, district)
+
+    if district and district_code is not None:
+        matches = lambda row: row['district_code'] == district_code
+    elif district:
+        # Unrecognised district name, fall back to comparing the text
+        matches = lambda row: ((row['division'] or '').lower() == division.lower()
+                               and (row['district'] or '').lower() == district.lower())
+    elif division_code is not None:
+        matches = lambda row: row['division_code'] == division_code
+    else:
+        matches = lambda row: (row['division'] or '').lower() == division.lower()
+
+    with _lock:
+        rows = [_copy(row) for row in _store['requests'].rows.values() if row['status'] == 'active' and matches(row)]
+    return _newest_first(rows, 'request_date')
+
+def update_request_status(request_id, status):
+    """Update the status of a request."""
+    return update_request_field(request_id, 'status', status)
+
+def update_request_field(request_id, field, value):
+    """Update a specific field in a request."""
+    with _lock:
+        row = _store['requests'].rows.get(_int(request_id))
+        if row is not None:
+            row[field] = value
+        return True
+
+def update_request_notified_donors(request_id, donor_ids):
+    """Update the list of notified donors for a request."""
+    return update_request_field(request_id, 'notified_donors', ','.join(str(id) for id in donor_ids))
+
+def delete_request(request_id):
+    """Delete a request and its donations."""
+    request_id = _int(request_id)
+    with _lock:
+        for donor_id, donation_id in _store['donations_by_request'].pop(request_id, {}).items():
+            donation = _store['donations'].rows.pop(donation_id)
+            if donation['status'] == 'completed':
+                _count_completed_donation(donation, -1)
+            _store['donations_by_donor'][donor_id].discard(donation_id)
+        _store['requests'].rows.pop(request_id, None)
+        return True
+
+# Request lifecycle functions
+def expire_stale_requests(cutoffs, default_cutoff, limit=500):
+    """Mark up to `limit` active requests older than their urgency's cutoff as expired.
+
+    cutoffs maps a lower-case urgency to the oldest request_date that stays
+    active; other urgencies use default_cutoff. Returns the expired request IDs.
+    """
+    with _lock:
+        stale = [row for row in _store['requests'].rows.values()
+                 if row['status'] == 'active' and row['request_date'] is not None
+                 and row['request_date'] < cutoffs.get((row['urgency'] or '').strip().lower(), default_cutoff)]
+        stale = sorted(stale, key=lambda row: row['request_date'])[:limit]
+        for row in stale:
+            row['status'] = 'expired'
+        return [row['id'] for row in stale]
+
+def archive_closed_requests(closed_before, limit=500):
+    """Move up to `limit` closed requests dated before closed_before, with their donations, to the archive.
+
+    Returns how many requests were archived.
+    """
+    archived_at = datetime.now()
+    with _lock:
+        requests = _store['requests'].rows
+        request_ids = sorted(row['id'] for row in requests.values()
+                             if row['status'] in ('fulfilled', 'inactive', 'expired')
+                             and row['request_date'] is not None and row['request_date'] < closed_before)[:limit]
+        for request_id in request_ids:
+            for donation_id in _store['donations_by_request'].pop(request_id, {}).values():
+                donation = _store['donations'].rows.pop(donation_id)
+                _store['donations_archive'][donation_id] = dict(donation, archived_at=archived_at)
+            _store['requests_archive'][request_id] = dict(requests.pop(request_id), archived_at=archived_at)
+        return len(request_ids)
+
+# Donation functions
+def _count_completed_donation(donation, delta):
+    """Keep donor_monthly_donations in step with a donation entering (+1) or leaving (-1) 'completed'."""
+    if donation['acceptance_date'] is None:
+        return
+    monthly = _store['donor_monthly_donations']
+    key = (donation['donor_id'], month_start(donation['acceptance_date']))
+    monthly[key] = monthly.get(key, 0) + delta
+    if monthly[key] <= 0:
+        del monthly[key]
+
+def _set_donation_status(request_id, donor_id, status):
+    request_id, donor_id = _int(request_id), _int(donor_id)
+    with _lock:
+        by_donor = _store['donations_by_request'].setdefault(request_id, {})
+        donation_id = by_donor.get(donor_id)
+        if donation_id is not None:
+            donation = _store['donations'].rows[donation_id]
+            if donation['status'] == 'completed':
+                _count_completed_donation(donation, -1)
+            donation.update(status=status, acceptance_date=datetime.now())
+            return True
+
+        donation_id = _store['donations'].insert({
+            'request_id': request_id,
+            'donor_id': donor_id,
+            'status': status,
+            'acceptance_date': datetime.now(),
+            'completion_date': None,
+            'notes': None
+        })
+        by_donor[donor_id] = donation_id
+        _store['donations_by_donor'].setdefault(donor_id, set()).add(donation_id)
+        return True
+
+def add_donor_to_request(request_id, donor_id):
+    """Add a donor to a request (donor accepts a blood request)."""
+    return _set_donation_status(request_id, donor_id, 'pending')
+
+def add_donor_to_declined_request(request_id, donor_id):
+    """Record that a donor declined a request."""
+    return _set_donation_status(request_id, donor_id, 'declined')
+
+def complete_request_donations(request_id):
+    """Mark a request's pending donations as completed and record each donor's donation date."""
+    completed_at = datetime.now()
+    donor_ids = []
+    with _lock:
+        donations = _store['donations'].rows
+        for donor_id, donation_id in _store['donations_by_request'].get(_int(request_id), {}).items():
+            donation = donations[donation_id]
+            if donation['status'] != 'pending':
+                continue
+            donation.update(status='completed', completion_date=completed_at)
+            _count_completed_donation(donation, 1)
+            donor_ids.append(donor_id)
+            donor = _store['donors'].rows.get(donor_id)
+            if donor is not None and (donor['last_donation_at'] is None or donor['last_donation_at'] < completed_at):
+                donor['last_donation_at'] = completed_at
+    return donor_ids
+
+def count_request_acceptances(request_id):
+    """Count donors who accepted a request and have not dropped out."""
+    with _lock:
+        donations = _store['donations'].rows
+        return sum(1 for donation_id in _store['donations_by_request'].get(_int(request_id), {}).values()
+                   if donations[donation_id]['status'] in ('pending', 'completed'))
+
+def get_recent_donor_notifications(since):
+    """Get (request_id, donor_id, sent_at) rows for notifications sent since a given time."""
+    with _lock:
+        rows = [(request_id, donor_id, sent_at)
+                for (request_id, donor_id), sent_at in _store['donor_notifications'].items() if sent_at >= since]
+    return sorted(rows, key=lambda row: row[2])
+
+def save_donor_notifications(notifications):
+    """Store (request_id, donor_id, sent_at) notification rows, ignoring duplicates."""
+    with _lock:
+        for request_id, donor_id, sent_at in notifications:
+            _store['donor_notifications'].setdefault((_int(request_id), _int(donor_id)), sent_at)
+        return True
+
+# Columns of the nested 'request' and 'donor' records in get_recent_operations
+OPERATION_REQUEST_COLUMNS = ('id', 'name', 'blood_group', 'hospital_name', 'division', 'district', 'urgency', 'status')
+OPERATION_DONOR_COLUMNS = ('id', 'name', 'blood_group', 'division', 'district')
+
+def get_recent_operations(limit=10, offset=0):
+    """Get recent successful donation operations, newest first, skipping the first `offset`."""
+    with _lock:
+        requests, donors = _store['requests'].rows, _store['donors'].rows
+        donations = [donation for donation in _store['donations'].rows.values()
+                     if donation['status'] in ('pending', 'completed')
+                     and donation['request_id'] in requests and donation['donor_id'] in donors]
+        return [
+            {
+                'id': donation['id'],
+                'operation_date': donation['acceptance_date'],
+                'request': {column: requests[donation['request_id']][column] for column in OPERATION_REQUEST_COLUMNS},
+                'donor': {column: donors[donation['donor_id']][column] for column in OPERATION_DONOR_COLUMNS}
+            }
+            for donation in _newest_first(donations, 'acceptance_date')[offset:offset + limit]
+        ]
+
+# Column order of exported rows, as in the SQL tables
+EXPORT_COLUMNS = {
+    'donors': ('id', *DONOR_COLUMNS),
+    'requests': ('id', *REQUEST_COLUMNS),
+    'donations': ('id', 'request_id', 'donor_id', 'status', 'acceptance_date', 'completion_date', 'notes')
+}
+
+def export_table(table, export_format, out):
+    """Write every row of table, by id, to out.write() as CSV with a header row or as JSON lines."""
+    import data_export
+    columns = EXPORT_COLUMNS[table]
+    with _lock:
+        rows = [tuple(row[column] for column in columns)
+                for _, row in sorted(_store[table].rows.items())]
+    data_export.write_rows(columns, [rows], export_format, out)
+    return True
+
+def backup_tables(outputs):
+    """The in-memory store is lost on exit anyway; there is nothing to back up."""
+    raise NotImplementedError("The in-memory storage backend cannot be backed up")
+
+def restore_tables(sources):
+    """Backups come from the SQL backends and are restored into one of them."""
+    raise NotImplementedError("The in-memory storage backend cannot restore backups")
+
+def get_operations_stats():
+    """Get donation operation statistics."""
+    with _lock:
+        return {
+            'total_donors': len(_store['donors'].rows),
+            'total_requests': len(_store['requests'].rows) + len(_store['requests_archive']),
+            'active_requests': sum(1 for row in _store['requests'].rows.values() if row['status'] == 'active'),
+            'total_operations': sum(1 for row in chain(_store['donations'].rows.values(),
+                                                       _store['donations_archive'].values())
+                                    if row['status'] in ('pending', 'completed')),
+            'unreachable_donors': sum(1 for row in _store['donors'].rows.values() if row['is_unreachable'])
+        }
+
+# Telegram chat functions
+def get_telegram_chat(chat_id):
+    """Get the stored username/first name for a Telegram chat."""
+    with _lock:
+        return _copy(_store['telegram_chats'].get(_int(chat_id)))
+
+def save_telegram_chats(chats):
+    """Upsert (chat_id, username, first_name, updated_at) rows."""
+    with _lock:
+        for chat_id, username, first_name, updated_at in chats:
+            previous = _store['telegram_chats'].get(chat_id, {})
+            _store['telegram_chats'][chat_id] = {
+                'chat_id': chat_id,
+                'username': username,
+                'first_name': first_name if first_name is not None else previous.get('first_name'),
+                'updated_at': updated_at
+            }
+        return True
+
+# Persistence functions
+def load_persisted_data(kind):
+    """Get all stored 'user' or 'chat' data as {id: data}."""
+    with _lock:
+        stored = dict(_store[f'persistence_{kind}_data'])
+    return {key: json.loads(data) for key, data in stored.items()}
+
+def load_persisted_conversations():
+    """Get every stored conversation state as {name: {key_json: state_json}}."""
+    conversations = {}
+    with _lock:
+        for (name, key), state in _store['persistence_conversations'].items():
+            conversations.setdefault(name, {})[key] = state
+    return conversations
+
+def save_persistence_batch(user_data, chat_data, conversations, dropped_users=(), dropped_chats=()):
+    """Apply a batch of persistence changes; see storage_postgres.save_persistence_batch."""
+    with _lock:
+        _store['persistence_user_data'].update(user_data)
+        _store['persistence_chat_data'].update(chat_data)
+        for user_id in dropped_users:
+            _store['persistence_user_data'].pop(user_id, None)
+        for chat_id in dropped_chats:
+            _store['persistence_chat_data'].pop(chat_id, None)
+        for name, key, state in conversations:
+            if state is None:
+                _store['persistence_conversations'].pop((name, key), None)
+            else:
+                _store['persistence_conversations'][(name, key)] = state
+        return True
+
+# Support message functions
+def store_support_message(user_info, message):
+    """Store a support message from a user."""
+    with _lock:
+        _store['support_messages'].insert({
+            'user_id': user_info.get('id'),
+            'user_name': f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip(),
+            'message': message,
+            'created_at': datetime.now(),
+            'status': 'pending'
+        })
+        return True
+
+def get_support_messages():
+    """Get all support messages."""
+    with _lock:
+        rows = [_copy(row) for row in _store['support_messages'].rows.values()]
+    return _newest_first(rows, 'created_at')
+
+def mark_support_messages_read():
+    """Mark all pending support messages as read. Returns how many were updated."""
+    with _lock:
+        pending = [row for row in _store['support_messages'].rows.values() if row['status'] == 'pending']
+        for row in pending:
+            row['status'] = 'read'
+        return len(pending)
+
+def record_admin_reply(user_id, message):
+    """Record an admin reply to a user."""
+    with _lock:
+        _store['admin_replies'].insert({
+            'admin_id': os.getenv('ADMIN_ID', '0'),
+            'user_id': user_id,
+            'message': message,
+            'sent_at': datetime.now()
+        })
+        return True
+
+# Broadcast message functions
+def save_broadcast_message(admin_id, message_text, target_type='all'):
+    """Save a broadcast message sent by an admin."""
+    with _lock:
+        return _store['broadcast_messages'].insert({
+            'admin_id': admin_id,
+            'message_text': message_text,
+            'target_type': target_type,
+            'sent_date': datetime.now(),
+            'recipient_count': 0
+        })
+
+def update_broadcast_recipient_count(broadcast_id, count):
+    """Update the recipient count for a broadcast message."""
+    with _lock:
+        row = _store['broadcast_messages'].rows.get(_int(broadcast_id))
+        if row is not None:
+            row['recipient_count'] = count
+        return True
+
+def get_recent_broadcasts(limit=10):
+    """Get recent broadcast messages."""
+    with _lock:
+        rows = [_copy(row) for row in _store['broadcast_messages'].rows.values()]
+    return _newest_first(rows, 'sent_date')[:limit]
+
+def delete_broadcast_message(broadcast_id):
+    """Delete a broadcast message. Returns True if a row was deleted."""
+    with _lock:
+        return _store['broadcast_messages'].rows.pop(_int(broadcast_id), None) is not None
+
+def save_personalized_message(admin_id, user_id, message_text):
+    """Save a personalized message sent by an admin to a specific user."""
+    with _lock:
+        return _store['personalized_messages'].insert({
+            'admin_id': admin_id,
+            'user_id': user_id,
+            'message_text': message_text,
+            'sent_date': datetime.now()
+        })
@@ -0,0 +1,1914 @@
+import io
+import os
+import csv
+import threading
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from datetime import datetime, timedelta
+from itertools import islice
+import logging
+from locations import get_location_codes
+from storage_session import Session, SessionConnection, active_session, after_commit, session_scope
+from periods import month_start, add_months, period_range
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('storage_postgres')
+
+# Database connection
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql:///blood_bot')
+
+# Handle Railway's PostgreSQL URL format
+if DATABASE_URL.startswith('postgres://'):
+    DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+
+# Connections kept open and reused by get_db_connection
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+# Seconds to wait for a free pooled connection before giving up
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '30'))
+
+# Each storage call inside a session runs in a savepoint (see database.py)
+SUPPORTS_SAVEPOINTS = True
+# Row locks let sessions write concurrently
+SINGLE_WRITER = False
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises instead of waiting when empty, so callers queue here
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+
+# Telegram IDs of restricted donors, loaded at startup and kept in sync by
+# update_donor_restriction/delete_donor so checks never need a query
+_restricted_telegram_ids = set()
+
+def print_db_info():
+    """Print database connection info without exposing credentials."""
+    try:
+        # Parse the URL to extract components without exposing credentials
+        from urllib.parse import urlparse
+        
+        parsed_url = urlparse(DATABASE_URL)
+        
+        logger.info(f"Database connection info:")
+        logger.info(f"- Host: {parsed_url.hostname}")
+        logger.info(f"- Port: {parsed_url.port}")
+        logger.info(f"- Database: {parsed_url.path[1:]}")  # Remove leading slash
+        logger.info(f"- SSL Mode: required")
+        logger.info(f"- Connection type: PostgreSQL")
+        
+        # Try to connect and get server version
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT version();")
+        version = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+        
+        logger.info(f"Connected to: {version}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to print database info: {e}")
+        return False
+
+class PooledConnection:
+    """A pooled psycopg2 connection whose close() hands it back to the pool.
+
+    Everything else is passed through to the real connection, so callers keep
+    using the usual get_db_connection() ... conn.close() pattern. A connection
+    that is never closed (an exception skipped conn.close()) is returned when
+    the wrapper is garbage collected.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                # Never hand out a connection with an open or failed transaction
+                conn.rollback()
+            except Exception:
+                broken = True
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            _pool_slots.release()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+def get_pool():
+    """Return the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                logger.info(f"Creating database connection pool ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)...")
+                _pool = ThreadedConnectionPool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DATABASE_URL)
+    return _pool
+
+def _checkout():
+    """Take a connection from the pool, waiting for a free one."""
+    pool = get_pool()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT_SECONDS):
+        raise PoolError(f"No free database connection after {DB_POOL_TIMEOUT_SECONDS:.0f}s")
+    try:
+        return PooledConnection(pool, pool.getconn())
+    except Exception:
+        _pool_slots.release()
+        raise
+
+def _transaction_failed(conn):
+    return conn.info.transaction_status == TRANSACTION_STATUS_INERROR
+
+def get_db_connection():
+    """Get a connection to the PostgreSQL database.
+    
+    Inside a session() this is the session's shared connection, otherwise a
+    connection from the pool.
+    """
+    try:
+        active = active_session()
+        if active is not None:
+            return SessionConnection(active)
+        return _checkout()
+    except Exception as e:
+        logger.error(f"Error connecting to database: {e}")
+        raise
+
+def new_session():
+    """Create a Session (see storage_session) on this backend's pool."""
+    return Session(_checkout, _transaction_failed)
+
+def session():
+    """Context manager sharing one connection and transaction, savepoints when nested."""
+    return session_scope(_checkout, _transaction_failed)
+
+def close_pool():
+    """Close every pooled connection, used at shutdown."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+def ensure_schema():
+    """Check the schema version at startup, migrating only when it is behind."""
+    import migrations
+    return migrations.ensure_schema()
+
+def migrate():
+    """Apply pending migrations (see migrations.py)."""
+    import migrations
+    return migrations.migrate()
+
+def get_schema_version():
+    """Return the applied schema version, None if it cannot be read."""
+    import migrations
+    return migrations.get_schema_version()
+
+def backfill_location_codes(cursor, table):
+    """Set division_code/district_code on rows that only have free-text locations."""
+    cursor.execute(f'''
+    SELECT id, division, district FROM {table}
+    WHERE division_code IS NULL OR district_code IS NULL
+    ''')
+    rows = cursor.fetchall()
+    
+    updates = []
+    for row_id, division, district in rows:
+        division_code, district_code = get_location_codes(division, district)
+        if division_code is not None or district_code is not None:
+            updates.append((row_id, division_code, district_code))
+    
+    if updates:
+        execute_values(cursor, f'''
+        UPDATE {table} AS t
+        SET division_code = v.division_code, district_code = v.district_code
+        FROM (VALUES %s) AS v(id, division_code, district_code)
+        WHERE t.id = v.id
+        ''', updates, template='(%s, %s::smallint, %s::smallint)')
+        logger.info(f"Backfilled location codes for {len(updates)} {table} rows")
+
+# Tables range-partitioned by month (see migration 10), and their partition key
+PARTITION_KEYS = {'requests': 'request_date', 'donations': 'acceptance_date'}
+
+# Monthly partitions kept ready past the current month, so new rows never land in the default partition
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+
+# Requests looked up by id are nearly always recent ones. A partitioned requests table
+# can only find an id by probing every partition, so by-id lookups first try the
+# partitions this many days back and search the rest only when the request is older.
+REQUEST_LOOKUP_RECENT_DAYS = int(os.getenv('REQUEST_LOOKUP_RECENT_DAYS', '45'))
+
+# Whether the requests table is partitioned, None until requests_partitioned first checks
+_requests_partitioned = None
+
+def requests_partitioned(cursor, refresh=False):
+    """Return whether the requests table is partitioned, reading the catalog once per process.
+
+    migrations.py refreshes it after partitioning; another process that
+    partitions the tables takes effect here on the next restart.
+    """
+    global _requests_partitioned
+    if _requests_partitioned is None or refresh:
+        check = cursor.connection.cursor()
+        check.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('requests')")
+        row = check.fetchone()
+        check.close()
+        _requests_partitioned = row is not None and row[0] == 'p'
+    return _requests_partitioned
+
+def partition_name(table, month):
+    """Name of table's partition for the month starting at month, e.g. donations_y2024m03."""
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+def create_month_partitions(cursor, table, first, last):
+    """Create the missing monthly partitions of table from first's month through last's. Returns their names."""
+    created = []
+    month = month_start(first)
+    last = month_start(last)
+    while month <= last:
+        next_month = add_months(month, 1)
+        name = partition_name(table, month)
+        cursor.execute('SELECT to_regclass(%s)', (name,))
+        if cursor.fetchone()[0] is None:
+            cursor.execute(f'''
+            CREATE TABLE {name} PARTITION OF {table}
+            FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')
+            ''')
+            created.append(name)
+        month = next_month
+    return created
+
+def ensure_partitions(months_ahead=None):
+    """Create the partitions for this month and the next months_ahead months. Returns the names created.
+    
+    Each partition is created in its own transaction: a month whose rows
+    already went to the default partition is logged and skipped.
+    """
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    created = []
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('requests')")
+        row = cursor.fetchone()
+        if row is not None and row[0] == 'p':
+            this_month = month_start(datetime.now())
+            for table in PARTITION_KEYS:
+                for offset in range(months_ahead + 1):
+                    month = add_months(this_month, offset)
+                    try:
+                        created.extend(create_month_partitions(cursor, table, month, month))
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        logger.error(f"Error creating partition {partition_name(table, month)}: {e}")
+        
+        cursor.close()
+        conn.close()
+        
+        if created:
+            logger.info(f"Created partitions: {', '.join(created)}")
+        return created
+    except Exception as e:
+        print(f"Error ensuring partitions: {e}")
+        return created
+
+# Donor functions
+def save_donor(donor_data):
+    """Save a new donor to the database."""
+    try:
+        logger.info(f"Saving donor: {donor_data['name']} (Telegram ID: {donor_data['telegram_id']})")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        division_code, district_code = get_location_codes(donor_data['division'], donor_data['district'])
+        
+        cursor.execute('''
+        INSERT INTO donors (
+            telegram_id, name, age, phone, district, division, area, blood_group, gender, registration_date,
+            division_code, district_code
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+        ''', (
+            donor_data['telegram_id'],
+            donor_data['name'],
+            donor_data['age'],
+            donor_data['phone'],
+            donor_data['district'],
+            donor_data['division'],
+            donor_data['area'],
+            donor_data['blood_group'],
+            donor_data['gender'],
+            donor_data['registration_date'],
+            division_code,
+            district_code
+        ))
+        
+        donor_id = cursor.fetchone()[0]
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        logger.info(f"Donor saved successfully with ID: {donor_id}")
+        return donor_id
+    except Exception as e:
+        logger.error(f"Error saving donor: {e}")
+        # If it's a unique constraint violation, log it specifically
+        if "duplicate key value violates unique constraint" in str(e):
+            logger.error(f"Duplicate donor Telegram ID: {donor_data.get('telegram_id')}")
+        return None
+
+def get_donor_by_telegram_id(telegram_id):
+    """Get donor information by Telegram ID."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute('SELECT * FROM donors WHERE telegram_id = %s', (telegram_id,))
+        donor = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        return donor
+    except Exception as e:
+        print(f"Error getting donor: {e}")
+        return None
+
+def get_donor_by_id(donor_id):
+    """Get donor information by ID."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute('SELECT * FROM donors WHERE id = %s', (donor_id,))
+        donor = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        return donor
+    except Exception as e:
+        print(f"Error getting donor: {e}")
+        return None
+
+def update_donor(donor_id, update_data):
+    """Update donor information."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Build the SQL query dynamically based on the fields to update
+        sql_parts = []
+        values = []
+        
+        for key, value in update_data.items():
+            sql_parts.append(f"{key} = %s")
+            values.append(value)
+        
+        # Add the donor_id as the last value
+        values.append(donor_id)
+        
+        sql = f"UPDATE donors SET {', '.join(sql_parts)} WHERE id = %s"
+        
+        cursor.execute(sql, values)
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error updating donor: {e}")
+        return False
+
+def get_all_donors(reachable_only=False):
+    """Get all registered donors, optionally skipping donors marked unreachable."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        if reachable_only:
+            cursor.execute('''
+            SELECT * FROM donors
+            WHERE is_unreachable IS NOT TRUE
+            ORDER BY registration_date DESC
+            ''')
+        else:
+            cursor.execute('SELECT * FROM donors ORDER BY registration_date DESC')
+        donors = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return donors
+    except Exception as e:
+        print(f"Error getting all donors: {e}")
+        return []
+
+def search_donors(search_term):
+    """Search for donors by name, blood group, or location."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Create a search pattern for LIKE queries
+        search_pattern = f"%{search_term}%"
+        
+        cursor.execute('''
+        SELECT * FROM donors 
+        WHERE 
+            lower(name) LIKE lower(%s) OR 
+            lower(blood_group) LIKE lower(%s) OR 
+            lower(district) LIKE lower(%s) OR 
+            lower(division) LIKE lower(%s) OR
+            lower(phone) LIKE lower(%s)
+        ORDER BY registration_date DESC
+        ''', (search_pattern, search_pattern, search_pattern, search_pattern, search_pattern))
+        
+        donors = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return donors
+    except Exception as e:
+        print(f"Error searching donors: {e}")
+        return []
+
+def get_donors_by_blood_groups(blood_groups, reachable_only=False):
+    """Get donors with specific blood groups, optionally skipping donors marked unreachable."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        placeholders = ', '.join(['%s'] * len(blood_groups))
+        query = f'SELECT * FROM donors WHERE blood_group IN ({placeholders})'
+        if reachable_only:
+            query += ' AND is_unreachable IS NOT TRUE'
+        
+        cursor.execute(query, blood_groups)
+        donors = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return donors
+    except Exception as e:
+        print(f"Error getting donors by blood groups: {e}")
+        return []
+
+def get_donor_index_rows():
+    """Get the donor columns needed to build the matching index."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        cursor.execute('''
+        SELECT id, telegram_id, blood_group, division, district, division_code, district_code,
+               is_restricted, is_unreachable, last_donation_at
+        FROM donors
+        ORDER BY id
+        ''')
+        donors = cursor.fetchall()
+
+        cursor.close()
+        conn.close()
+
+        return donors
+    except Exception as e:
+        print(f"Error getting donor index rows: {e}")
+        return []
+
+def delete_donor(donor_id):
+    """Delete a donor from the database."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('DELETE FROM donors WHERE id = %s RETURNING telegram_id', (donor_id,))
+        deleted = cursor.fetchone()
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        if deleted:
+            after_commit(lambda: _restricted_telegram_ids.discard(deleted[0]))
+        
+        return True
+    except Exception as e:
+        print(f"Error deleting donor: {e}")
+        return False
+
+def update_donor_restriction(donor_id, is_restricted):
+    """Update donor restriction status."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        UPDATE donors SET is_restricted = %s WHERE id = %s
+        RETURNING telegram_id
+        ''', (is_restricted, donor_id))
+        updated = cursor.fetchone()
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        if updated:
+            # Only once committed, a rolled back session must leave the set as it was
+            if is_restricted:
+                after_commit(lambda: _restricted_telegram_ids.add(updated[0]))
+            else:
+                after_commit(lambda: _restricted_telegram_ids.discard(updated[0]))
+        
+        return True
+    except Exception as e:
+        print(f"Error updating donor restriction: {e}")
+        return False
+
+def load_restricted_telegram_ids():
+    """Load the Telegram IDs of all restricted donors into memory."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT telegram_id FROM donors WHERE is_restricted')
+        restricted = {row[0] for row in cursor.fetchall()}
+        
+        cursor.close()
+        conn.close()
+        
+        _restricted_telegram_ids.clear()
+        _restricted_telegram_ids.update(restricted)
+        logger.info(f"Loaded {len(restricted)} restricted users")
+        return True
+    except Exception as e:
+        print(f"Error loading restricted users: {e}")
+        return False
+
+def is_telegram_id_restricted(telegram_id):
+    """Check the in-memory restricted set; no database round trip."""
+    return telegram_id in _restricted_telegram_ids
+
+def mark_donor_unreachable(donor_id):
+    """Flag a donor whose Telegram chat permanently rejects messages."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        UPDATE donors
+        SET is_unreachable = TRUE, unreachable_at = %s
+        WHERE id = %s AND is_unreachable IS NOT TRUE
+        ''', (datetime.now(), donor_id))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error marking donor unreachable: {e}")
+        return False
+
+def mark_donor_reachable(telegram_id):
+    """Clear the unreachable flag once a donor talks to the bot again. Returns True if it was set."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        UPDATE donors
+        SET is_unreachable = FALSE, unreachable_at = NULL
+        WHERE telegram_id = %s AND is_unreachable
+        ''', (telegram_id,))
+        
+        updated = cursor.rowcount > 0
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return updated
+    except Exception as e:
+        print(f"Error marking donor reachable: {e}")
+        return False
+
+def get_donor_stats(donor_id):
+    """Get statistics for a specific donor."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Get total donations
+        cursor.execute(f'''
+        SELECT COUNT(*) as total_donations FROM {ALL_DONATIONS} AS don
+        WHERE donor_id = %s
+        ''', (donor_id,))
+        total_donations = cursor.fetchone()['total_donations']
+        
+        # Get fulfilled donations
+        cursor.execute(f'''
+        SELECT COUNT(*) as fulfilled_donations FROM {ALL_DONATIONS} AS don
+        WHERE donor_id = %s AND status = 'completed'
+        ''', (donor_id,))
+        fulfilled_donations = cursor.fetchone()['fulfilled_donations']
+        
+        # Get pending donations
+        cursor.execute(f'''
+        SELECT COUNT(*) as pending_donations FROM {ALL_DONATIONS} AS don
+        WHERE donor_id = %s AND status = 'pending'
+        ''', (donor_id,))
+        pending_donations = cursor.fetchone()['pending_donations']
+        
+        # Get donor rank
+        cursor.execute(f'''
+        WITH donor_ranks AS (
+            SELECT 
+                d.id, 
+                COUNT(don.id) as donation_count,
+                RANK() OVER (ORDER BY COUNT(don.id) DESC) as donor_rank
+            FROM 
+                donors d
+            LEFT JOIN 
+                {ALL_DONATIONS} AS don ON d.id = don.donor_id
+            GROUP BY 
+                d.id
+        )
+        SELECT donor_rank FROM donor_ranks WHERE id = %s
+        ''', (donor_id,))
+        
+        rank_result = cursor.fetchone()
+        donor_rank = rank_result['donor_rank'] if rank_result else None
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            'total_donations': total_donations,
+            'fulfilled_donations': fulfilled_donations,
+            'pending_donations': pending_donations,
+            'donor_rank': donor_rank
+        }
+    except Exception as e:
+        print(f"Error getting donor stats: {e}")
+        return {
+            'total_donations': 0,
+            'fulfilled_donations': 0,
+            'pending_donations': 0,
+            'donor_rank': None
+        }
+
+def get_top_donors(limit=10, period=None):
+    """Get top donors by donation count."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Summed from the monthly rollup instead of counting donations
+        time_condition = ""
+        params = ()
+        date_range = period_range(period)
+        if date_range:
+            time_condition = "WHERE m.month >= %s AND m.month < %s"
+            params = tuple(bound.date() for bound in date_range)
+        
+        cursor.execute(f'''
+        SELECT 
+            d.id, d.name, d.blood_group,
+            SUM(m.donation_count)::int as donation_count
+        FROM 
+            donor_monthly_donations m
+        JOIN 
+            donors d ON d.id = m.donor_id
+        {time_condition}
+        GROUP BY 
+            d.id, d.name, d.blood_group
+        HAVING 
+            SUM(m.donation_count) > 0
+        ORDER BY 
+            donation_count DESC
+        LIMIT %s
+        ''', (*params, limit))
+        
+        top_donors = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return top_donors
+    except Exception as e:
+        print(f"Error getting top donors: {e}")
+        return []
+
+# Import rows encoded per refill of the COPY stream
+DONOR_IMPORT_BATCH_SIZE = 5000
+
+# Columns of the rows import_donors takes, in order
+DONOR_IMPORT_COLUMNS = ('line', 'telegram_id', 'name', 'age', 'phone', 'district', 'division', 'area', 'blood_group',
+                        'gender', 'division_code', 'district_code')
+
+# A stored phone number without the separators people type into it
+NORMALIZED_PHONE_SQL = "REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(phone, ' ', ''), '-', ''), '(', ''), ')', ''), '.', '')"
+
+class _CopySource:
+    """File-like object whose read() encodes row tuples as CSV for COPY ... FROM STDIN, a batch at a time."""
+    
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = io.StringIO()
+    
+    def read(self, size=-1):
+        data = self._buffer.read(size)
+        while not data:
+            batch = list(islice(self._rows, DONOR_IMPORT_BATCH_SIZE))
+            if not batch:
+                return ''
+            self._buffer = io.StringIO()
+            csv.writer(self._buffer, lineterminator='\n').writerows(batch)
+            self._buffer.seek(0)
+            data = self._buffer.read(size)
+        return data
+
+def import_donors(rows):
+    """Upsert validated donor rows (tuples in DONOR_IMPORT_COLUMNS order) in one transaction.
+    
+    Rows are streamed into a temporary table with COPY, then matched to donors
+    by Telegram ID, or by phone number for rows without one, and applied with
+    one UPDATE and one INSERT. Rows without a Telegram ID can only update an
+    existing donor. Returns {'inserted', 'updated', 'errors': [(line, message)]},
+    None on error.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('DROP TABLE IF EXISTS pg_temp.donor_import')
+        cursor.execute('''
+        CREATE TEMP TABLE donor_import (
+            line INTEGER PRIMARY KEY,
+            telegram_id BIGINT,
+            name VARCHAR(100),
+            age VARCHAR(20),
+            phone VARCHAR(20),
+            district VARCHAR(50),
+            division VARCHAR(50),
+            area VARCHAR(100),
+            blood_group VARCHAR(5),
+            gender VARCHAR(20),
+            division_code INTEGER,
+            district_code INTEGER,
+            donor_id INTEGER,
+            error TEXT
+        ) ON COMMIT DROP
+        ''')
+        cursor.copy_expert(f"COPY donor_import ({', '.join(DONOR_IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                           _CopySource(rows))
+        cursor.execute('ANALYZE donor_import')
+        
+        cursor.execute('''
+        UPDATE donor_import SET donor_id = d.id
+        FROM donors d
+        WHERE d.telegram_id = donor_import.telegram_id
+        ''')
+        cursor.execute(f'''
+        WITH phones AS (
+            SELECT {NORMALIZED_PHONE_SQL} AS phone, MIN(id) AS donor_id, COUNT(*) AS donors
+            FROM donors
+            GROUP BY 1
+        )
+        UPDATE donor_import
+        SET donor_id = CASE WHEN phones.donors = 1 THEN phones.donor_id END,
+            error = CASE WHEN phones.donors > 1 THEN 'phone number belongs to ' || phones.donors || ' donors' END
+        FROM phones
+        WHERE donor_import.telegram_id IS NULL AND phones.phone = donor_import.phone
+        ''')
+        cursor.execute('''
+        UPDATE donor_import
+        SET error = 'no donor has this phone number, new donors need a Telegram ID'
+        WHERE telegram_id IS NULL AND donor_id IS NULL AND error IS NULL
+        ''')
+        cursor.execute('''
+        UPDATE donor_import
+        SET donor_id = NULL, error = 'phone number belongs to the donor on line ' || other.line
+        FROM donor_import AS other
+        WHERE donor_import.telegram_id IS NULL AND other.telegram_id IS NOT NULL
+        AND other.donor_id = donor_import.donor_id
+        ''')
+        cursor.execute('SELECT line, error FROM donor_import WHERE error IS NOT NULL ORDER BY line')
+        errors = cursor.fetchall()
+        
+        cursor.execute('''
+        UPDATE donors
+        SET name = s.name, age = COALESCE(s.age, donors.age), phone = COALESCE(s.phone, donors.phone),
+            district = s.district, division = s.division, area = COALESCE(s.area, donors.area),
+            blood_group = s.blood_group, gender = COALESCE(s.gender, donors.gender),
+            division_code = s.division_code, district_code = s.district_code
+        FROM donor_import s
+        WHERE s.donor_id = donors.id AND s.error IS NULL
+        ''')
+        updated = cursor.rowcount
+        cursor.execute('''
+        INSERT INTO donors (
+            telegram_id, name, age, phone, district, division, area, blood_group, gender, registration_date,
+            division_code, district_code
+        )
+        SELECT telegram_id, name, age, phone, district, division, area, blood_group, gender, %s,
+            division_code, district_code
+        FROM donor_import
+        WHERE donor_id IS NULL AND error IS NULL
+        ORDER BY line
+        ''', (datetime.now(),))
+        inserted = cursor.rowcount
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return {'inserted': inserted, 'updated': updated, 'errors': errors}
+    except Exception as e:
+        print(f"Error importing donors: {e}")
+        return None
+
+# Request functions
+def save_request(request_data):
+    """Save a new blood request to the database."""
+    try:
+        logger.info(f"Saving blood request: {request_data['name']} (Blood Group: {request_data['blood_group']})")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        division_code, district_code = get_location_codes(request_data['division'], request_data['district'])
+        
+        # Log the SQL query and parameters for debugging
+        query = '''
+        INSERT INTO requests (
+            telegram_id, name, age, hospital_name, hospital_address, 
+            area, division, district, urgency, phone, blood_group, request_date, status,
+            division_code, district_code
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+        '''
+        
+        params = (
+            request_data['telegram_id'],
+            request_data['name'],
+            request_data['age'],
+            request_data['hospital_name'],
+            request_data['hospital_address'],
+            request_data['area'],
+            request_data['division'],
+            request_data['district'],
+            request_data['urgency'],
+            request_data['phone'],
+            request_data['blood_group'],
+            request_data['request_date'],
+            request_data['status'],
+            division_code,
+            district_code
+        )
+        
+        logger.info(f"Executing query with params: {params}")
+        
+        cursor.execute(query, params)
+        
+        request_id = cursor.fetchone()[0]
+        logger.info(f"Request ID returned: {request_id}")
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        logger.info(f"Blood request saved successfully with ID: {request_id}")
+        return request_id
+    except Exception as e:
+        logger.error(f"Error saving request: {e}")
+        # Print traceback for debugging
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
+
+def _execute_by_request_id(cursor, sql, params):
+    """Run sql, whose WHERE clause ends in 'id = %s{recent}', on recent requests first.
+
+    The request date hint lets PostgreSQL skip older partitions; the query is
+    only run again without it when no recent request matched. An unpartitioned
+    table finds the id through its primary key either way, so it is queried
+    once, without the hint.
+    """
+    if not requests_partitioned(cursor):
+        cursor.execute(sql.format(recent=''), params)
+        return
+
+    since = datetime.now() - timedelta(days=REQUEST_LOOKUP_RECENT_DAYS)
+    cursor.execute(sql.format(recent=' AND request_date >= %s'), (*params, since))
+    if cursor.rowcount == 0:
+        cursor.execute(sql.format(recent=''), params)
+
+def get_request_by_id(request_id):
+    """Get request information by ID."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        _execute_by_request_id(cursor, 'SELECT * FROM requests WHERE id = %s{recent}', (request_id,))
+        request = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        return request
+    except Exception as e:
+        print(f"Error getting request: {e}")
+        return None
+
+def get_active_requests():
+    """Get all active blood requests."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute('''
+        SELECT * FROM requests 
+        WHERE status = 'active' 
+        ORDER BY request_date DESC
+        ''')
+        
+        requests = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return requests
+    except Exception as e:
+        print(f"Error getting active requests: {e}")
+        return []
+
+def get_requests_by_location(division, district=None):
+    """Get active requests by location."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        division_code, district_code = get_location_codes(division, district)
+        
+        if district and district_code is not None:
+            cursor.execute('''
+            SELECT * FROM requests 
+            WHERE status = 'active' 
+            AND district_code = %s
+            ORDER BY request_date DESC
+            ''', (district_code,))
+        elif district:
+            # Unrecognised district name, fall back to comparing the text
+            cursor.execute('''
+            SELECT * FROM requests 
+            WHERE status = 'active' 
+            AND lower(division) = lower(%s) 
+            AND lower(district) = lower(%s)
+            ORDER BY request_date DESC
+            ''', (division, district))
+        elif division_code is not None:
+            cursor.execute('''
+            SELECT * FROM requests 
+            WHERE status = 'active' 
+            AND division_code = %s
+            ORDER BY request_date DESC
+            ''', (division_code,))
+        else:
+            cursor.execute('''
+            SELECT * FROM requests 
+            WHERE status = 'active' 
+            AND lower(division) = lower(%s)
+            ORDER BY request_date DESC
+            ''', (division,))
+        
+        requests = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return requests
+    except Exception as e:
+        print(f"Error getting requests by location: {e}")
+        return []
+
+def update_request_status(request_id, status):
+    """Update the status of a request."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        _execute_by_request_id(cursor, '''
+        UPDATE requests 
+        SET status = %s 
+        WHERE id = %s{recent}
+        ''', (status, request_id))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error updating request status: {e}")
+        return False
+
+def update_request_field(request_id, field, value):
+    """Update a specific field in a request."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        sql = f"UPDATE requests SET {field} = %s WHERE id = %s{{recent}}"
+        _execute_by_request_id(cursor, sql, (value, request_id))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error updating request field: {e}")
+        return False
+
+def update_request_notified_donors(request_id, donor_ids):
+    """Update the list of notified donors for a request."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Convert list of IDs to comma-separated string
+        donor_ids_str = ','.join(str(id) for id in donor_ids)
+        
+        _execute_by_request_id(cursor, '''
+        UPDATE requests 
+        SET notified_donors = %s 
+        WHERE id = %s{recent}
+        ''', (donor_ids_str, request_id))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error updating notified donors: {e}")
+        return False
+
+def delete_request(request_id):
+    """Delete a request from the database."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # First delete related donations
+        cursor.execute('''
+        DELETE FROM donations WHERE request_id = %s
+        RETURNING donor_id, status, acceptance_date
+        ''', (request_id,))
+        completed = [(donor_id, accepted) for donor_id, status, accepted in cursor.fetchall() if status == 'completed']
+        _count_completed_donations(cursor, completed, -1)
+        
+        # Then delete the request
+        cursor.execute('DELETE FROM requests WHERE id = %s', (request_id,))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error deleting request: {e}")
+        return False
+
+# Request lifecycle functions
+ARCHIVED_REQUEST_COLUMNS = ('id, telegram_id, name, age, hospital_name, hospital_address, area, division, district, '
+                            'urgency, phone, blood_group, request_date, status, notified_donors, '
+                            'division_code, district_code')
+ARCHIVED_DONATION_COLUMNS = 'id, request_id, donor_id, status, acceptance_date, completion_date, notes'
+
+# Live and archived donations, so donor history survives archival
+ALL_DONATIONS = '''(
+    SELECT id, donor_id, status, acceptance_date FROM donations
+    UNION ALL
+    SELECT id, donor_id, status, acceptance_date FROM donations_archive
+)'''
+
+def expire_stale_requests(cutoffs, default_cutoff, limit=500):
+    """Mark up to `limit` active requests older than their urgency's cutoff as expired.
+    
+    cutoffs maps a lower-case urgency to the oldest request_date that stays
+    active; other urgencies use default_cutoff. Returns the expired request IDs.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cutoff_sql = '%s'
+        params = []
+        if cutoffs:
+            cutoff_sql = f"CASE lower(trim(urgency)) {' '.join(['WHEN %s THEN %s'] * len(cutoffs))} ELSE %s END"
+            params = [value for cutoff in cutoffs.items() for value in cutoff]
+        
+        cursor.execute(f'''
+        UPDATE requests
+        SET status = 'expired'
+        WHERE id IN (
+            SELECT id FROM requests
+            WHERE status = 'active' AND request_date < {cutoff_sql}
+            ORDER BY request_date
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+        ''', (*params, default_cutoff, limit))
+        
+        expired_ids = [row[0] for row in cursor.fetchall()]
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return expired_ids
+    except Exception as e:
+        print(f"Error expiring stale requests: {e}")
+        return []
+
+def archive_closed_requests(closed_before, limit=500):
+    """Move up to `limit` closed requests dated before closed_before, with their donations, to the archive tables.
+    
+    Returns how many requests were archived, None on error.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # One statement, so a batch is never left half moved
+        archived_at = datetime.now()
+        cursor.execute(f'''
+        WITH batch AS (
+            SELECT id FROM requests
+            WHERE status IN ('fulfilled', 'inactive', 'expired') AND request_date < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), moved_donations AS (
+            DELETE FROM donations
+            WHERE request_id IN (SELECT id FROM batch)
+            RETURNING {ARCHIVED_DONATION_COLUMNS}
+        ), archived_donations AS (
+            INSERT INTO donations_archive ({ARCHIVED_DONATION_COLUMNS}, archived_at)
+            SELECT {ARCHIVED_DONATION_COLUMNS}, %s FROM moved_donations
+        ), moved_requests AS (
+            DELETE FROM requests
+            WHERE id IN (SELECT id FROM batch)
+            RETURNING {ARCHIVED_REQUEST_COLUMNS}
+        )
+        INSERT INTO requests_archive ({ARCHIVED_REQUEST_COLUMNS}, archived_at)
+        SELECT {ARCHIVED_REQUEST_COLUMNS}, %s FROM moved_requests
+        ''', (closed_before, limit, archived_at, archived_at))
+        
+        archived = cursor.rowcount
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return archived
+    except Exception as e:
+        print(f"Error archiving closed requests: {e}")
+        return None
+
+# Donation functions
+def _count_completed_donations(cursor, donations, delta):
+    """Add delta to donor_monthly_donations for each (donor_id, acceptance_date) that entered or left 'completed'."""
+    counts = {}
+    for donor_id, accepted in donations:
+        if accepted is not None:
+            key = (donor_id, month_start(accepted).date())
+            counts[key] = counts.get(key, 0) + delta
+    
+    if counts:
+        execute_values(cursor, '''
+        INSERT INTO donor_monthly_donations (donor_id, month, donation_count)
+        VALUES %s
+        ON CONFLICT (donor_id, month) DO UPDATE
+        SET donation_count = donor_monthly_donations.donation_count + EXCLUDED.donation_count
+        ''', [(donor_id, month, count) for (donor_id, month), count in counts.items()])
+
+def add_donor_to_request(request_id, donor_id):
+    """Add a donor to a request (donor accepts a blood request)."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Check if this donation already exists
+        cursor.execute('''
+        SELECT donor_id, status, acceptance_date FROM donations
+        WHERE request_id = %s AND donor_id = %s
+        ''', (request_id, donor_id))
+        
+        existing = cursor.fetchone()
+        
+        if existing:
+            if existing[1] == 'completed':
+                _count_completed_donations(cursor, [(existing[0], existing[2])], -1)
+            # Update existing donation
+            cursor.execute('''
+            UPDATE donations
+            SET status = 'pending', acceptance_date = %s
+            WHERE request_id = %s AND donor_id = %s
+            ''', (datetime.now(), request_id, donor_id))
+        else:
+            # Create new donation
+            cursor.execute('''
+            INSERT INTO donations (request_id, donor_id, status, acceptance_date)
+            VALUES (%s, %s, 'pending', %s)
+            ''', (request_id, donor_id, datetime.now()))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error adding donor to request: {e}")
+        return False
+
+def complete_request_donations(request_id):
+    """Mark a request's pending donations as completed and record each donor's donation date."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        completed_at = datetime.now()
+        cursor.execute('''
+        UPDATE donations
+        SET status = 'completed', completion_date = %s
+        WHERE request_id = %s AND status = 'pending'
+        RETURNING donor_id, acceptance_date
+        ''', (completed_at, request_id))
+        
+        completed = cursor.fetchall()
+        donor_ids = [row[0] for row in completed]
+        _count_completed_donations(cursor, completed, 1)
+        
+        if donor_ids:
+            cursor.execute('''
+            UPDATE donors
+            SET last_donation_at = %s
+            WHERE id = ANY(%s) AND (last_donation_at IS NULL OR last_donation_at < %s)
+            ''', (completed_at, donor_ids, completed_at))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return donor_ids
+    except Exception as e:
+        print(f"Error completing request donations: {e}")
+        return []
+
+def count_request_acceptances(request_id):
+    """Count donors who accepted a request and have not dropped out."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT COUNT(*) FROM donations
+        WHERE request_id = %s AND status IN ('pending', 'completed')
+        ''', (request_id,))
+        
+        count = cursor.fetchone()[0]
+        
+        cursor.close()
+        conn.close()
+        
+        return count
+    except Exception as e:
+        print(f"Error counting request acceptances: {e}")
+        return 0
+
+def get_recent_donor_notifications(since):
+    """Get (request_id, donor_id, sent_at) rows for notifications sent since a given time."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT request_id, donor_id, sent_at FROM donor_notifications
+        WHERE sent_at >= %s
+        ORDER BY sent_at
+        ''', (since,))
+        
+        notifications = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return notifications
+    except Exception as e:
+        print(f"Error getting recent donor notifications: {e}")
+        return []
+
+def save_donor_notifications(notifications):
+    """Bulk insert (request_id, donor_id, sent_at) notification rows, ignoring duplicates."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        execute_values(cursor, '''
+        INSERT INTO donor_notifications (request_id, donor_id, sent_at)
+        VALUES %s
+        ON CONFLICT (request_id, donor_id) DO NOTHING
+        ''', notifications)
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error saving donor notifications: {e}")
+        return False
+
+def add_donor_to_declined_request(request_id, donor_id):
+    """Record that a donor declined a request."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Check if this donation already exists
+        cursor.execute('''
+        SELECT donor_id, status, acceptance_date FROM donations
+        WHERE request_id = %s AND donor_id = %s
+        ''', (request_id, donor_id))
+        
+        existing = cursor.fetchone()
+        
+        if existing:
+            if existing[1] == 'completed':
+                _count_completed_donations(cursor, [(existing[0], existing[2])], -1)
+            # Update existing donation
+            cursor.execute('''
+            UPDATE donations
+            SET status = 'declined', acceptance_date = %s
+            WHERE request_id = %s AND donor_id = %s
+            ''', (datetime.now(), request_id, donor_id))
+        else:
+            # Create new donation record with declined status
+            cursor.execute('''
+            INSERT INTO donations (request_id, donor_id, status, acceptance_date)
+            VALUES (%s, %s, 'declined', %s)
+            ''', (request_id, donor_id, datetime.now()))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error recording declined request: {e}")
+        return False
+
+# Columns of the nested 'request' and 'donor' records in get_recent_operations
+OPERATION_REQUEST_COLUMNS = ('id', 'name', 'blood_group', 'hospital_name', 'division', 'district', 'urgency', 'status')
+OPERATION_DONOR_COLUMNS = ('id', 'name', 'blood_group', 'division', 'district')
+
+def get_recent_operations(limit=10, offset=0):
+    """Get recent successful donation operations, newest first, skipping the first `offset`."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        request_columns = ', '.join(f'r.{column}' for column in OPERATION_REQUEST_COLUMNS)
+        donor_columns = ', '.join(f'dnr.{column}' for column in OPERATION_DONOR_COLUMNS)
+        cursor.execute(f'''
+        SELECT 
+            d.id, d.acceptance_date, {request_columns}, {donor_columns}
+        FROM 
+            donations d
+        JOIN 
+            requests r ON d.request_id = r.id
+        JOIN 
+            donors dnr ON d.donor_id = dnr.id
+        WHERE 
+            d.status IN ('pending', 'completed')
+        ORDER BY 
+            d.acceptance_date DESC
+        LIMIT %s OFFSET %s
+        ''', (limit, offset))
+        
+        # Plain tuples in a known column order, sliced straight into the nested records
+        donor_start = 2 + len(OPERATION_REQUEST_COLUMNS)
+        operations = [
+            {
+                'id': row[0],
+                'operation_date': row[1],
+                'request': dict(zip(OPERATION_REQUEST_COLUMNS, row[2:donor_start])),
+                'donor': dict(zip(OPERATION_DONOR_COLUMNS, row[donor_start:]))
+            }
+            for row in cursor.fetchall()
+        ]
+        
+        cursor.close()
+        conn.close()
+        
+        return operations
+    except Exception as e:
+        print(f"Error getting recent operations: {e}")
+        return []
+
+def export_table(table, export_format, out):
+    """Stream every row of table, by id, to out.write() as CSV with a header row or as JSON lines.
+    
+    COPY ... TO STDOUT hands rows over as the server sends them, so the table
+    is never held in memory. table must be one of data_export.EXPORT_TABLES.
+    Returns True on success.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        if export_format == 'csv':
+            cursor.copy_expert(f'COPY (SELECT * FROM {table} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)', out)
+        else:
+            # CSV mode with quote and delimiter bytes JSON never contains copies each object unescaped
+            cursor.copy_expert(f'''
+            COPY (SELECT row_to_json(t) FROM (SELECT * FROM {table} ORDER BY id) AS t)
+            TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')
+            ''', out)
+        
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error exporting {table}: {e}")
+        return False
+
+def backup_tables(outputs):
+    """Write each (table, out) pair's rows to out.write() as CSV with a header row, all from one snapshot.
+    
+    Runs on a pooled connection of its own, outside any session, in a
+    REPEATABLE READ, READ ONLY transaction: every table is copied as of the
+    same moment, and COPY takes no locks that block the bot's writes.
+    Returns True on success.
+    """
+    try:
+        conn = _checkout()
+        cursor = conn.cursor()
+        
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        for table, out in outputs:
+            # COPY of a partitioned table needs a query
+            cursor.copy_expert(f'COPY (SELECT * FROM {table}) TO STDOUT WITH (FORMAT csv, HEADER)', out)
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error backing up tables: {e}")
+        return False
+
+def restore_tables(sources):
+    """Load each (table, source) pair, source being CSV with a header row, in one transaction.
+    
+    Every table must be empty. Serial sequences are moved past the restored
+    IDs. Returns {table: rows restored}, None on error.
+    """
+    try:
+        conn = _checkout()
+        cursor = conn.cursor()
+        
+        restored = {}
+        for table, source in sources:
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table})')
+            if cursor.fetchone()[0]:
+                raise ValueError(f"{table} is not empty; restore only into an empty database")
+            
+            columns = next(csv.reader([source.readline()]))
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", source)
+            if 'id' in columns:
+                cursor.execute(f'''
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'), MAX(id)) FROM {table}
+                HAVING MAX(id) IS NOT NULL
+                ''')
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            restored[table] = cursor.fetchone()[0]
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return restored
+    except Exception as e:
+        print(f"Error restoring tables: {e}")
+        return None
+
+def get_operations_stats():
+    """Get donation operation statistics."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Get total donors
+        cursor.execute('SELECT COUNT(*) as total_donors FROM donors')
+        total_donors = cursor.fetchone()['total_donors']
+        
+        # Get total requests
+        cursor.execute('''
+        SELECT (SELECT COUNT(*) FROM requests) + (SELECT COUNT(*) FROM requests_archive) as total_requests
+        ''')
+        total_requests = cursor.fetchone()['total_requests']
+        
+        # Get active requests
+        cursor.execute('SELECT COUNT(*) as active_requests FROM requests WHERE status = %s', ('active',))
+        active_requests = cursor.fetchone()['active_requests']
+        
+        # Get total operations (successful donations)
+        cursor.execute(f'''
+        SELECT COUNT(*) as total_operations 
+        FROM {ALL_DONATIONS} AS don
+        WHERE status IN ('pending', 'completed')
+        ''')
+        total_operations = cursor.fetchone()['total_operations']
+        
+        # Get donors that can no longer be messaged
+        cursor.execute('SELECT COUNT(*) as unreachable_donors FROM donors WHERE is_unreachable')
+        unreachable_donors = cursor.fetchone()['unreachable_donors']
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            'total_donors': total_donors,
+            'total_requests': total_requests,
+            'active_requests': active_requests,
+            'total_operations': total_operations,
+            'unreachable_donors': unreachable_donors
+        }
+    except Exception as e:
+        print(f"Error getting operations stats: {e}")
+        return {
+            'total_donors': 0,
+            'total_requests': 0,
+            'active_requests': 0,
+            'total_operations': 0,
+            'unreachable_donors': 0
+        }
+
+# Telegram chat functions
+def get_telegram_chat(chat_id):
+    """Get the stored username/first name for a Telegram chat."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute('SELECT * FROM telegram_chats WHERE chat_id = %s', (chat_id,))
+        chat = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        return chat
+    except Exception as e:
+        print(f"Error getting Telegram chat: {e}")
+        return None
+
+def save_telegram_chats(chats):
+    """Bulk upsert (chat_id, username, first_name, updated_at) rows."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        execute_values(cursor, '''
+        INSERT INTO telegram_chats (chat_id, username, first_name, updated_at)
+        VALUES %s
+        ON CONFLICT (chat_id) DO UPDATE
+        SET username = EXCLUDED.username,
+            first_name = COALESCE(EXCLUDED.first_name, telegram_chats.first_name),
+            updated_at = EXCLUDED.updated_at
+        ''', chats)
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error saving Telegram chats: {e}")
+        return False
+
+# Persistence functions
+def load_persisted_data(kind):
+    """Get all stored 'user' or 'chat' data as {id: data}."""
+    table, id_column = {'user': ('persistence_user_data', 'user_id'),
+                        'chat': ('persistence_chat_data', 'chat_id')}[kind]
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'SELECT {id_column}, data FROM {table}')
+        data = {row[0]: row[1] for row in cursor.fetchall()}
+        
+        cursor.close()
+        conn.close()
+        
+        return data
+    except Exception as e:
+        print(f"Error loading persisted {kind} data: {e}")
+        return {}
+
+def load_persisted_conversations():
+    """Get every stored conversation state as {name: {key_json: state_json}}."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT name, conversation_key, state FROM persistence_conversations')
+        conversations = {}
+        for name, key, state in cursor.fetchall():
+            conversations.setdefault(name, {})[key] = state
+        
+        cursor.close()
+        conn.close()
+        
+        return conversations
+    except Exception as e:
+        print(f"Error loading persisted conversations: {e}")
+        return {}
+
+def save_persistence_batch(user_data, chat_data, conversations, dropped_users=(), dropped_chats=()):
+    """Write a batch of persistence changes in one transaction.
+    
+    user_data/chat_data are (id, data_json) rows, conversations are
+    (name, key_json, state_json) rows where a None state deletes the row.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        now = datetime.now()
+        
+        if user_data:
+            execute_values(cursor, '''
+            INSERT INTO persistence_user_data (user_id, data, updated_at) VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            ''', [(user_id, data, now) for user_id, data in user_data])
+        if chat_data:
+            execute_values(cursor, '''
+            INSERT INTO persistence_chat_data (chat_id, data, updated_at) VALUES %s
+            ON CONFLICT (chat_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            ''', [(chat_id, data, now) for chat_id, data in chat_data])
+        if dropped_users:
+            cursor.execute('DELETE FROM persistence_user_data WHERE user_id = ANY(%s)', (list(dropped_users),))
+        if dropped_chats:
+            cursor.execute('DELETE FROM persistence_chat_data WHERE chat_id = ANY(%s)', (list(dropped_chats),))
+        
+        ended = [(name, key) for name, key, state in conversations if state is None]
+        active = [(name, key, state, now) for name, key, state in conversations if state is not None]
+        if active:
+            execute_values(cursor, '''
+            INSERT INTO persistence_conversations (name, conversation_key, state, updated_at) VALUES %s
+            ON CONFLICT (name, conversation_key) DO UPDATE
+            SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
+            ''', active)
+        if ended:
+            execute_values(cursor, '''
+            DELETE FROM persistence_conversations AS c
+            USING (VALUES %s) AS v(name, conversation_key)
+            WHERE c.name = v.name AND c.conversation_key = v.conversation_key
+            ''', ended)
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error saving persistence batch: {e}")
+        return False
+
+# Support message functions
+def store_support_message(user_info, message):
+    """Store a support message from a user."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        user_id = user_info.get('id')
+        user_name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip()
+        
+        cursor.execute('''
+        INSERT INTO support_messages (user_id, user_name, message, created_at, status)
+        VALUES (%s, %s, %s, %s, %s)
+        ''', (user_id, user_name, message, datetime.now(), 'pending'))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error storing support message: {e}")
+        return False
+
+def get_support_messages():
+    """Get all support messages."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute('''
+        SELECT * FROM support_messages
+        ORDER BY created_at DESC
+        ''')
+        
+        messages = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return messages
+    except Exception as e:
+        print(f"Error getting support messages: {e}")
+        return []
+
+def mark_support_messages_read():
+    """Mark all pending support messages as read. Returns how many were updated."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        UPDATE support_messages
+        SET status = %s
+        WHERE status = %s
+        ''', ('read', 'pending'))
+        
+        rows_affected = cursor.rowcount
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return rows_affected
+    except Exception as e:
+        print(f"Error marking support messages as read: {e}")
+        return None
+
+def record_admin_reply(user_id, message):
+    """Record an admin reply to a user."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        admin_id = os.getenv('ADMIN_ID', '0')
+        
+        cursor.execute('''
+        INSERT INTO admin_replies (admin_id, user_id, message, sent_at)
+        VALUES (%s, %s, %s, %s)
+        ''', (admin_id, user_id, message, datetime.now()))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error recording admin reply: {e}")
+        return False
+
+# Broadcast message functions
+def save_broadcast_message(admin_id, message_text, target_type='all'):
+    """Save a broadcast message sent by an admin."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT INTO broadcast_messages (admin_id, message_text, target_type, sent_date)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+        ''', (admin_id, message_text, target_type, datetime.now()))
+        
+        broadcast_id = cursor.fetchone()[0]
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return broadcast_id
+    except Exception as e:
+        print(f"Error saving broadcast message: {e}")
+        return None
+
+def update_broadcast_recipient_count(broadcast_id, count):
+    """Update the recipient count for a broadcast message."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        UPDATE broadcast_messages
+        SET recipient_count = %s
+        WHERE id = %s
+        ''', (count, broadcast_id))
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return True
+    except Exception as e:
+        print(f"Error updating broadcast recipient count: {e}")
+        return False
+
+def get_recent_broadcasts(limit=10):
+    """Get recent broadcast messages."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        cursor.execute('''
+        SELECT * FROM broadcast_messages
+        ORDER BY sent_date DESC
+        LIMIT %s
+        ''', (limit,))
+        
+        broadcasts = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return broadcasts
+    except Exception as e:
+        print(f"Error getting recent broadcasts: {e}")
+        return []
+
+def delete_broadcast_message(broadcast_id):
+    """Delete a broadcast message. Returns True if a row was deleted."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('DELETE FROM broadcast_messages WHERE id = %s', (broadcast_id,))
+        affected_rows = cursor.rowcount
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return affected_rows > 0
+    except Exception as e:
+        print(f"Error deleting broadcast message: {e}")
+        return False
+
+def save_personalized_message(admin_id, user_id, message_text):
+    """Save a personalized message sent by an admin to a specific user."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT INTO personalized_messages (admin_id, user_id, message_text, sent_date)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+        ''', (admin_id, user_id, message_text, datetime.now()))
+        
+        message_id = cursor.fetchone()[0]
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        return message_id
+    except Exception as e:
+        print(f"Error saving personalized message: {e}")
+        return None
@@ -0,0 +1,298 @@
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger('storage_session')
+
+# The Session whose connection get_db_connection hands out, if any (see session())
+current_session = contextvars.ContextVar('db_session', default=None)
+
+
+def after_commit(callback):
+    """Run callback once the active session's work is committed, or now outside a session.
+
+    For in-memory state mirroring the database, which must not change for
+    writes that are then rolled back.
+    """
+    active = active_session()
+    if active is None:
+        callback()
+    else:
+        active.on_commit(callback)
+
+
+def active_session():
+    """Return the current Session, or None outside a session or after it ended."""
+    active = current_session.get()
+    if active is None or active.closed:
+        return None
+    return active
+
+
+class Session:
+    """One connection and one transaction shared by all database work in a unit of work.
+
+    The connection is only taken (with checkout) when the first query runs, so
+    a unit of work that never touches the database costs nothing. Work is
+    committed by close(), or earlier by commit(), unless something failed, in
+    which case it is rolled back. Callbacks registered with on_commit() run
+    after their work commits and are dropped if it is rolled back.
+    transaction_failed(conn) lets a backend report a transaction the server
+    has already aborted.
+    """
+
+    def __init__(self, checkout, transaction_failed=None):
+        self._checkout = checkout
+        self._transaction_failed = transaction_failed or (lambda conn: False)
+        self.conn = None
+        self.failed = False
+        self.closed = False
+        self.savepoints = []
+        self.commits = 0
+        self.commit_callbacks = []
+        self._lock = threading.Lock()
+        # Calls gathered concurrently in one unit of work share the connection, one at a time
+        self.call_lock = threading.RLock()
+
+    def connection(self):
+        with self._lock:
+            if self.conn is None:
+                self.conn = self._checkout()
+            return self.conn
+
+    def on_commit(self, callback):
+        with self._lock:
+            self.commit_callbacks.append(callback)
+
+    def transaction_failed(self):
+        return self.conn is not None and self._transaction_failed(self.conn)
+
+    def commit(self):
+        """Commit the work so far (or roll it back after a failure) and return the connection.
+
+        The session carries on; its next query takes a connection again.
+        """
+        with self.call_lock:
+            with self._lock:
+                conn, self.conn = self.conn, None
+            self._end(conn)
+
+    def close(self):
+        """Commit (or roll back after a failure) and return the connection to the pool."""
+        with self._lock:
+            self.closed = True
+            conn, self.conn = self.conn, None
+        self._end(conn)
+
+    def _end(self, conn):
+        # Without a connection nothing was written since the last commit
+        committed = True
+        if conn is not None:
+            try:
+                if self.failed or self._transaction_failed(conn):
+                    conn.rollback()
+                    committed = False
+                    logger.warning("Rolled back database session after a failure")
+                else:
+                    conn.commit()
+            except Exception as e:
+                committed = False
+                logger.error(f"Error ending database session: {e}")
+            finally:
+                conn.close()
+
+        with self._lock:
+            callbacks, self.commit_callbacks = self.commit_callbacks, []
+        if committed:
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in on-commit callback: {e}")
+
+
+# Statements whose failure means the unit of work lost part of its writes
+WRITE_STATEMENTS = frozenset({'INSERT', 'UPDATE', 'DELETE', 'REPLACE'})
+
+
+def _is_write(sql):
+    # psycopg2's execute_values passes the statement as bytes
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors='replace')
+    words = sql.split(None, 1)
+    return bool(words) and words[0].upper() in WRITE_STATEMENTS
+
+
+class SessionCursor:
+    """A cursor that marks its session as failed when a write statement fails.
+
+    Storage functions log their errors and return a default, which would
+    otherwise commit the rest of the unit of work without the failed write.
+    """
+
+    def __init__(self, session, cursor):
+        object.__setattr__(self, '_session', session)
+        object.__setattr__(self, '_cursor', cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # e.g. row_factory, which sqlite3 reads from the cursor itself
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, *args, **kwargs):
+        try:
+            return self._cursor.execute(sql, *args, **kwargs)
+        except Exception:
+            if _is_write(sql):
+                self._session.failed = True
+            raise
+
+    def executemany(self, sql, *args, **kwargs):
+        try:
+            return self._cursor.executemany(sql, *args, **kwargs)
+        except Exception:
+            if _is_write(sql):
+                self._session.failed = True
+            raise
+
+
+class SessionConnection:
+    """What get_db_connection returns inside a session.
+
+    commit() and close() are deferred to the end of the session; commit() is
+    counted so call_in_savepoint knows the call meant to keep its writes.
+    rollback() undoes the innermost savepoint, or marks the whole session as
+    failed, as does a failed write statement.
+    """
+
+    def __init__(self, session):
+        self._session = session
+        self._conn = session.connection()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return SessionCursor(self._session, self._conn.cursor(*args, **kwargs))
+
+    # sqlite3's shortcuts, which would otherwise bypass SessionCursor
+    def execute(self, sql, *args, **kwargs):
+        cursor = self.cursor()
+        cursor.execute(sql, *args, **kwargs)
+        return cursor
+
+    def executemany(self, sql, *args, **kwargs):
+        cursor = self.cursor()
+        cursor.executemany(sql, *args, **kwargs)
+        return cursor
+
+    def commit(self):
+        self._session.commits += 1
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        if self._session.savepoints:
+            cursor = self._conn.cursor()
+            cursor.execute(f'ROLLBACK TO SAVEPOINT {self._session.savepoints[-1]}')
+            cursor.close()
+        else:
+            self._session.failed = True
+            self._conn.rollback()
+
+
+def _begin(conn, cursor):
+    # sqlite3 only opens a transaction before a write, and a SAVEPOINT outside
+    # one would start a transaction of its own that RELEASE commits. IMMEDIATE
+    # takes the write lock up front: under WAL a deferred transaction that has
+    # read cannot upgrade to a writer once another session has committed, and
+    # fails at once with "database is locked" whatever the busy timeout.
+    if getattr(conn, 'in_transaction', True) is False:
+        cursor.execute('BEGIN IMMEDIATE')
+
+
+def call_in_savepoint(active, func, *args, **kwargs):
+    """Run one storage call in a savepoint of the active session.
+
+    Storage functions catch their own errors and return a default, so the
+    caller never sees a failure. The call's writes are kept only if it
+    committed them and the server did not abort the transaction; otherwise
+    the savepoint is rolled back, as returning the connection to the pool
+    would have done outside a session. On PostgreSQL this also clears the
+    aborted state a failed statement leaves behind, so the rest of the unit of
+    work carries on.
+    """
+    with active.call_lock:
+        conn = active.connection()
+        name = f"sp_{len(active.savepoints) + 1}"
+        cursor = conn.cursor()
+        _begin(conn, cursor)
+        cursor.execute(f'SAVEPOINT {name}')
+        active.savepoints.append(name)
+        commits = active.commits
+        callbacks = len(active.commit_callbacks)
+        kept = False
+        try:
+            result = func(*args, **kwargs)
+            kept = active.commits > commits and not active.transaction_failed()
+            return result
+        finally:
+            active.savepoints.pop()
+            if not kept:
+                del active.commit_callbacks[callbacks:]
+                cursor.execute(f'ROLLBACK TO SAVEPOINT {name}')
+            cursor.execute(f'RELEASE SAVEPOINT {name}')
+            cursor.close()
+
+
+@contextmanager
+def session_scope(checkout, transaction_failed=None):
+    """Run the enclosed database calls on one connection in one transaction.
+
+    Nested blocks become savepoints: a failure inside one rolls back only that
+    block, while the outer transaction carries on.
+    """
+    active = active_session()
+    if active is None:
+        new_session = Session(checkout, transaction_failed)
+        token = current_session.set(new_session)
+        try:
+            yield new_session
+        except BaseException:
+            new_session.failed = True
+            raise
+        finally:
+            current_session.reset(token)
+            new_session.close()
+        return
+
+    conn = active.connection()
+    name = f"sp_{len(active.savepoints) + 1}"
+    cursor = conn.cursor()
+    _begin(conn, cursor)
+    cursor.execute(f'SAVEPOINT {name}')
+    active.savepoints.append(name)
+    callbacks = len(active.commit_callbacks)
+    try:
+        yield active
+    except BaseException:
+        del active.commit_callbacks[callbacks:]
+        cursor.execute(f'ROLLBACK TO SAVEPOINT {name}')
+        raise
+    else:
+        if active.transaction_failed():
+            # A call inside the block failed and swallowed its error
+            del active.commit_callbacks[callbacks:]
+            cursor.execute(f'ROLLBACK TO SAVEPOINT {name}')
+        else:
+            cursor.execute(f'RELEASE SAVEPOINT {name}')
+    finally:
+        active.savepoints.pop()
+        cursor.close()
@@ -0,0 +1,1452 @@
+import os
+import csv
+import json
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from itertools import islice
+from locations import get_location_codes
+from storage_session import Session, SessionConnection, active_session, after_commit, session_scope
+from periods import period_range
+
+logger = logging.getLogger('storage_sqlite')
+
+# sqlite:///relative/path.db or sqlite:////absolute/path.db
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///blood_bot.sqlite3')
+
+# Connections kept open and reused by get_db_connection. SQLite allows one
+# writer at a time, so a few connections are enough to overlap reads.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '4'))
+# Seconds to wait for a free pooled connection before giving up
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '30'))
+
+# Milliseconds a writer waits for the database lock before failing
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Applied to every new connection. WAL lets readers run alongside the single
+# writer, and synchronous=NORMAL is durable in WAL mode apart from the last
+# transactions before a power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'cache_size': -20000,       # KiB, about 20 MB per connection
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456      # 256 MB
+}
+
+SCHEMA_VERSION = 4
+
+# Each storage call inside a session runs in a savepoint (see database.py)
+SUPPORTS_SAVEPOINTS = True
+# A session takes the write lock when it begins (see storage_session._begin),
+# so async_db lets one session at a time run
+SINGLE_WRITER = True
+
+# Telegram IDs of restricted donors, see is_telegram_id_restricted
+_restricted_telegram_ids = set()
+
+_idle_connections = queue.LifoQueue()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+
+# Store datetimes as ISO text and read TIMESTAMP/BOOLEAN columns back as Python types
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('BOOLEAN', lambda value: value not in (b'0', b''))
+
+def database_path(url=None):
+    """Return the file path from a sqlite:/// URL."""
+    url = url or DATABASE_URL
+    path = url.split('://', 1)[1]
+    # sqlite:///relative.db has one leading slash left, sqlite:////abs.db has two
+    return path[1:] if path.startswith('/') else path
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _connect():
+    conn = sqlite3.connect(
+        database_path(),
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False
+    )
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+class PooledConnection:
+    """A pooled sqlite3 connection whose close() hands it back to the pool."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            _idle_connections.put(conn)
+        except Exception:
+            conn.close()
+        finally:
+            _pool_slots.release()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+def _checkout():
+    """Take a connection from the pool, opening one if none is idle."""
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT_SECONDS):
+        raise sqlite3.OperationalError(f"No free database connection after {DB_POOL_TIMEOUT_SECONDS:.0f}s")
+    try:
+        try:
+            conn = _idle_connections.get_nowait()
+        except queue.Empty:
+            conn = _connect()
+        return PooledConnection(conn)
+    except Exception:
+        _pool_slots.release()
+        raise
+
+def get_db_connection():
+    """Get a connection to the SQLite database.
+
+    Inside a session() this is the session's shared connection, otherwise a
+    connection from the pool.
+    """
+    try:
+        active = active_session()
+        if active is not None:
+            return SessionConnection(active)
+        return _checkout()
+    except Exception as e:
+        logger.error(f"Error connecting to database: {e}")
+        raise
+
+def new_session():
+    """Create a Session (see storage_session) on this backend's pool."""
+    return Session(_checkout)
+
+def session():
+    """Context manager sharing one connection and transaction, savepoints when nested."""
+    return session_scope(_checkout)
+
+def close_pool():
+    """Close every idle pooled connection, used at shutdown."""
+    while True:
+        try:
+            _idle_connections.get_nowait().close()
+        except queue.Empty:
+            return
+
+def print_db_info():
+    """Log which database file is used and how it is configured."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+        logger.info("Database connection info:")
+        logger.info(f"- File: {os.path.abspath(database_path())}")
+        logger.info(f"- Journal mode: {journal_mode}")
+        logger.info(f"- Connection type: SQLite {sqlite3.sqlite_version}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to print database info: {e}")
+        return False
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS donors (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    age TEXT,
+    phone TEXT,
+    district TEXT,
+    division TEXT,
+    area TEXT,
+    blood_group TEXT,
+    gender TEXT,
+    registration_date TIMESTAMP,
+    is_restricted BOOLEAN DEFAULT 0,
+    division_code INTEGER,
+    district_code INTEGER,
+    last_donation_at TIMESTAMP,
+    is_unreachable BOOLEAN DEFAULT 0,
+    unreachable_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_donors_location_codes ON donors (division_code, district_code);
+
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    age TEXT,
+    hospital_name TEXT,
+    hospital_address TEXT,
+    area TEXT,
+    division TEXT,
+    district TEXT,
+    urgency TEXT,
+    phone TEXT,
+    blood_group TEXT,
+    request_date TIMESTAMP,
+    status TEXT DEFAULT 'active',
+    notified_donors TEXT,
+    division_code INTEGER,
+    district_code INTEGER
+);
+-- Hot reads only ever look at active requests, newest first
+DROP INDEX IF EXISTS idx_requests_location_codes;
+CREATE INDEX IF NOT EXISTS idx_requests_active_date ON requests (request_date DESC) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_requests_active_division
+    ON requests (division_code, request_date DESC) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_requests_active_district
+    ON requests (district_code, request_date DESC) WHERE status = 'active';
+
+CREATE TABLE IF NOT EXISTS donations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id INTEGER REFERENCES requests(id),
+    donor_id INTEGER REFERENCES donors(id),
+    status TEXT DEFAULT 'pending',
+    acceptance_date TIMESTAMP,
+    completion_date TIMESTAMP,
+    notes TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_donations_request ON donations (request_id, donor_id);
+DROP INDEX IF EXISTS idx_donations_donor;
+CREATE INDEX IF NOT EXISTS idx_donations_donor_status ON donations (donor_id, status);
+-- Operations are donations that were accepted, whether or not completed yet
+CREATE INDEX IF NOT EXISTS idx_donations_operations
+    ON donations (acceptance_date DESC) WHERE status IN ('pending', 'completed');
+
+CREATE TABLE IF NOT EXISTS support_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    user_name TEXT,
+    message TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'pending'
+);
+
+CREATE TABLE IF NOT EXISTS admin_replies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    message TEXT,
+    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_id INTEGER NOT NULL,
+    message_text TEXT,
+    target_type TEXT,
+    sent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    recipient_count INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS personalized_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    message_text TEXT,
+    sent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS donor_notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id INTEGER NOT NULL,
+    donor_id INTEGER NOT NULL,
+    sent_at TIMESTAMP NOT NULL,
+    UNIQUE (request_id, donor_id)
+);
+CREATE INDEX IF NOT EXISTS idx_donor_notifications_sent_at ON donor_notifications (sent_at);
+
+CREATE TABLE IF NOT EXISTS telegram_chats (
+    chat_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    updated_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS persistence_user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS persistence_chat_data (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS persistence_conversations (
+    name TEXT NOT NULL,
+    conversation_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (name, conversation_key)
+);
+
+CREATE TABLE IF NOT EXISTS requests_archive (
+    id INTEGER PRIMARY KEY,
+    telegram_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    age TEXT,
+    hospital_name TEXT,
+    hospital_address TEXT,
+    area TEXT,
+    division TEXT,
+    district TEXT,
+    urgency TEXT,
+    phone TEXT,
+    blood_group TEXT,
+    request_date TIMESTAMP,
+    status TEXT,
+    notified_donors TEXT,
+    division_code INTEGER,
+    district_code INTEGER,
+    archived_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS donations_archive (
+    id INTEGER PRIMARY KEY,
+    request_id INTEGER NOT NULL,
+    donor_id INTEGER,
+    status TEXT,
+    acceptance_date TIMESTAMP,
+    completion_date TIMESTAMP,
+    notes TEXT,
+    archived_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_donations_archive_donor ON donations_archive (donor_id);
+
+-- Completed donations per donor per month, archived ones included; see _count_completed_donations
+CREATE TABLE IF NOT EXISTS donor_monthly_donations (
+    donor_id INTEGER NOT NULL REFERENCES donors(id) ON DELETE CASCADE,
+    month TEXT NOT NULL,
+    donation_count INTEGER NOT NULL,
+    PRIMARY KEY (donor_id, month)
+);
+CREATE INDEX IF NOT EXISTS idx_donor_monthly_donations_month
+    ON donor_monthly_donations (month, donor_id, donation_count);
+'''
+
+def get_schema_version():
+    """Return the schema version stored in PRAGMA user_version, None if it cannot be read."""
+    try:
+        conn = get_db_connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        return version
+    except Exception as e:
+        logger.error(f"Error reading schema version: {e}")
+        return None
+
+def migrate():
+    """Create the schema in the database file if it is not there yet."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        # The bot.py of old SQLite deployments used a different donors table
+        cursor.execute('PRAGMA table_info(donors)')
+        columns = {row[1] for row in cursor.fetchall()}
+        if columns and 'division_code' not in columns:
+            logger.error(f"{database_path()} has a donors table from an older, incompatible schema; "
+                         f"point DATABASE_URL at a new file")
+            cursor.close()
+            conn.close()
+            return False
+
+        logger.info("Creating SQLite schema if not exists...")
+        cursor.executescript(SCHEMA)
+        # Recount from the donations, which is exact however far behind the schema was
+        cursor.execute(f'''
+        INSERT OR REPLACE INTO donor_monthly_donations (donor_id, month, donation_count)
+        SELECT don.donor_id, strftime('%Y-%m-01', don.acceptance_date), COUNT(*)
+        FROM {ALL_DONATIONS} AS don
+        JOIN donors d ON d.id = don.donor_id
+        WHERE don.status = 'completed' AND don.acceptance_date IS NOT NULL
+        GROUP BY don.donor_id, strftime('%Y-%m-01', don.acceptance_date)
+        ''')
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return True
+    except Exception as e:
+        logger.error(f"Error creating SQLite schema: {e}")
+        return False
+
+def ensure_schema():
+    """Startup check: one PRAGMA when the schema is current, create it otherwise."""
+    version = get_schema_version()
+    if version is None:
+        return False
+    if version >= SCHEMA_VERSION:
+        logger.info(f"Schema is up to date (version {version})")
+        return True
+    return migrate()
+
+def ensure_partitions(months_ahead=None):
+    """SQLite has no table partitioning; nothing to create."""
+    return []
+
+def _placeholders(values):
+    return ', '.join(['?'] * len(values))
+
+# Donor functions
+def save_donor(donor_data):
+    """Save a new donor to the database."""
+    try:
+        logger.info(f"Saving donor: {donor_data['name']} (Telegram ID: {donor_data['telegram_id']})")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        division_code, district_code = get_location_codes(donor_data['division'], donor_data['district'])
+
+        cursor.execute('''
+        INSERT INTO donors (
+            telegram_id, name, age, phone, district, division, area, blood_group, gender, registration_date,
+            division_code, district_code
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            donor_data['telegram_id'],
+            donor_data['name'],
+            donor_data['age'],
+            donor_data['phone'],
+            donor_data['district'],
+            donor_data['division'],
+            donor_data['area'],
+            donor_data['blood_group'],
+            donor_data['gender'],
+            donor_data['registration_date'],
+            division_code,
+            district_code
+        ))
+
+        donor_id = cursor.lastrowid
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        logger.info(f"Donor saved successfully with ID: {donor_id}")
+        return donor_id
+    except Exception as e:
+        logger.error(f"Error saving donor: {e}")
+        if "UNIQUE constraint failed" in str(e):
+            logger.error(f"Duplicate donor Telegram ID: {donor_data.get('telegram_id')}")
+        return None
+
+def _fetch_one(query, params, error_message):
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = _dict_row
+
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+
+        cursor.close()
+        conn.close()
+
+        return row
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        return None
+
+def _fetch_all(query, params, error_message):
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = _dict_row
+
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+        cursor.close()
+        conn.close()
+
+        return rows
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        return []
+
+def _execute(query, params, error_message):
+    """Run one write statement. Returns the affected row count, None on error."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(query, params)
+        rowcount = cursor.rowcount
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return rowcount
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        return None
+
+def get_donor_by_telegram_id(telegram_id):
+    """Get donor information by Telegram ID."""
+    return _fetch_one('SELECT * FROM donors WHERE telegram_id = ?', (telegram_id,), "Error getting donor")
+
+def get_donor_by_id(donor_id):
+    """Get donor information by ID."""
+    return _fetch_one('SELECT * FROM donors WHERE id = ?', (donor_id,), "Error getting donor")
+
+def update_donor(donor_id, update_data):
+    """Update donor information."""
+    sql_parts = [f"{key} = ?" for key in update_data]
+    values = list(update_data.values()) + [donor_id]
+    return _execute(f"UPDATE donors SET {', '.join(sql_parts)} WHERE id = ?", values,
+                    "Error updating donor") is not None
+
+def get_all_donors(reachable_only=False):
+    """Get all registered donors, optionally skipping donors marked unreachable."""
+    condition = 'WHERE is_unreachable IS NOT 1' if reachable_only else ''
+    return _fetch_all(f'SELECT * FROM donors {condition} ORDER BY registration_date DESC', (),
+                      "Error getting all donors")
+
+def search_donors(search_term):
+    """Search for donors by name, blood group, or location."""
+    search_pattern = f"%{search_term}%"
+    # SQLite's LIKE is already case-insensitive for ASCII
+    return _fetch_all('''
+    SELECT * FROM donors
+    WHERE name LIKE ? OR blood_group LIKE ? OR district LIKE ? OR division LIKE ? OR phone LIKE ?
+    ORDER BY registration_date DESC
+    ''', (search_pattern,) * 5, "Error searching donors")
+
+def get_donors_by_blood_groups(blood_groups, reachable_only=False):
+    """Get donors with specific blood groups, optionally skipping donors marked unreachable."""
+    query = f'SELECT * FROM donors WHERE blood_group IN ({_placeholders(blood_groups)})'
+    if reachable_only:
+        query += ' AND is_unreachable IS NOT 1'
+    return _fetch_all(query, list(blood_groups), "Error getting donors by blood groups")
+
+def get_donor_index_rows():
+    """Get the donor columns needed to build the matching index."""
+    return _fetch_all('''
+    SELECT id, telegram_id, blood_group, division, district, division_code, district_code,
+           is_restricted, is_unreachable, last_donation_at
+    FROM donors
+    ORDER BY id
+    ''', (), "Error getting donor index rows")
+
+def delete_donor(donor_id):
+    """Delete a donor from the database."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT telegram_id FROM donors WHERE id = ?', (donor_id,))
+        deleted = cursor.fetchone()
+        cursor.execute('DELETE FROM donors WHERE id = ?', (donor_id,))
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        if deleted:
+            after_commit(lambda: _restricted_telegram_ids.discard(deleted[0]))
+
+        return True
+    except Exception as e:
+        print(f"Error deleting donor: {e}")
+        return False
+
+def update_donor_restriction(donor_id, is_restricted):
+    """Update donor restriction status."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('UPDATE donors SET is_restricted = ? WHERE id = ?', (bool(is_restricted), donor_id))
+        cursor.execute('SELECT telegram_id FROM donors WHERE id = ?', (donor_id,))
+        updated = cursor.fetchone()
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        if updated:
+            # Only once committed, a rolled back session must leave the set as it was
+            if is_restricted:
+                after_commit(lambda: _restricted_telegram_ids.add(updated[0]))
+            else:
+                after_commit(lambda: _restricted_telegram_ids.discard(updated[0]))
+
+        return True
+    except Exception as e:
+        print(f"Error updating donor restriction: {e}")
+        return False
+
+def load_restricted_telegram_ids():
+    """Load the Telegram IDs of all restricted donors into memory."""
+    rows = _fetch_all('SELECT telegram_id FROM donors WHERE is_restricted = 1', (),
+                      "Error loading restricted users")
+    _restricted_telegram_ids.clear()
+    _restricted_telegram_ids.update(row['telegram_id'] for row in rows)
+    logger.info(f"Loaded {len(rows)} restricted users")
+    return True
+
+def is_telegram_id_restricted(telegram_id):
+    """Check the in-memory restricted set; no database round trip."""
+    return telegram_id in _restricted_telegram_ids
+
+def mark_donor_unreachable(donor_id):
+    """Flag a donor whose Telegram chat permanently rejects messages."""
+    return _execute('''
+    UPDATE donors
+    SET is_unreachable = 1, unreachable_at = ?
+    WHERE id = ? AND is_unreachable IS NOT 1
+    ''', (datetime.now(), donor_id), "Error marking donor unreachable") is not None
+
+def mark_donor_reachable(telegram_id):
+    """Clear the unreachable flag once a donor talks to the bot again. Returns True if it was set."""
+    updated = _execute('''
+    UPDATE donors
+    SET is_unreachable = 0, unreachable_at = NULL
+    WHERE telegram_id = ? AND is_unreachable = 1
+    ''', (telegram_id,), "Error marking donor reachable")
+    return bool(updated)
+
+def get_donor_stats(donor_id):
+    """Get statistics for a specific donor."""
+    stats = _fetch_one(f'''
+    SELECT
+        COUNT(*) AS total_donations,
+        COALESCE(SUM(status = 'completed'), 0) AS fulfilled_donations,
+        COALESCE(SUM(status = 'pending'), 0) AS pending_donations
+    FROM {ALL_DONATIONS} AS don
+    WHERE donor_id = ?
+    ''', (donor_id,), "Error getting donor stats")
+    rank = _fetch_one(f'''
+    WITH donor_ranks AS (
+        SELECT d.id, RANK() OVER (ORDER BY COUNT(don.id) DESC) AS donor_rank
+        FROM donors d
+        LEFT JOIN {ALL_DONATIONS} AS don ON d.id = don.donor_id
+        GROUP BY d.id
+    )
+    SELECT donor_rank FROM donor_ranks WHERE id = ?
+    ''', (donor_id,), "Error getting donor rank")
+
+    return {
+        'total_donations': stats['total_donations'] if stats else 0,
+        'fulfilled_donations': stats['fulfilled_donations'] if stats else 0,
+        'pending_donations': stats['pending_donations'] if stats else 0,
+        'donor_rank': rank['donor_rank'] if rank else None
+    }
+
+def get_top_donors(limit=10, period=None):
+    """Get top donors by donation count."""
+    # Summed from the monthly rollup instead of counting donations
+    time_condition = ""
+    params = ()
+    date_range = period_range(period)
+    if date_range:
+        time_condition = "WHERE m.month >= ? AND m.month < ?"
+        params = tuple(f"{bound:%Y-%m-%d}" for bound in date_range)
+
+    return _fetch_all(f'''
+    SELECT d.id, d.name, d.blood_group, SUM(m.donation_count) AS donation_count
+    FROM donor_monthly_donations m
+    JOIN donors d ON d.id = m.donor_id
+    {time_condition}
+    GROUP BY d.id, d.name, d.blood_group
+    HAVING SUM(m.donation_count) > 0
+    ORDER BY donation_count DESC
+    LIMIT ?
+    ''', (*params, limit), "Error getting top donors")
+
+# Staged import rows inserted per executemany call
+DONOR_IMPORT_BATCH_SIZE = 5000
+
+# Columns of the rows import_donors takes, in order
+DONOR_IMPORT_COLUMNS = ('line', 'telegram_id', 'name', 'age', 'phone', 'district', 'division', 'area', 'blood_group',
+                        'gender', 'division_code', 'district_code')
+
+# A stored phone number without the separators people type into it
+NORMALIZED_PHONE_SQL = "REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(phone, ' ', ''), '-', ''), '(', ''), ')', ''), '.', '')"
+
+def import_donors(rows):
+    """Upsert validated donor rows (tuples in DONOR_IMPORT_COLUMNS order) in one transaction.
+
+    Rows are staged in a temporary table in batches, then matched to donors
+    by Telegram ID, or by phone number for rows without one, and applied with
+    one UPDATE and one INSERT. Rows without a Telegram ID can only update an
+    existing donor. Returns {'inserted', 'updated', 'errors': [(line, message)]},
+    None on error.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DROP TABLE IF EXISTS temp.donor_import')
+        cursor.execute('''
+        CREATE TEMP TABLE donor_import (
+            line INTEGER PRIMARY KEY,
+            telegram_id INTEGER,
+            name TEXT,
+            age TEXT,
+            phone TEXT,
+            district TEXT,
+            division TEXT,
+            area TEXT,
+            blood_group TEXT,
+            gender TEXT,
+            division_code INTEGER,
+            district_code INTEGER,
+            donor_id INTEGER,
+            error TEXT
+        )
+        ''')
+        insert = (f"INSERT INTO donor_import ({', '.join(DONOR_IMPORT_COLUMNS)}) "
+                  f"VALUES ({_placeholders(DONOR_IMPORT_COLUMNS)})")
+        for batch in iter(lambda: list(islice(rows, DONOR_IMPORT_BATCH_SIZE)), []):
+            cursor.executemany(insert, batch)
+        # Without it the phone match below compares every donor with every staged row
+        cursor.execute('CREATE INDEX temp.idx_donor_import_phone ON donor_import (phone)')
+
+        cursor.execute('''
+        UPDATE donor_import SET donor_id = d.id
+        FROM donors d
+        WHERE d.telegram_id = donor_import.telegram_id
+        ''')
+        cursor.execute(f'''
+        WITH phones AS (
+            SELECT {NORMALIZED_PHONE_SQL} AS phone, MIN(id) AS donor_id, COUNT(*) AS donors
+            FROM donors
+            GROUP BY 1
+        )
+        UPDATE donor_import
+        SET donor_id = CASE WHEN phones.donors = 1 THEN phones.donor_id END,
+            error = CASE WHEN phones.donors > 1 THEN 'phone number belongs to ' || phones.donors || ' donors' END
+        FROM phones
+        WHERE donor_import.telegram_id IS NULL AND phones.phone = donor_import.phone
+        ''')
+        cursor.execute('''
+        UPDATE donor_import
+        SET error = 'no donor has this phone number, new donors need a Telegram ID'
+        WHERE telegram_id IS NULL AND donor_id IS NULL AND error IS NULL
+        ''')
+        cursor.execute('''
+        UPDATE donor_import
+        SET donor_id = NULL, error = 'phone number belongs to the donor on line ' || other.line
+        FROM donor_import AS other
+        WHERE donor_import.telegram_id IS NULL AND other.telegram_id IS NOT NULL
+        AND other.donor_id = donor_import.donor_id
+        ''')
+        cursor.execute('SELECT line, error FROM donor_import WHERE error IS NOT NULL ORDER BY line')
+        errors = cursor.fetchall()
+
+        cursor.execute('''
+        UPDATE donors
+        SET name = s.name, age = COALESCE(s.age, donors.age), phone = COALESCE(s.phone, donors.phone),
+            district = s.district, division = s.division, area = COALESCE(s.area, donors.area),
+            blood_group = s.blood_group, gender = COALESCE(s.gender, donors.gender),
+            division_code = s.division_code, district_code = s.district_code
+        FROM donor_import s
+        WHERE s.donor_id = donors.id AND s.error IS NULL
+        ''')
+        updated = cursor.rowcount
+        cursor.execute('''
+        INSERT INTO donors (
+            telegram_id, name, age, phone, district, division, area, blood_group, gender, registration_date,
+            division_code, district_code
+        )
+        SELECT telegram_id, name, age, phone, district, division, area, blood_group, gender, ?,
+            division_code, district_code
+        FROM donor_import
+        WHERE donor_id IS NULL AND error IS NULL
+        ORDER BY line
+        ''', (datetime.now(),))
+        inserted = cursor.rowcount
+        cursor.execute('DROP TABLE temp.donor_import')
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return {'inserted': inserted, 'updated': updated, 'errors': errors}
+    except Exception as e:
+        print(f"Error importing donors: {e}")
+        return None
+
+# Request functions
+def save_request(request_data):
+    """Save a new blood request to the database."""
+    try:
+        logger.info(f"Saving blood request: {request_data['name']} (Blood Group: {request_data['blood_group']})")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        division_code, district_code = get_location_codes(request_data['division'], request_data['district'])
+
+        cursor.execute('''
+        INSERT INTO requests (
+            telegram_id, name, age, hospital_name, hospital_address,
+            area, division, district, urgency, phone, blood_group, request_date, status,
+            division_code, district_code
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            request_data['telegram_id'],
+            request_data['name'],
+            request_data['age'],
+            request_data['hospital_name'],
+            request_data['hospital_address'],
+            request_data['area'],
+            request_data['division'],
+            request_data['district'],
+            request_data['urgency'],
+            request_data['phone'],
+            request_data['blood_group'],
+            request_data['request_date'],
+            request_data['status'],
+            division_code,
+            district_code
+        ))
+
+        request_id = cursor.lastrowid
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        logger.info(f"Blood request saved successfully with ID: {request_id}")
+        return request_id
+    except Exception as e:
+        logger.error(f"Error saving request: {e}")
+        return None
+
+def get_request_by_id(request_id):
+    """Get request information by ID."""
+    return _fetch_one('SELECT * FROM requests WHERE id = ?', (request_id,), "Error getting request")
+
+def get_active_requests():
+    """Get all active blood requests."""
+    return _fetch_all('''
+    SELECT * FROM requests
+    WHERE status = 'active'
+    ORDER BY request_date DESC
+    ''', (), "Error getting active requests")
+
+def get_requests_by_location(division, district=None):
+    """Get active requests by location."""
+    division_code, district_code = get_location_codes(division, district)
+
+    if district and district_code is not None:
+        condition, params = 'district_code = ?', (district_code,)
+    elif district:
+        # Unrecognised district name, fall back to comparing the text
+        condition, params = 'lower(division) = lower(?) AND lower(district) = lower(?)', (division, district)
+    elif division_code is not None:
+        condition, params = 'division_code = ?', (division_code,)
+    else:
+        condition, params = 'lower(division) = lower(?)', (division,)
+
+    return _fetch_all(f'''
+    SELECT * FROM requests
+    WHERE status = 'active' AND {condition}
+    ORDER BY request_date DESC
+    ''', params, "Error getting requests by location")
+
+def update_request_status(request_id, status):
+    """Update the status of a request."""
+    return _execute('UPDATE requests SET status = ? WHERE id = ?', (status, request_id),
+                    "Error updating request status") is not None
+
+def update_request_field(request_id, field, value):
+    """Update a specific field in a request."""
+    return _execute(f"UPDATE requests SET {field} = ? WHERE id = ?", (value, request_id),
+                    "Error updating request field") is not None
+
+def update_request_notified_donors(request_id, donor_ids):
+    """Update the list of notified donors for a request."""
+    donor_ids_str = ','.join(str(id) for id in donor_ids)
+    return _execute('UPDATE requests SET notified_donors = ? WHERE id = ?', (donor_ids_str, request_id),
+                    "Error updating notified donors") is not None
+
+def delete_request(request_id):
+    """Delete a request from the database."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        SELECT donor_id, acceptance_date FROM donations
+        WHERE request_id = ? AND status = 'completed'
+        ''', (request_id,))
+        _count_completed_donations(cursor, cursor.fetchall(), -1)
+
+        # First delete related donations, then the request
+        cursor.execute('DELETE FROM donations WHERE request_id = ?', (request_id,))
+        cursor.execute('DELETE FROM requests WHERE id = ?', (request_id,))
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"Error deleting request: {e}")
+        return False
+
+# Request lifecycle functions
+ARCHIVED_REQUEST_COLUMNS = ('id, telegram_id, name, age, hospital_name, hospital_address, area, division, district, '
+                            'urgency, phone, blood_group, request_date, status, notified_donors, '
+                            'division_code, district_code')
+ARCHIVED_DONATION_COLUMNS = 'id, request_id, donor_id, status, acceptance_date, completion_date, notes'
+
+# Live and archived donations, so donor history survives archival
+ALL_DONATIONS = '''(
+    SELECT id, donor_id, status, acceptance_date FROM donations
+    UNION ALL
+    SELECT id, donor_id, status, acceptance_date FROM donations_archive
+)'''
+
+def expire_stale_requests(cutoffs, default_cutoff, limit=500):
+    """Mark up to `limit` active requests older than their urgency's cutoff as expired.
+
+    cutoffs maps a lower-case urgency to the oldest request_date that stays
+    active; other urgencies use default_cutoff. Returns the expired request IDs.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cutoff_sql = '?'
+        params = []
+        if cutoffs:
+            cutoff_sql = f"CASE lower(trim(urgency)) {' '.join(['WHEN ? THEN ?'] * len(cutoffs))} ELSE ? END"
+            params = [value for cutoff in cutoffs.items() for value in cutoff]
+
+        cursor.execute(f'''
+        SELECT id FROM requests
+        WHERE status = 'active' AND request_date < {cutoff_sql}
+        ORDER BY request_date
+        LIMIT ?
+        ''', (*params, default_cutoff, limit))
+        expired_ids = [row[0] for row in cursor.fetchall()]
+
+        if expired_ids:
+            cursor.execute(f'''
+            UPDATE requests SET status = 'expired'
+            WHERE id IN ({_placeholders(expired_ids)}) AND status = 'active'
+            ''', expired_ids)
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return expired_ids
+    except Exception as e:
+        print(f"Error expiring stale requests: {e}")
+        return []
+
+def archive_closed_requests(closed_before, limit=500):
+    """Move up to `limit` closed requests dated before closed_before, with their donations, to the archive tables.
+
+    Returns how many requests were archived, None on error.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        SELECT id FROM requests
+        WHERE status IN ('fulfilled', 'inactive', 'expired') AND request_date < ?
+        ORDER BY id
+        LIMIT ?
+        ''', (closed_before, limit))
+        request_ids = [row[0] for row in cursor.fetchall()]
+
+        if request_ids:
+            batch = _placeholders(request_ids)
+            archived_at = datetime.now()
+            cursor.execute(f'''
+            INSERT INTO donations_archive ({ARCHIVED_DONATION_COLUMNS}, archived_at)
+            SELECT {ARCHIVED_DONATION_COLUMNS}, ? FROM donations WHERE request_id IN ({batch})
+            ''', (archived_at, *request_ids))
+            cursor.execute(f'DELETE FROM donations WHERE request_id IN ({batch})', request_ids)
+            cursor.execute(f'''
+            INSERT INTO requests_archive ({ARCHIVED_REQUEST_COLUMNS}, archived_at)
+            SELECT {ARCHIVED_REQUEST_COLUMNS}, ? FROM requests WHERE id IN ({batch})
+            ''', (archived_at, *request_ids))
+            cursor.execute(f'DELETE FROM requests WHERE id IN ({batch})', request_ids)
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return len(request_ids)
+    except Exception as e:
+        print(f"Error archiving closed requests: {e}")
+        return None
+
+# Donation functions
+def _count_completed_donations(cursor, donations, delta):
+    """Add delta to donor_monthly_donations for each (donor_id, acceptance_date) that entered or left 'completed'."""
+    for donor_id, accepted in donations:
+        if accepted is None:
+            continue
+        cursor.execute('''
+        INSERT INTO donor_monthly_donations (donor_id, month, donation_count) VALUES (?, ?, ?)
+        ON CONFLICT (donor_id, month) DO UPDATE SET donation_count = donation_count + excluded.donation_count
+        ''', (donor_id, f"{accepted:%Y-%m-01}", delta))
+
+def _set_donation_status(request_id, donor_id, status, error_message):
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        SELECT donor_id, acceptance_date FROM donations
+        WHERE request_id = ? AND donor_id = ? AND status = 'completed'
+        ''', (request_id, donor_id))
+        _count_completed_donations(cursor, cursor.fetchall(), -1)
+
+        cursor.execute('''
+        UPDATE donations
+        SET status = ?, acceptance_date = ?
+        WHERE request_id = ? AND donor_id = ?
+        ''', (status, datetime.now(), request_id, donor_id))
+        if cursor.rowcount == 0:
+            cursor.execute('''
+            INSERT INTO donations (request_id, donor_id, status, acceptance_date)
+            VALUES (?, ?, ?, ?)
+            ''', (request_id, donor_id, status, datetime.now()))
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        return False
+
+def add_donor_to_request(request_id, donor_id):
+    """Add a donor to a request (donor accepts a blood request)."""
+    return _set_donation_status(request_id, donor_id, 'pending', "Error adding donor to request")
+
+def add_donor_to_declined_request(request_id, donor_id):
+    """Record that a donor declined a request."""
+    return _set_donation_status(request_id, donor_id, 'declined', "Error recording declined request")
+
+def complete_request_donations(request_id):
+    """Mark a request's pending donations as completed and record each donor's donation date."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        completed_at = datetime.now()
+        cursor.execute('''
+        SELECT donor_id, acceptance_date FROM donations
+        WHERE request_id = ? AND status = 'pending'
+        ''', (request_id,))
+        completed = cursor.fetchall()
+        donor_ids = [row[0] for row in completed]
+
+        if donor_ids:
+            cursor.execute('''
+            UPDATE donations
+            SET status = 'completed', completion_date = ?
+            WHERE request_id = ? AND status = 'pending'
+            ''', (completed_at, request_id))
+            _count_completed_donations(cursor, completed, 1)
+            cursor.execute(f'''
+            UPDATE donors
+            SET last_donation_at = ?
+            WHERE id IN ({_placeholders(donor_ids)}) AND (last_donation_at IS NULL OR last_donation_at < ?)
+            ''', (completed_at, *donor_ids, completed_at))
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return donor_ids
+    except Exception as e:
+        print(f"Error completing request donations: {e}")
+        return []
+
+def count_request_acceptances(request_id):
+    """Count donors who accepted a request and have not dropped out."""
+    row = _fetch_one('''
+    SELECT COUNT(*) AS acceptances FROM donations
+    WHERE request_id = ? AND status IN ('pending', 'completed')
+    ''', (request_id,), "Error counting request acceptances")
+    return row['acceptances'] if row else 0
+
+def get_recent_donor_notifications(since):
+    """Get (request_id, donor_id, sent_at) rows for notifications sent since a given time."""
+    rows = _fetch_all('''
+    SELECT request_id, donor_id, sent_at FROM donor_notifications
+    WHERE sent_at >= ?
+    ORDER BY sent_at
+    ''', (since,), "Error getting recent donor notifications")
+    return [(row['request_id'], row['donor_id'], row['sent_at']) for row in rows]
+
+def save_donor_notifications(notifications):
+    """Bulk insert (request_id, donor_id, sent_at) notification rows, ignoring duplicates."""
+    try:
+        conn = get_db_connection()
+        conn.executemany('''
+        INSERT INTO donor_notifications (request_id, donor_id, sent_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (request_id, donor_id) DO NOTHING
+        ''', notifications)
+        conn.commit()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"Error saving donor notifications: {e}")
+        return False
+
+# Columns of the nested 'request' and 'donor' records in get_recent_operations
+OPERATION_REQUEST_COLUMNS = ('id', 'name', 'blood_group', 'hospital_name', 'division', 'district', 'urgency', 'status')
+OPERATION_DONOR_COLUMNS = ('id', 'name', 'blood_group', 'division', 'district')
+
+def get_recent_operations(limit=10, offset=0):
+    """Get recent successful donation operations, newest first, skipping the first `offset`."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        request_columns = ', '.join(f'r.{column}' for column in OPERATION_REQUEST_COLUMNS)
+        donor_columns = ', '.join(f'dnr.{column}' for column in OPERATION_DONOR_COLUMNS)
+        cursor.execute(f'''
+        SELECT d.id, d.acceptance_date, {request_columns}, {donor_columns}
+        FROM donations d
+        JOIN requests r ON d.request_id = r.id
+        JOIN donors dnr ON d.donor_id = dnr.id
+        WHERE d.status IN ('pending', 'completed')
+        ORDER BY d.acceptance_date DESC
+        LIMIT ? OFFSET ?
+        ''', (limit, offset))
+
+        # Plain tuples in a known column order, sliced straight into the nested records
+        donor_start = 2 + len(OPERATION_REQUEST_COLUMNS)
+        operations = [
+            {
+                'id': row[0],
+                'operation_date': row[1],
+                'request': dict(zip(OPERATION_REQUEST_COLUMNS, row[2:donor_start])),
+                'donor': dict(zip(OPERATION_DONOR_COLUMNS, row[donor_start:]))
+            }
+            for row in cursor.fetchall()
+        ]
+
+        cursor.close()
+        conn.close()
+
+        return operations
+    except Exception as e:
+        print(f"Error getting recent operations: {e}")
+        return []
+
+# Rows fetched per round trip while exporting
+EXPORT_BATCH_SIZE = 1000
+
+def export_table(table, export_format, out):
+    """Stream every row of table, by id, to out.write() as CSV with a header row or as JSON lines.
+
+    Rows are read in batches of EXPORT_BATCH_SIZE, so the table is never held
+    in memory. table must be one of data_export.EXPORT_TABLES. Returns True on success.
+    """
+    import data_export
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'SELECT * FROM {table} ORDER BY id')
+        columns = [column[0] for column in cursor.description]
+        batches = iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), [])
+        data_export.write_rows(columns, batches, export_format, out)
+
+        cursor.close()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"Error exporting {table}: {e}")
+        return False
+
+def backup_tables(outputs):
+    """Write each (table, out) pair's rows to out.write() as CSV with a header row, all from one snapshot.
+
+    Runs on a pooled connection of its own, outside any session. In WAL mode
+    a read transaction sees the database as of its first read, so every table
+    is copied as of the same moment while the bot keeps writing.
+    Returns True on success.
+    """
+    import data_export
+    try:
+        conn = _checkout()
+        cursor = conn.cursor()
+
+        cursor.execute('BEGIN')
+        for table, out in outputs:
+            cursor.execute(f'SELECT * FROM {table}')
+            columns = [column[0] for column in cursor.description]
+            batches = iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), [])
+            data_export.write_rows(columns, batches, 'csv', out)
+
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"Error backing up tables: {e}")
+        return False
+
+def _restored_value(value, boolean):
+    # Empty CSV fields are NULLs; booleans arrive as COPY writes them ('t'/'f')
+    if value == '':
+        return None
+    if boolean:
+        return value.lower() in ('t', 'true', '1')
+    return value
+
+def restore_tables(sources):
+    """Load each (table, source) pair, source being CSV with a header row, in one transaction.
+
+    Every table must be empty. Returns {table: rows restored}, None on error.
+    """
+    try:
+        conn = _checkout()
+        cursor = conn.cursor()
+
+        cursor.execute('BEGIN')
+        restored = {}
+        for table, source in sources:
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table})')
+            if cursor.fetchone()[0]:
+                raise ValueError(f"{table} is not empty; restore only into an empty database")
+
+            reader = csv.reader(source)
+            columns = next(reader)
+            cursor.execute(f'PRAGMA table_info({table})')
+            booleans = {row[1] for row in cursor.fetchall() if row[2].upper() == 'BOOLEAN'}
+            flags = [column in booleans for column in columns]
+            insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({_placeholders(columns)})"
+            for batch in iter(lambda: list(islice(reader, EXPORT_BATCH_SIZE)), []):
+                cursor.executemany(insert, [[_restored_value(value, boolean) for value, boolean in zip(row, flags)]
+                                            for row in batch])
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            restored[table] = cursor.fetchone()[0]
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return restored
+    except Exception as e:
+        print(f"Error restoring tables: {e}")
+        return None
+
+def get_operations_stats():
+    """Get donation operation statistics."""
+    # One statement per count, so each can use its own index
+    queries = {
+        'total_donors': 'SELECT COUNT(*) FROM donors',
+        'total_requests': 'SELECT (SELECT COUNT(*) FROM requests) + (SELECT COUNT(*) FROM requests_archive)',
+        'active_requests': "SELECT COUNT(*) FROM requests WHERE status = 'active'",
+        'total_operations': f"SELECT COUNT(*) FROM {ALL_DONATIONS} AS don WHERE status IN ('pending', 'completed')",
+        'unreachable_donors': 'SELECT COUNT(*) FROM donors WHERE is_unreachable = 1'
+    }
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        stats = {}
+        for name, query in queries.items():
+            cursor.execute(query)
+            stats[name] = cursor.fetchone()[0]
+
+        cursor.close()
+        conn.close()
+
+        return stats
+    except Exception as e:
+        print(f"Error getting operations stats: {e}")
+        return {name: 0 for name in queries}
+
+# Telegram chat functions
+def get_telegram_chat(chat_id):
+    """Get the stored username/first name for a Telegram chat."""
+    return _fetch_one('SELECT * FROM telegram_chats WHERE chat_id = ?', (chat_id,), "Error getting Telegram chat")
+
+def save_telegram_chats(chats):
+    """Bulk upsert (chat_id, username, first_name, updated_at) rows."""
+    try:
+        conn = get_db_connection()
+        conn.executemany('''
+        INSERT INTO telegram_chats (chat_id, username, first_name, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (chat_id) DO UPDATE
+        SET username = excluded.username,
+            first_name = COALESCE(excluded.first_name, telegram_chats.first_name),
+            updated_at = excluded.updated_at
+        ''', chats)
+        conn.commit()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"Error saving Telegram chats: {e}")
+        return False
+
+# Persistence functions
+def load_persisted_data(kind):
+    """Get all stored 'user' or 'chat' data as {id: data}."""
+    table, id_column = {'user': ('persistence_user_data', 'user_id'),
+                        'chat': ('persistence_chat_data', 'chat_id')}[kind]
+    rows = _fetch_all(f'SELECT {id_column} AS id, data FROM {table}', (), f"Error loading persisted {kind} data")
+    return {row['id']: json.loads(row['data']) for row in rows}
+
+def load_persisted_conversations():
+    """Get every stored conversation state as {name: {key_json: state_json}}."""
+    conversations = {}
+    for row in _fetch_all('SELECT name, conversation_key, state FROM persistence_conversations', (),
+                          "Error loading persisted conversations"):
+        conversations.setdefault(row['name'], {})[row['conversation_key']] = row['state']
+    return conversations
+
+def save_persistence_batch(user_data, chat_data, conversations, dropped_users=(), dropped_chats=()):
+    """Write a batch of persistence changes in one transaction.
+
+    user_data/chat_data are (id, data_json) rows, conversations are
+    (name, key_json, state_json) rows where a None state deletes the row.
+    """
+    try:
+        conn = get_db_connection()
+        now = datetime.now()
+
+        conn.executemany('''
+        INSERT INTO persistence_user_data (user_id, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        ''', [(user_id, data, now) for user_id, data in user_data])
+        conn.executemany('''
+        INSERT INTO persistence_chat_data (chat_id, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (chat_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        ''', [(chat_id, data, now) for chat_id, data in chat_data])
+        conn.executemany('DELETE FROM persistence_user_data WHERE user_id = ?',
+                         [(user_id,) for user_id in dropped_users])
+        conn.executemany('DELETE FROM persistence_chat_data WHERE chat_id = ?',
+                         [(chat_id,) for chat_id in dropped_chats])
+        conn.executemany('''
+        INSERT INTO persistence_conversations (name, conversation_key, state, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (name, conversation_key) DO UPDATE
+        SET state = excluded.state, updated_at = excluded.updated_at
+        ''', [(name, key, state, now) for name, key, state in conversations if state is not None])
+        conn.executemany('DELETE FROM persistence_conversations WHERE name = ? AND conversation_key = ?',
+                         [(name, key) for name, key, state in conversations if state is None])
+
+        conn.commit()
+        conn.close()
+
+        return True
+    except Exception as e:
+        print(f"Error saving persistence batch: {e}")
+        return False
+
+# Support message functions
+def store_support_message(user_info, message):
+    """Store a support message from a user."""
+    user_name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip()
+    return _execute('''
+    INSERT INTO support_messages (user_id, user_name, message, created_at, status)
+    VALUES (?, ?, ?, ?, ?)
+    ''', (user_info.get('id'), user_name, message, datetime.now(), 'pending'),
+        "Error storing support message") is not None
+
+def get_support_messages():
+    """Get all support messages."""
+    return _fetch_all('SELECT * FROM support_messages ORDER BY created_at DESC', (),
+                      "Error getting support messages")
+
+def mark_support_messages_read():
+    """Mark all pending support messages as read. Returns how many were updated."""
+    return _execute('UPDATE support_messages SET status = ? WHERE status = ?', ('read', 'pending'),
+                    "Error marking support messages as read")
+
+def record_admin_reply(user_id, message):
+    """Record an admin reply to a user."""
+    return _execute('''
+    INSERT INTO admin_replies (admin_id, user_id, message, sent_at)
+    VALUES (?, ?, ?, ?)
+    ''', (os.getenv('ADMIN_ID', '0'), user_id, message, datetime.now()),
+        "Error recording admin reply") is not None
+
+# Broadcast message functions
+def _insert(query, params, error_message):
+    """Run one INSERT. Returns the new row id, None on error."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(query, params)
+        row_id = cursor.lastrowid
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        return row_id
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        return None
+
+def save_broadcast_message(admin_id, message_text, target_type='all'):
+    """Save a broadcast message sent by an admin."""
+    return _insert('''
+    INSERT INTO broadcast_messages (admin_id, message_text, target_type, sent_date)
+    VALUES (?, ?, ?, ?)
+    ''', (admin_id, message_text, target_type, datetime.now()), "Error saving broadcast message")
+
+def update_broadcast_recipient_count(broadcast_id, count):
+    """Update the recipient count for a broadcast message."""
+    return _execute('UPDATE broadcast_messages SET recipient_count = ? WHERE id = ?', (count, broadcast_id),
+                    "Error updating broadcast recipient count") is not None
+
+def get_recent_broadcasts(limit=10):
+    """Get recent broadcast messages."""
+    return _fetch_all('SELECT * FROM broadcast_messages ORDER BY sent_date DESC LIMIT ?', (limit,),
+                      "Error getting recent broadcasts")
+
+def delete_broadcast_message(broadcast_id):
+    """Delete a broadcast message. Returns True if a row was deleted."""
+    return bool(_execute('DELETE FROM broadcast_messages WHERE id = ?', (broadcast_id,),
+                         "Error deleting broadcast message"))
+
+def save_personalized_message(admin_id, user_id, message_text):
+    """Save a personalized message sent by an admin to a specific user."""
+    return _insert('''
+    INSERT INTO personalized_messages (admin_id, user_id, message_text, sent_date)
+    VALUES (?, ?, ?, ?)
+    ''', (admin_id, user_id, message_text, datetime.now()), "Error saving personalized message")
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database picks its backend from DATABASE_URL when first imported, so point it at
+# a throwaway SQLite file before any test module imports it
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='blood_bot_tests_'), 'test.db')}"
@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+from callback_router import CallbackRouter, NO_ROUTE
+
+
+def handler(name):
+    async def handle(update, context):
+        return name, context.args
+    return handle
+
+
+def make_router():
+    router = CallbackRouter('test')
+    router.add_exact('admin_settings', handler('settings'))
+    router.add_prefix('admin_', handler('admin'))
+    router.add_prefix('admin_donor_', handler('donor'), (int,))
+    router.add_prefix('accept_', handler('accept'), (int, int))
+    router.add_prefix('note_', handler('note'), (int, str))
+    return router
+
+
+def test_exact_route_wins_over_prefix():
+    route, handle, args = make_router().resolve('admin_settings')
+    assert route == 'admin_settings'
+    assert args == []
+
+
+def test_longest_prefix_wins():
+    route, _, args = make_router().resolve('admin_donor_42')
+    assert route == 'admin_donor_*'
+    assert args == [42]
+
+
+def test_unparsable_payload_falls_back_to_shorter_prefix():
+    route, _, args = make_router().resolve('admin_donor_abc')
+    assert route == 'admin_*'
+    assert args == []
+
+
+def test_arguments_are_split_and_converted():
+    assert make_router().resolve('accept_12_345')[2] == [12, 345]
+
+
+def test_wrong_argument_count_does_not_match():
+    assert make_router().resolve('accept_12') is None
+
+
+def test_last_argument_keeps_underscores():
+    assert make_router().resolve('note_7_hello_there')[2] == [7, 'hello_there']
+
+
+def test_unknown_data_does_not_match():
+    assert make_router().resolve('unknown') is None
+    assert make_router().resolve('') is None
+
+
+def test_dispatch_sets_args_and_records_metrics():
+    router = make_router()
+    context = SimpleNamespace(args=None)
+    update = SimpleNamespace(callback_query=SimpleNamespace(data='accept_1_2'))
+
+    assert asyncio.run(router.dispatch(update, context)) == ('accept', [1, 2])
+    assert router.metrics['accept_*']['calls'] == 1
+
+    update.callback_query.data = 'nothing'
+    assert asyncio.run(router.dispatch(update, context)) is NO_ROUTE
+    assert asyncio.run(router.dispatch(update, context, default=None)) is None
@@ -0,0 +1,64 @@
+import csv
+import gzip
+import io
+import json
+import random
+from data_export import SplitGzipWriter
+
+
+def read_part(path):
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as file:
+        return file.read()
+
+
+def chunks(data, rng):
+    position = 0
+    while position < len(data):
+        size = rng.randint(1, 200)
+        yield data[position:position + size]
+        position += size
+
+
+def test_csv_parts_split_between_records_and_repeat_the_header(tmp_path):
+    rng = random.Random(1)
+    header = ['id', 'note']
+    records = [[str(i), f"{rng.getrandbits(256):x}\nsecond line, \"quoted\""] for i in range(2000)]
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(records)
+
+    out = SplitGzipWriter(str(tmp_path), 'requests', 'csv', max_bytes=5000, csv_records=True)
+    for chunk in chunks(buffer.getvalue(), rng):
+        out.write(chunk)
+    paths = out.close()
+
+    assert len(paths) > 1
+    assert out.rows == len(records)
+    assert out.bytes == sum(path.stat().st_size for path in tmp_path.iterdir())
+    read_back = []
+    for path in paths:
+        rows = list(csv.reader(io.StringIO(read_part(path), newline='')))
+        assert rows[0] == header
+        read_back.extend(rows[1:])
+    assert read_back == records
+
+
+def test_jsonl_parts_have_no_header(tmp_path):
+    lines = [json.dumps({'id': i, 'value': f"{random.Random(i).getrandbits(512):x}"}) for i in range(300)]
+
+    out = SplitGzipWriter(str(tmp_path), 'donors', 'jsonl', max_bytes=3000)
+    out.write('\n'.join(lines))
+    paths = out.close()
+
+    assert len(paths) > 1
+    assert out.rows == len(lines)
+    assert [line for path in paths for line in read_part(path).splitlines()] == lines
+
+
+def test_empty_export_still_writes_one_part(tmp_path):
+    out = SplitGzipWriter(str(tmp_path), 'donations', 'csv', csv_records=True)
+    paths = out.close()
+    assert len(paths) == 1
+    assert out.rows == 0
+    assert read_part(paths[0]) == ''
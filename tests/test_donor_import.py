@@ -0,0 +1,99 @@
+import pytest
+import database as db
+import donor_import
+from donor_import import ImportFileError
+
+HEADER = ['Telegram ID', 'Full Name', 'Age', 'Mobile', 'Division', 'District', 'Area', 'Blood Type', 'Sex']
+
+
+def record(**fields):
+    return dict({'telegram_id': '', 'name': 'Rahim', 'age': '', 'phone': '01711000000', 'division': '',
+                 'district': 'Gazipur', 'area': '', 'blood_group': 'B+', 'gender': ''}, **fields)
+
+
+def test_header_aliases_are_mapped():
+    assert donor_import._map_header(HEADER) == {
+        'telegram_id': 0, 'name': 1, 'age': 2, 'phone': 3, 'division': 4, 'district': 5, 'area': 6,
+        'blood_group': 7, 'gender': 8
+    }
+
+
+def test_missing_required_columns_reject_the_file():
+    with pytest.raises(ImportFileError, match='district, blood_group, telegram_id or phone'):
+        donor_import._map_header(['name', 'age'])
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('a+', 'A+'), ('AB Positive', 'AB+'), ('O neg', 'O-'), ('b -ve', 'B-'), ('C+', None), ('', None)
+])
+def test_normalize_blood_group(value, expected):
+    assert donor_import.normalize_blood_group(value) == expected
+
+
+def test_normalize_phone_restores_dropped_leading_zero():
+    assert donor_import.normalize_phone('1711-000 000') == '01711000000'
+    assert donor_import.normalize_phone('+880 1711 000000') == '+8801711000000'
+
+
+def test_valid_row_is_normalized():
+    donor, error = donor_import.validate_row(record(telegram_id='42', blood_group='b positive', gender='f'))
+    assert error is None
+    assert donor[0] == 42
+    assert donor[4:8] == ('Gazipur', 'Dhaka', None, 'B+')
+    assert donor[8] == 'Female'
+
+
+@pytest.mark.parametrize('fields, error', [
+    ({'name': ''}, 'name is empty'),
+    ({'name': 'x' * 101}, 'name is longer than 100 characters'),
+    ({'blood_group': 'Z'}, "unknown blood group 'Z'"),
+    ({'district': 'Atlantis'}, "unknown district 'Atlantis'"),
+    ({'division': 'Sylhet'}, "Gazipur is not in division 'Sylhet'"),
+    ({'telegram_id': 'abc'}, "invalid Telegram ID 'abc'"),
+    ({'phone': '12'}, "invalid phone number '12'"),
+    ({'phone': ''}, 'needs a Telegram ID or a phone number'),
+])
+def test_invalid_rows_are_explained(fields, error):
+    assert donor_import.validate_row(record(**fields)) == (None, error)
+
+
+def test_validate_rows_skips_blank_lines_and_repeats():
+    columns = donor_import._map_header(HEADER)
+    rows = [
+        (2, ['1', 'A', '', '01711000001', '', 'Dhaka', '', 'A+', '']),
+        (3, ['', '', '', '', '', '', '', '', '']),
+        (4, ['1', 'B', '', '01711000002', '', 'Dhaka', '', 'A+', '']),
+        (5, ['', 'C', '', '01711000001', '', 'Dhaka', '', 'A+', '']),
+        (6, ['', 'D', '', '01711000003', '', 'Dhaka', '', 'Q', '']),
+        (7, ['2', 'E', '', '', '', 'Dhaka', '', 'O-', '']),
+    ]
+    report = {'rows': 0, 'errors': []}
+
+    valid = list(donor_import.validate_rows(rows, columns, report))
+
+    assert [row[0] for row in valid] == [2, 7]
+    assert report['rows'] == 5
+    assert report['errors'] == [(4, 'same telegram id as line 2'), (5, 'same phone as line 2'),
+                                (6, "unknown blood group 'Q'")]
+
+
+def test_import_file_inserts_updates_and_reports(tmp_path):
+    assert db.ensure_schema()
+    path = tmp_path / 'donors.csv'
+    path.write_text('\n'.join([
+        ','.join(HEADER),
+        '9001,Karim,30,01811000001,Dhaka,Dhaka,Mirpur,A+,m',
+        '9002,Salma,25,01811000002,,Comilla,,O-,F',
+        ',Nobody,,01811999999,,Dhaka,,A+,',
+        '9003,Bad,,,,Nowhere,,A+,',
+    ]), encoding='utf-8')
+
+    report = donor_import.import_file(str(path))
+    assert (report['rows'], report['inserted'], report['updated']) == (4, 2, 0)
+    assert [line for line, _ in report['errors']] == [4, 5]
+    assert db.get_donor_by_telegram_id(9002)['division'] == 'Chittagong'
+
+    path.write_text(','.join(HEADER) + '\n9001,Karim Uddin,31,01811000001,,Dhaka,,A+,m\n', encoding='utf-8')
+    report = donor_import.import_file(str(path))
+    assert (report['inserted'], report['updated'], report['errors']) == (0, 1, [])
+    assert db.get_donor_by_telegram_id(9001)['name'] == 'Karim Uddin'
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+import numpy as np
+import matching
+from matching import DonorIndex
+from locations import get_location_codes
+
+DHAKA = get_location_codes('Dhaka', 'Dhaka')
+
+
+def donor(donor_id, district='Dhaka', division='Dhaka', blood_group='A+', **fields):
+    division_code, district_code = get_location_codes(division, district)
+    return dict({'id': donor_id, 'telegram_id': 1000 + donor_id, 'blood_group': blood_group,
+                 'division_code': division_code, 'district_code': district_code, 'is_restricted': False,
+                 'is_unreachable': False, 'last_donation_at': None}, **fields)
+
+
+def ranked_ids(index, blood_group='A+', location=DHAKA):
+    positions, _, _ = index.rank(blood_group, *location)
+    return [index.donors[position]['id'] for position in positions.tolist()]
+
+
+def test_rank_keeps_compatible_blood_groups_only():
+    index = DonorIndex([donor(1, blood_group='A+'), donor(2, blood_group='O-'), donor(3, blood_group='B+'),
+                        donor(4, blood_group='AB+'), donor(5, blood_group='unknown')])
+    assert sorted(ranked_ids(index, 'A+')) == [1, 2]
+    assert sorted(ranked_ids(index, 'AB+')) == [1, 2, 3, 4]
+
+
+def test_rank_skips_restricted_donors_and_donors_without_telegram():
+    index = DonorIndex([donor(1), donor(2, is_restricted=True), donor(3, telegram_id=None)])
+    assert ranked_ids(index) == [1]
+
+
+def test_rank_puts_same_district_before_same_division_before_the_rest():
+    index = DonorIndex([donor(1, 'Rangpur', 'Rangpur'), donor(2, 'Gazipur', 'Dhaka'), donor(3)])
+    _, tiers, _ = index.rank('A+', *DHAKA)
+    assert ranked_ids(index) == [3, 2, 1]
+    assert tiers.tolist() == [matching.TIER_EXACT, matching.TIER_DIVISION, matching.TIER_BLOOD_ONLY]
+
+
+def test_unknown_request_location_ranks_by_blood_group_only():
+    ranked = DonorIndex([donor(1), donor(2, 'Comilla', 'Chittagong')]).ranked_donors('A+', None, None)
+    assert {entry[0]['id'] for entry in ranked} == {1, 2}
+    assert all(tier == matching.TIER_BLOOD_ONLY and distance is None for _, tier, distance in ranked)
+
+
+def test_rank_orders_by_distance_nearest_first():
+    index = DonorIndex([donor(1, 'Rangpur', 'Rangpur'), donor(2, 'Comilla', 'Chittagong'),
+                        donor(3, 'Gazipur', 'Dhaka'), donor(4), donor(5)])
+    _, _, distances = index.rank('A+', *DHAKA)
+    # Same distance keeps index order
+    assert ranked_ids(index) == [4, 5, 3, 2, 1]
+    assert distances.tolist() == sorted(distances.tolist())
+    assert distances[0] == 0
+
+
+def test_unknown_donor_district_comes_last():
+    index = DonorIndex([donor(1, district=None, division=None), donor(2, 'Rangpur', 'Rangpur')])
+    assert ranked_ids(index) == [2, 1]
+    assert index.ranked_donors('A+', *DHAKA)[1][2] is None
+
+
+def plan_index():
+    return DonorIndex([donor(1, 'Rangpur', 'Rangpur'), donor(2, 'Comilla', 'Chittagong'),
+                       donor(3, 'Gazipur', 'Dhaka'), donor(4), donor(10)])
+
+
+def test_escalation_plan_assigns_rings():
+    plan = plan_index().escalation_plan('A+', *DHAKA)
+    assert dict(zip(plan.donor_ids.tolist(), plan.rings.tolist())) == {
+        4: matching.RING_DISTRICT, 10: matching.RING_DISTRICT, 3: matching.RING_DIVISION,
+        2: matching.RING_NEIGHBOURING_DIVISIONS, 1: matching.RING_NATIONAL}
+    assert plan.ring_counts() == [2, 1, 1, 1]
+
+
+def test_select_wave_widens_the_ring_once_it_is_exhausted():
+    index = plan_index()
+    plan = index.escalation_plan('A+', *DHAKA)
+
+    wave, ring, _ = matching.select_wave(plan, index, matching.RING_DISTRICT, size=1)
+    assert [entry[0]['id'] for entry in wave] == [4] and ring == matching.RING_DISTRICT
+
+    plan.mark_done([10])
+    wave, ring, _ = matching.select_wave(plan, index, matching.RING_DISTRICT)
+    assert [entry[0]['id'] for entry in wave] == [3] and ring == matching.RING_DIVISION
+
+    plan.mark_done([1, 2])
+    wave, ring, _ = matching.select_wave(plan, index, matching.RING_DIVISION)
+    assert wave == [] and ring > matching.RING_NATIONAL
+
+
+def test_select_wave_takes_donors_from_the_current_index():
+    plan = plan_index().escalation_plan('A+', *DHAKA)
+    # Donor 4 was deleted and donor 10 changed since the plan was built
+    index = DonorIndex([donor(1, 'Rangpur', 'Rangpur'), donor(10, telegram_id=42)])
+    wave, ring, _ = matching.select_wave(plan, index, matching.RING_DISTRICT)
+    assert wave == [(index.donors[1], matching.TIER_EXACT, 0.0)] and ring == matching.RING_DISTRICT
+
+
+def test_select_wave_replaces_donors_no_longer_notifiable():
+    plan = plan_index().escalation_plan('A+', *DHAKA)
+    index = DonorIndex([donor(1, 'Rangpur', 'Rangpur'), donor(2, 'Comilla', 'Chittagong'),
+                        donor(3, 'Gazipur', 'Dhaka'), donor(4, is_restricted=True), donor(10, is_unreachable=True)])
+    wave, ring, dropped = matching.select_wave(plan, index, matching.RING_DIVISION, size=2)
+    assert [entry[0]['id'] for entry in wave] == [3] and ring == matching.RING_DIVISION and dropped == 2
+
+
+def test_notifiable_positions_drops_donors_no_longer_matched():
+    index = DonorIndex([donor(4), donor(6, is_restricted=True), donor(7, is_unreachable=True),
+                        donor(9, last_donation_at=datetime.now() - timedelta(days=10))])
+    positions = index.notifiable_positions(np.array([9, 4, 6, 7, 99, 1]))
+    assert positions.tolist() == [-1, 0, -1, -1, -1, -1]
+
+
+def test_donors_inside_the_deferral_window_are_skipped():
+    index = DonorIndex([
+        donor(1, last_donation_at=datetime.now() - timedelta(days=10)),
+        donor(2, last_donation_at=datetime.now() - timedelta(days=matching.DONATION_DEFERRAL_DAYS + 1)),
+        donor(3)
+    ])
+    assert ranked_ids(index) == [2, 3]
+
+
+def test_unreachable_donors_are_skipped():
+    index = DonorIndex([donor(1, is_unreachable=True), donor(2)])
+    assert ranked_ids(index) == [2]
@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+from datetime import datetime
+import pytest
+import database as db
+import async_db as adb
+import matching
+from storage_session import after_commit, call_in_savepoint, current_session
+
+
+def donor(telegram_id):
+    return {'telegram_id': telegram_id, 'name': f"Donor {telegram_id}", 'age': '30', 'phone': f"0171{telegram_id:07d}",
+            'district': 'Dhaka', 'division': 'Dhaka', 'area': 'Mirpur', 'blood_group': 'A+', 'gender': 'Male',
+            'registration_date': datetime.now()}
+
+
+def outside_session(func, *args):
+    """Call func on a connection of its own, as another unit of work would."""
+    return contextvars.Context().run(func, *args)
+
+
+def stored_names():
+    return sorted(row['name'] for row in outside_session(db.get_all_donors))
+
+
+@pytest.fixture(autouse=True)
+def no_donors():
+    assert db.ensure_schema()
+    conn = db.get_db_connection()
+    conn.execute('DELETE FROM donors')
+    conn.commit()
+    conn.close()
+    db.load_restricted_telegram_ids()
+
+
+def test_session_commits_when_it_ends():
+    with db.session():
+        db.save_donor(donor(1))
+        db.save_donor(donor(2))
+        assert stored_names() == []
+        assert len(db.get_all_donors()) == 2
+    assert stored_names() == ['Donor 1', 'Donor 2']
+
+
+def test_failed_session_rolls_back():
+    with db.session() as session:
+        db.save_donor(donor(1))
+        session.failed = True
+    assert stored_names() == []
+
+
+def test_exception_rolls_back_the_session():
+    with pytest.raises(RuntimeError):
+        with db.session():
+            db.save_donor(donor(1))
+            raise RuntimeError('handler failed')
+    assert stored_names() == []
+
+
+def test_failed_write_fails_the_session():
+    with db.session() as session:
+        assert db.save_donor(donor(1))
+        # Duplicate Telegram ID: the backend logs the error and returns None
+        assert db.save_donor(donor(1)) is None
+        assert session.failed
+        assert db.save_donor(donor(2))
+    assert stored_names() == []
+
+
+def test_failed_read_does_not_undo_the_rest_of_the_session():
+    def fail_to_read():
+        try:
+            db.get_db_connection().execute('SELECT no_such_column FROM donors')
+        except Exception:
+            return None
+
+    with db.session() as session:
+        db.save_donor(donor(1))
+        call_in_savepoint(session, fail_to_read)
+        db.save_donor(donor(2))
+        assert not session.failed
+    assert stored_names() == ['Donor 1', 'Donor 2']
+
+
+def test_call_that_raises_only_undoes_its_own_writes():
+    def rename_then_fail():
+        conn = db.get_db_connection()
+        conn.execute("UPDATE donors SET name = 'Renamed'")
+        conn.execute('SELECT no_such_column FROM donors')
+
+    with db.session() as session:
+        db.save_donor(donor(1))
+        with pytest.raises(Exception, match='no_such_column'):
+            call_in_savepoint(session, rename_then_fail)
+        assert session.savepoints == []
+    assert stored_names() == ['Donor 1']
+
+
+def test_uncommitted_call_writes_are_rolled_back():
+    def rename_without_commit():
+        db.get_db_connection().execute("UPDATE donors SET name = 'Renamed'")
+
+    with db.session() as session:
+        db.save_donor(donor(1))
+        call_in_savepoint(session, rename_without_commit)
+    assert stored_names() == ['Donor 1']
+
+
+def test_nested_session_rolls_back_to_its_savepoint():
+    with db.session():
+        db.save_donor(donor(1))
+        with pytest.raises(RuntimeError):
+            with db.session():
+                db.save_donor(donor(2))
+                raise RuntimeError('inner block failed')
+        db.save_donor(donor(3))
+    assert stored_names() == ['Donor 1', 'Donor 3']
+
+
+def test_restriction_changes_follow_the_commit():
+    donor_id = db.save_donor(donor(1))
+
+    with db.session() as session:
+        db.update_donor_restriction(donor_id, True)
+        assert not db.is_telegram_id_restricted(1)
+        session.failed = True
+    assert not db.is_telegram_id_restricted(1)
+
+    with db.session():
+        db.update_donor_restriction(donor_id, True)
+        assert not db.is_telegram_id_restricted(1)
+    assert db.is_telegram_id_restricted(1)
+
+
+def test_donor_index_is_dropped_only_after_commit():
+    matching.get_donor_index()
+    with db.session():
+        db.save_donor(donor(1))
+        matching.invalidate_donor_index()
+        assert matching._donor_index is not None
+    assert matching._donor_index is None
+    assert len(matching.get_donor_index()) == 1
+
+
+def test_on_commit_callbacks_of_a_rolled_back_savepoint_are_dropped():
+    calls = []
+    with db.session() as session:
+        with pytest.raises(RuntimeError):
+            with db.session():
+                after_commit(lambda: calls.append('inner'))
+                raise RuntimeError('inner block failed')
+        after_commit(lambda: calls.append('outer'))
+        assert calls == []
+        assert len(session.commit_callbacks) == 1 and not session.failed
+    assert calls == ['outer']
+
+
+def test_commit_in_the_middle_of_an_async_session():
+    async def unit_of_work():
+        async with adb.session() as session:
+            await adb.save_donor(donor(1))
+            await adb.commit()
+            assert session.conn is None
+            assert stored_names() == ['Donor 1']
+
+            await adb.save_donor(donor(2))
+            session.failed = True
+
+    asyncio.run(unit_of_work())
+    assert stored_names() == ['Donor 1']
+
+
+def test_background_task_runs_outside_the_session():
+    async def current():
+        return current_session.get()
+
+    async def unit_of_work():
+        async with adb.session() as session:
+            inherited = await asyncio.create_task(current())
+            detached = await asyncio.create_task(adb.outside_session(current()))
+            return session, inherited, detached
+
+    session, inherited, detached = asyncio.run(unit_of_work())
+    assert inherited is session
+    assert detached is None
+
+
+def test_concurrent_sessions_that_read_then_write_all_commit():
+    async def unit_of_work(telegram_id):
+        async with adb.session():
+            await adb.get_all_donors()
+            await asyncio.sleep(0)
+            assert await adb.save_donor(donor(telegram_id))
+
+    async def main():
+        await asyncio.gather(*(unit_of_work(telegram_id) for telegram_id in range(1, 9)))
+
+    asyncio.run(main())
+    assert len(stored_names()) == 8
+
+
+def test_outside_session_awaited_inline_restores_the_session():
+    async def current():
+        return current_session.get()
+
+    async def unit_of_work():
+        async with adb.session() as session:
+            detached = await adb.outside_session(current())
+            return session, detached, current_session.get()
+
+    session, detached, after = asyncio.run(unit_of_work())
+    assert detached is None
+    assert after is session